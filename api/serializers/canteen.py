@@ -1,7 +1,7 @@
 import logging
 from rest_framework import serializers
 from drf_base64.fields import Base64ImageField
-from data.models import Canteen, Sector, CanteenImage, Diagnostic
+from data.models import Canteen, Sector, CanteenImage, Diagnostic, PublicCanteenCard
 from django.conf import settings
 from .diagnostic import PublicDiagnosticSerializer, FullDiagnosticSerializer, CentralKitchenDiagnosticSerializer
 from .diagnostic import ApproDiagnosticSerializer
@@ -104,11 +104,31 @@ class BadgesSerializer(serializers.ModelSerializer):
         )
 
 
+class PublicCanteenCardBadgesSerializer(serializers.ModelSerializer):
+    year = serializers.IntegerField(source="latest_published_year")
+    appro = serializers.BooleanField(source="appro_badge")
+    waste = serializers.BooleanField(source="waste_badge")
+    diversification = serializers.BooleanField(source="diversification_badge")
+    plastic = serializers.BooleanField(source="plastic_badge")
+    info = serializers.BooleanField(source="info_badge")
+
+    class Meta:
+        model = PublicCanteenCard
+        fields = (
+            "year",
+            "appro",
+            "waste",
+            "diversification",
+            "plastic",
+            "info",
+        )
+
+
 class PublicCanteenPreviewSerializer(serializers.ModelSerializer):
-    sectors = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
-    badges = BadgesSerializer(read_only=True, source="*")
-    appro_diagnostic = PublicApproDiagnosticSerializer(read_only=True, source="latest_published_appro_diagnostic")
-    lead_image = CanteenImageSerializer()
+    sectors = serializers.ListField(child=serializers.IntegerField(), read_only=True, source="card.sector_ids")
+    badges = PublicCanteenCardBadgesSerializer(read_only=True, source="card")
+    appro_diagnostic = serializers.JSONField(read_only=True, source="card.appro_diagnostic")
+    lead_image = CanteenImageSerializer(read_only=True, source="card.lead_image")
 
     class Meta:
         model = Canteen
@@ -145,7 +165,7 @@ class PublicCanteenSerializer(serializers.ModelSerializer):
     logo = Base64ImageField(required=False, allow_null=True)
     images = MediaListSerializer(child=CanteenImageSerializer(), read_only=True)
     is_managed_by_user = serializers.SerializerMethodField(read_only=True)
-    badges = BadgesSerializer(read_only=True, source="*")
+    badges = PublicCanteenCardBadgesSerializer(read_only=True, source="card")
 
     class Meta:
         model = Canteen
@@ -184,6 +184,9 @@ class PurchasePercentageSummarySerializer(PurchaseSummarySerializer):
 
 class PurchaseExportSerializer(serializers.ModelSerializer):
     canteen = serializers.SlugRelatedField(read_only=True, slug_field="name")
+    # Native values so that the spreadsheet cells are typed as dates and numbers
+    date = serializers.DateField(format=None, read_only=True)
+    price_ht = serializers.DecimalField(max_digits=20, decimal_places=2, coerce_to_string=False, read_only=True)
 
     class Meta:
         model = Purchase
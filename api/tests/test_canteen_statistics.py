@@ -1,3 +1,8 @@
+import io
+from unittest.mock import patch
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import transaction
 from django.test.utils import override_settings
 from django.urls import reverse
 from rest_framework.test import APITestCase
@@ -6,9 +11,10 @@ import requests_mock
 from data.department_choices import Department
 from data.factories import CanteenFactory, SectorFactory
 from data.factories import DiagnosticFactory
-from data.models import Canteen, Diagnostic, Sector
-from api.views.canteen import badges_for_queryset
+from data.models import Canteen, CanteenStatisticsCell, Diagnostic, Sector, StaleStatisticsDepartment
+from api.views.canteen import CanteenStatisticsView, badges_for_queryset, diagnostic_statistics_for_queryset
 from data.region_choices import Region
+from macantine.geo import GEO_REFERENTIAL_PATH, GeoReferential, clear_geo_referential_cache, save_geo_referential
 
 
 class TestCanteenStatsApi(APITestCase):
@@ -422,6 +428,84 @@ class TestCanteenStatsApi(APITestCase):
         self.assertEqual(info_badge_qs.count(), 1)
         self.assertTrue(info_badge_qs.filter(canteen=earned).exists())
 
+    def test_stored_badges_follow_canteen(self):
+        """
+        The shares and badges stored on the diagnostics are recomputed when the canteen changes, and by the
+        refresh_diagnostic_badges command
+        """
+        primaire = SectorFactory(name="Scolaire primaire", category="education")
+        canteen = CanteenFactory.create(region=Region.ile_de_france.value, daily_meal_count=4000, sectors=[])
+        diagnostic = DiagnosticFactory.create(
+            canteen=canteen,
+            value_total_ht=100,
+            value_bio_ht=10,
+            value_sustainable_ht=15,
+            value_externality_performance_ht=None,
+            value_egalim_others_ht=0,
+            has_waste_diagnostic=True,
+            waste_actions=["action1"],
+            has_donation_agreement=False,
+            vegetarian_weekly_recurrence=Diagnostic.MenuFrequency.MID.value,
+        )
+        self.assertEqual(diagnostic.bio_share, 0.1)
+        self.assertEqual(diagnostic.combined_share, 0.25)
+        self.assertFalse(diagnostic.has_appro_badge)
+        self.assertFalse(diagnostic.has_waste_badge)
+        self.assertFalse(diagnostic.has_diversification_badge)
+
+        canteen.region = Region.guadeloupe.value
+        canteen.daily_meal_count = 100
+        canteen.save()
+        canteen.sectors.add(primaire)
+        diagnostic.refresh_from_db()
+        self.assertTrue(diagnostic.has_appro_badge)
+        self.assertTrue(diagnostic.has_waste_badge)
+        self.assertTrue(diagnostic.has_diversification_badge)
+        self.assertEqual(badges_for_queryset(Diagnostic.objects.all())["appro"].count(), 1)
+
+        Diagnostic.objects.update(has_appro_badge=False, bio_share=None)
+        call_command("refresh_diagnostic_badges", stdout=io.StringIO())
+        diagnostic.refresh_from_db()
+        self.assertTrue(diagnostic.has_appro_badge)
+        self.assertEqual(diagnostic.bio_share, 0.1)
+
+    def test_diagnostic_statistics_single_pass(self):
+        """
+        The badge counts and appro averages are computed in a single query, the diagnostics of the canteens with
+        several of the requested sectors being counted once
+        """
+        school = SectorFactory.create(category=Sector.Categories.EDUCATION)
+        enterprise = SectorFactory.create(category=Sector.Categories.ENTERPRISE)
+        both = CanteenFactory.create(sectors=[school, enterprise])
+        other = CanteenFactory.create(sectors=[enterprise])
+        DiagnosticFactory.create(
+            canteen=both,
+            year=2023,
+            value_total_ht=100,
+            value_bio_ht=20,
+            value_sustainable_ht=30,
+            value_externality_performance_ht=None,
+            value_egalim_others_ht=10,
+            communicates_on_food_quality=True,
+        )
+        DiagnosticFactory.create(
+            canteen=other,
+            year=2023,
+            value_total_ht=None,
+            value_bio_ht=None,
+            communicates_on_food_quality=False,
+        )
+
+        diagnostics = CanteenStatisticsView._filter_diagnostics([2023], [], [], None, None, [school.id, enterprise.id])
+        with self.assertNumQueries(1):
+            statistics = diagnostic_statistics_for_queryset(diagnostics)
+        self.assertEqual(statistics["diagnostics_count"], 2)
+        self.assertEqual(statistics["bio_share_avg"], 0.2)
+        self.assertEqual(statistics["sustainable_share_avg"], 0.4)
+        self.assertEqual(statistics["info_badge_count"], 1)
+        for badge, queryset in badges_for_queryset(diagnostics).items():
+            self.assertEqual(statistics[f"{badge}_badge_count"], queryset.count(), badge)
+
     def test_canteen_locations(self):
         """
         Test that the right subset of regions and departments 'in use' by canteens are returned
@@ -502,6 +586,25 @@ class TestCanteenStatsApi(APITestCase):
         body = response.json()
         self.assertEqual(body["canteenCount"], 4)
 
+    @requests_mock.Mocker()
+    def test_epci_referential(self, mock):
+        """
+        With the geo referential, the EPCI stored on the canteens is filtered without calling the geo API
+        """
+        save_geo_referential(
+            GeoReferential("2024-01-01", {"12345": ("01", "84", "1"), "11223": ("02", "32", "2")}, {"1": "", "2": ""})
+        )
+        self.addCleanup(clear_geo_referential_cache)
+        self.addCleanup(default_storage.delete, GEO_REFERENTIAL_PATH)
+        CanteenFactory.create(city_insee_code="12345")
+        CanteenFactory.create(city_insee_code="11223")
+        CanteenFactory.create(city_insee_code="00000")
+
+        response = self.client.get(reverse("canteen_statistics"), {"year": 2021, "epci": ["1", "2"]})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["canteenCount"], 2)
+        self.assertFalse(mock.called)
+
     @requests_mock.Mocker()
     def test_epci_error(self, mock):
         """
@@ -549,3 +652,154 @@ class TestCanteenStatsApi(APITestCase):
         body = response.json()
         self.assertEqual(body["canteenCount"], 3)
         self.assertEqual(body["publishedCanteenCount"], 2)
+
+    @override_settings(PUBLISH_BY_DEFAULT=False)
+    def test_statistics_cube(self):
+        """
+        Once the cube is built, the statistics are summed from its cells, with the same results as from the tables
+        """
+        save_geo_referential(
+            GeoReferential(
+                "2024-01-01",
+                {"29021": ("29", "53", "242900793"), "29022": ("29", "53", "242900793"), "01002": ("01", "84", None)},
+                {"242900793": "CC Lesneven"},
+            )
+        )
+        self.addCleanup(clear_geo_referential_cache)
+        self.addCleanup(default_storage.delete, GEO_REFERENTIAL_PATH)
+
+        # The refreshes of the cells registered by the signals are run, nothing being refreshed before the build
+        with self.captureOnCommitCallbacks(execute=True):
+            school = SectorFactory.create(category=Sector.Categories.EDUCATION)
+            enterprise = SectorFactory.create(category=Sector.Categories.ENTERPRISE)
+            unknown = SectorFactory.create(category=None)
+            canteens = [
+                CanteenFactory.create(
+                    city_insee_code="29021",
+                    department="29",
+                    region="53",
+                    publication_status=Canteen.PublicationStatus.PUBLISHED,
+                    sectors=[school, enterprise],
+                ),
+                CanteenFactory.create(city_insee_code="29022", department="29", region="53", sectors=[school]),
+                CanteenFactory.create(city_insee_code="01002", department="01", region="84", sectors=[unknown]),
+                CanteenFactory.create(department=None, region=None, sectors=[]),
+            ]
+            for canteen, value_bio_ht in zip(canteens, [10, 35, 70, None]):
+                DiagnosticFactory.create(
+                    canteen=canteen,
+                    year=2023,
+                    value_total_ht=100 if value_bio_ht is not None else None,
+                    value_bio_ht=value_bio_ht,
+                    value_sustainable_ht=10,
+                    value_externality_performance_ht=None,
+                    value_egalim_others_ht=5,
+                    communicates_on_food_quality=canteen.department == "29",
+                )
+            DiagnosticFactory.create(canteen=canteens[0], year=2022)
+
+        queries = [
+            {"year": 2023},
+            {"year": 2022},
+            {"year": 2023, "region": ["53", "84"]},
+            {"year": 2023, "department": "29"},
+            {"year": 2023, "epci": "242900793"},
+            {"year": 2023, "sectors": [school.id, unknown.id]},
+            {"year": 2023, "department": "01", "sectors": [school.id]},
+        ]
+        expected = [self.client.get(reverse("canteen_statistics"), query).json() for query in queries]
+
+        call_command("rebuild_statistics_cube", stdout=io.StringIO())
+        for query, body in zip(queries, expected):
+            with self.assertNumQueries(4):
+                response = self.client.get(reverse("canteen_statistics"), query)
+            self.assertEqual(response.json(), body, query)
+        self.assertEqual(expected[0]["canteenCount"], 4)
+        self.assertEqual(expected[4]["canteenCount"], 2)
+        self.assertEqual(expected[5]["sectorCategories"]["inconnu"], 1)
+
+        # The cells of the previous and new departments are refreshed when a canteen moves
+        with self.captureOnCommitCallbacks(execute=True):
+            canteens[1].department = "01"
+            canteens[1].save()
+        with self.captureOnCommitCallbacks(execute=True):
+            canteens[2].sectors.add(school)
+        body = self.client.get(reverse("canteen_statistics"), {"year": 2023, "department": "01"}).json()
+        self.assertEqual(body["canteenCount"], 2)
+        self.assertEqual(body["diagnosticsCount"], 2)
+        self.assertEqual(body["sectorCategories"][Sector.Categories.EDUCATION], 2)
+        body = self.client.get(reverse("canteen_statistics"), {"year": 2023, "department": "29"}).json()
+        self.assertEqual(body["canteenCount"], 1)
+        self.assertEqual(body["bioPercent"], 10)
+
+        # The changes of a transaction, e.g. the rows of a CSV import, refresh their departments once
+        with patch.object(CanteenStatisticsCell, "refresh", wraps=CanteenStatisticsCell.refresh) as refresh:
+            with self.captureOnCommitCallbacks(execute=True):
+                with transaction.atomic():
+                    for canteen in canteens[:3]:
+                        canteen.save()
+                        DiagnosticFactory.create(canteen=canteen, year=2024)
+        refresh.assert_called_once_with({"01", "29"})
+        self.assertFalse(StaleStatisticsDepartment.objects.exists())
+        body = self.client.get(reverse("canteen_statistics"), {"year": 2024, "department": "01"}).json()
+        self.assertEqual(body["diagnosticsCount"], 2)
+
+        CanteenStatisticsCell.objects.all().delete()
+        self.assertEqual(CanteenStatisticsCell.refresh(["29"]), 0, "The cube is only refreshed once built")
+
+    def test_statistics_time_series(self):
+        """
+        The time series has the diagnostic statistics of each year, as the statistics of the year
+        """
+        school = SectorFactory.create(category=Sector.Categories.EDUCATION)
+        canteen = CanteenFactory.create(department="29", sectors=[school])
+        other = CanteenFactory.create(department="01", sectors=[school])
+        for year, value_bio_ht in [(2021, 10), (2022, 30)]:
+            DiagnosticFactory.create(
+                canteen=canteen,
+                year=year,
+                value_total_ht=100,
+                value_bio_ht=value_bio_ht,
+                communicates_on_food_quality=year == 2022,
+            )
+        DiagnosticFactory.create(canteen=other, year=2022, value_total_ht=100, value_bio_ht=60)
+
+        for query in [{"department": "29"}, {"sectors": school.id}]:
+            expected = [
+                {"year": year, **self.client.get(reverse("canteen_statistics"), {"year": year, **query}).json()}
+                for year in [2020, 2021, 2022]
+            ]
+            for fields in ["canteenCount", "publishedCanteenCount", "sectorCategories"]:
+                for statistics in expected:
+                    statistics.pop(fields)
+
+            # Whether the cube is built, then the diagnostics grouped by year
+            with self.assertNumQueries(2):
+                response = self.client.get(
+                    reverse("canteen_statistics_time_series"), {"min_year": 2020, "max_year": 2022, **query}
+                )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.json()["years"], expected, query)
+
+            call_command("rebuild_statistics_cube", stdout=io.StringIO())
+            response = self.client.get(
+                reverse("canteen_statistics_time_series"), {"year": [2022, 2020, 2021], **query}
+            )
+            self.assertEqual(response.json()["years"], expected, query)
+            CanteenStatisticsCell.objects.all().delete()
+
+        self.assertEqual(expected[1]["bioPercent"], 10)
+        self.assertEqual(expected[2]["diagnosticsCount"], 2)
+
+        response = self.client.get(reverse("canteen_statistics_time_series"), {"min_year": 2000, "max_year": 2050})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(reverse("canteen_statistics_time_series"), {"year": "2022a"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        # The size of the range and of the list are checked before building them
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                reverse("canteen_statistics_time_series"), {"min_year": 0, "max_year": 999999999}
+            )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(reverse("canteen_statistics_time_series"), {"year": list(range(2000, 2031))})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
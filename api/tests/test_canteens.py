@@ -10,6 +10,7 @@ from rest_framework import status
 from data.factories import CanteenFactory, ManagerInvitationFactory, PurchaseFactory
 from data.factories import DiagnosticFactory, SectorFactory
 from data.models import Canteen, Teledeclaration, Diagnostic
+from data.models.canteen import prefetch_diagnostics
 from .utils import authenticate, get_oauth2_token
 from freezegun import freeze_time
 
@@ -1265,6 +1266,41 @@ class TestCanteenApi(APITestCase):
         self.assertIn(unpublished_canteen.id, ids)
         self.assertNotIn(out_of_place_canteen.id, ids)
 
+    @authenticate
+    def test_territory_canteens_central_kitchen_diagnostics(self):
+        """
+        The satellites of the list are serialised with the diagnostics of their central kitchen, resolved for the
+        whole page
+        """
+        user = authenticate.user
+        user.is_elected_official = True
+        user.departments = ["01"]
+        user.save()
+        central_kitchen = CanteenFactory.create(
+            department="02", production_type=Canteen.ProductionType.CENTRAL, siret="21340172201787"
+        )
+        satellite = CanteenFactory.create(
+            department="01",
+            production_type=Canteen.ProductionType.ON_SITE_CENTRAL,
+            central_producer_siret=central_kitchen.siret,
+        )
+        diagnostic = DiagnosticFactory.create(
+            canteen=central_kitchen,
+            year=2022,
+            central_kitchen_diagnostic_mode=Diagnostic.CentralKitchenDiagnosticMode.ALL,
+        )
+
+        response = self.client.get(reverse("territory_canteens"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        body = response.json()["results"]
+        self.assertEqual(len(body), 1)
+        self.assertEqual([d["id"] for d in body[0]["centralKitchenDiagnostics"]], [diagnostic.id])
+
+        # The prefetched diagnostics are read like the queried ones
+        prefetched_satellite = prefetch_diagnostics([Canteen.objects.get(id=satellite.id)])[0]
+        self.assertTrue(prefetched_satellite.has_diagnostic_for_year(2022))
+        self.assertFalse(prefetched_satellite.has_diagnostic_for_year(2021))
+
     @authenticate
     def test_not_elected_official_territory_canteens_list(self):
         """
@@ -1,14 +1,17 @@
+import io
 import os
 import datetime
 from datetime import date
+from django.core.management import call_command
 from django.urls import reverse
 from django.utils import timezone
 from django.test.utils import override_settings
 from rest_framework.test import APITestCase
 from rest_framework import status
+from api.views.canteen import CanteenFacets
 from data.factories import CanteenFactory, SectorFactory
 from data.factories import DiagnosticFactory
-from data.models import Canteen
+from data.models import Canteen, Diagnostic, PublicCanteenCard
 from data.region_choices import Region
 
 CURRENT_DIR = os.path.dirname(os.path.realpath(__file__))
@@ -133,6 +136,82 @@ class TestPublicCanteenPreviewsApi(APITestCase):
 
     # TODO: test satellites: CC APPRO, CC ALL, own diag
 
+    @override_settings(PUBLISH_BY_DEFAULT=False)
+    def test_public_canteen_cards(self):
+        """
+        The public list reads the denormalised cards, refreshed when the canteens and their diagnostics change
+        """
+        last_year = timezone.now().date().year - 1
+        school = SectorFactory.create(name="School")
+        with self.captureOnCommitCallbacks(execute=True):
+            central_kitchen = CanteenFactory.create(
+                publication_status="published", production_type=Canteen.ProductionType.CENTRAL, siret="21340172201787"
+            )
+            satellite = CanteenFactory.create(
+                publication_status="published",
+                production_type=Canteen.ProductionType.ON_SITE_CENTRAL,
+                central_producer_siret=central_kitchen.siret,
+                sectors=[school],
+            )
+            CanteenFactory.create_batch(3, publication_status="published")
+            draft = CanteenFactory.create(publication_status="draft")
+
+        self.assertEqual(PublicCanteenCard.objects.count(), 5)
+        self.assertFalse(PublicCanteenCard.objects.filter(canteen=draft).exists())
+        self.assertEqual(satellite.public_card.sector_ids, [school.id])
+        self.assertIsNone(satellite.public_card.latest_published_year)
+
+        # The satellites follow the diagnostics of their central kitchen
+        with self.captureOnCommitCallbacks(execute=True):
+            DiagnosticFactory.create(
+                canteen=central_kitchen,
+                year=last_year,
+                value_total_ht=100,
+                value_bio_ht=60,
+                central_kitchen_diagnostic_mode=Diagnostic.CentralKitchenDiagnosticMode.APPRO,
+            )
+        card = PublicCanteenCard.objects.get(canteen=satellite)
+        self.assertEqual(card.latest_published_year, last_year)
+        self.assertTrue(card.appro_badge)
+        self.assertEqual(card.appro_diagnostic["percentage_value_bio_ht"], 0.6)
+
+        with self.assertNumQueries(4):  # The validators, the count, the filter options and the page
+            response = self.client.get(reverse("published_canteens"))
+        results = {result["id"]: result for result in response.json()["results"]}
+        self.assertEqual(len(results), 5)
+        self.assertEqual(results[satellite.id]["badges"]["year"], last_year)
+        self.assertTrue(results[satellite.id]["badges"]["appro"])
+        self.assertEqual(results[satellite.id]["approDiagnostic"]["percentageValueBioHt"], 0.6)
+        self.assertEqual(results[satellite.id]["sectors"], [school.id])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            satellite.publication_status = Canteen.PublicationStatus.DRAFT
+            satellite.save()
+        self.assertFalse(PublicCanteenCard.objects.filter(canteen=satellite).exists())
+
+        # The cards that have not been stored yet are built on the fly
+        PublicCanteenCard.objects.all().delete()
+        response = self.client.get(reverse("single_public_canteen_preview", kwargs={"pk": central_kitchen.id}))
+        self.assertEqual(response.json()["badges"]["year"], last_year)
+
+        call_command("rebuild_public_canteen_cards", stdout=io.StringIO())
+        self.assertEqual(PublicCanteenCard.objects.count(), 4)
+
+        # The nightly rebuild leaves the unchanged cards, and so the validators of their requests, untouched
+        modification_dates = dict(PublicCanteenCard.objects.values_list("canteen_id", "modification_date"))
+        call_command("rebuild_public_canteen_cards", stdout=io.StringIO())
+        self.assertEqual(
+            dict(PublicCanteenCard.objects.values_list("canteen_id", "modification_date")), modification_dates
+        )
+
+        # Any change of the public data of a canteen modifies its card
+        with self.captureOnCommitCallbacks(execute=True):
+            central_kitchen.name = "Cuisine centrale renommée"
+            central_kitchen.save()
+        card = PublicCanteenCard.objects.get(canteen=central_kitchen)
+        self.assertGreater(card.modification_date, modification_dates[central_kitchen.id])
+        self.assertEqual(card.canteen_modification_date, Canteen.objects.get(id=central_kitchen.id).modification_date)
+
 
 class TestPublicCanteenSearchApi(APITestCase):
     def test_search_single_result(self):
@@ -181,6 +260,49 @@ class TestPublicCanteenSearchApi(APITestCase):
         self.assertIn("Mochi", result_names)
         self.assertIn("Sudachi", result_names)
 
+    def test_search_prefix_mode(self):
+        """
+        In the prefix mode, the words of the canteens must start with the terms
+        """
+        CanteenFactory.create(publication_status="published", name="Cantine du Moulin")
+        CanteenFactory.create(publication_status="published", name="École Mouloud Feraoun")
+        CanteenFactory.create(publication_status="published", name="Restaurant scolaire du Lac")
+        CanteenFactory.create(publication_status="published", name="Cantine Scoumoulin")
+
+        response = self.client.get(f"{reverse('published_canteens')}?search=cant mou&search_mode=prefix")
+        results = response.json().get("results", [])
+        self.assertEqual([result["name"] for result in results], ["Cantine du Moulin"])
+        self.assertEqual(response.json()["count"], 1)
+
+        response = self.client.get(f"{reverse('published_canteens')}?search=ecol&search_mode=prefix")
+        results = response.json().get("results", [])
+        self.assertEqual([result["name"] for result in results], ["École Mouloud Feraoun"])
+
+        # By default the terms are searched within the names
+        response = self.client.get(f"{reverse('published_canteens')}?search=moul")
+        self.assertEqual(response.json()["count"], 3)
+
+    def test_search_ranking(self):
+        """
+        The canteens matching the words of the search come first, unless an ordering is requested
+        """
+        CanteenFactory.create(publication_status="published", name="Sasha")
+        CanteenFactory.create(publication_status="published", name="Restaurant Sasha")
+        CanteenFactory.create(publication_status="published", name="Rasha")
+
+        # None of the words start with the term, the canteens are listed by creation date
+        response = self.client.get(f"{reverse('published_canteens')}?search=sha")
+        results = response.json().get("results", [])
+        self.assertEqual([result["name"] for result in results], ["Rasha", "Restaurant Sasha", "Sasha"])
+
+        response = self.client.get(f"{reverse('published_canteens')}?search=sasha")
+        results = response.json().get("results", [])
+        self.assertEqual([result["name"] for result in results], ["Sasha", "Restaurant Sasha"])
+
+        response = self.client.get(f"{reverse('published_canteens')}?search=sasha&ordering=-creation_date")
+        results = response.json().get("results", [])
+        self.assertEqual([result["name"] for result in results], ["Restaurant Sasha", "Sasha"])
+
     def test_meal_count_filter(self):
         CanteenFactory.create(publication_status="published", daily_meal_count=10, name="Shiso")
         CanteenFactory.create(publication_status="published", daily_meal_count=15, name="Wasabi")
@@ -653,6 +775,103 @@ class TestPublicCanteenSearchApi(APITestCase):
         self.assertEqual(len(body.get("managementTypes")), 1)
         self.assertIn("conceded", body.get("managementTypes"))
 
+    def test_pagination_facets(self):
+        """
+        The filter options are computed in a single query, the sectors ignoring the search and the sector filters
+        """
+        school = SectorFactory.create(name="School")
+        enterprise = SectorFactory.create(name="Enterprise")
+        CanteenFactory.create(
+            publication_status="published",
+            department="75",
+            region="11",
+            management_type="conceded",
+            production_type="site",
+            sectors=[school],
+            name="Shiso",
+        )
+        CanteenFactory.create(
+            publication_status="published",
+            department="69",
+            region="84",
+            management_type="direct",
+            production_type="central",
+            sectors=[enterprise],
+            name="Wasabi",
+        )
+        CanteenFactory.create(
+            publication_status="draft", department="01", management_type="direct", sectors=[school], name="Mochi"
+        )
+
+        canteens = Canteen.objects.publicly_visible().filter(sectors=school)
+        with self.assertNumQueries(1):
+            facets = CanteenFacets(canteens, Canteen.objects.publicly_visible()).get_facets()
+        self.assertEqual(
+            facets,
+            {
+                "department": ["75"],
+                "region": ["11"],
+                "management_type": ["conceded"],
+                "production_type": ["site"],
+                "sectors": sorted([school.id, enterprise.id]),
+            },
+        )
+
+        body = self.client.get(f"{reverse('published_canteens')}?search=Umami").json()
+        self.assertEqual(body["count"], 0)
+        self.assertEqual(body["departments"], [])
+        self.assertEqual(body["productionTypes"], [])
+        self.assertEqual(len(body["sectors"]), 2)
+
+        body = self.client.get(f"{reverse('published_canteens')}?department=69").json()
+        self.assertEqual(body["departments"], ["69"])
+        self.assertEqual(body["managementTypes"], ["direct"])
+        self.assertEqual(body["sectors"], [enterprise.id])
+
+        empty = Canteen.objects.filter(id__in=[])
+        self.assertEqual(CanteenFacets(empty, empty).get_facets()["sectors"], [])
+
+    def test_keyset_pagination(self):
+        """
+        With the cursor param, the pages are fetched after the last canteen of the previous page, the ties and
+        null values being ordered by id, and the count of the first page is kept
+        """
+        for daily_meal_count in [None, 50, 50, 50, None, 100, 20, 50]:
+            CanteenFactory.create(publication_status="published", daily_meal_count=daily_meal_count)
+
+        for ordering in ["dailyMealCount", "-dailyMealCount", "name", "-creationDate"]:
+            expected = [
+                canteen["id"]
+                for canteen in self.client.get(f"{reverse('published_canteens')}?ordering={ordering}&limit=30").json()[
+                    "results"
+                ]
+            ]
+            ids = []
+            url = f"{reverse('published_canteens')}?ordering={ordering}&limit=3&cursor="
+            while url:
+                body = self.client.get(url).json()
+                self.assertEqual(body["count"], 8)
+                self.assertIsNone(body["previous"])
+                ids += [canteen["id"] for canteen in body["results"]]
+                url = body["next"]
+            self.assertEqual(len(ids), 8)
+            self.assertEqual(len(set(ids)), 8)
+            if ordering in ["dailyMealCount", "-dailyMealCount"]:
+                meal_counts = dict(Canteen.objects.values_list("id", "daily_meal_count"))
+                self.assertEqual([meal_counts[id] for id in ids], [meal_counts[id] for id in expected])
+            else:
+                self.assertEqual(ids, expected)
+
+        # The filter options are only computed for the first page
+        body = self.client.get(f"{reverse('published_canteens')}?limit=3&cursor=").json()
+        self.assertIsInstance(body["departments"], list)
+        body = self.client.get(body["next"]).json()
+        self.assertIsNone(body["departments"])
+        self.assertIsNone(body["sectors"])
+
+        response = self.client.get(f"{reverse('published_canteens')}?cursor=invalid")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
     def test_get_canteens_filter_production_type(self):
         site_canteen = CanteenFactory.create(publication_status="published", production_type="site")
         central_cuisine = CanteenFactory.create(publication_status="published", production_type="central")
@@ -60,6 +60,84 @@ class TestPublishedCanteenApi(APITestCase):
         body = response.json()
         self.assertIn("badges", body)
 
+    def test_conditional_requests(self):
+        """
+        Anonymous users get a 304 Not Modified until the card of the canteen is refreshed,
+        without the canteen being serialised
+        """
+        with self.captureOnCommitCallbacks(execute=True):
+            canteen = CanteenFactory.create(publication_status="published")
+        urls = [
+            reverse("single_published_canteen", kwargs={"pk": canteen.id}),
+            reverse("single_public_canteen_preview", kwargs={"pk": canteen.id}),
+            reverse("published_canteens"),
+        ]
+        etags = {}
+        for url in urls:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertIn("public", response.headers["Cache-Control"])
+            self.assertIn("Last-Modified", response.headers)
+            etags[url] = response.headers["ETag"]
+
+            with self.assertNumQueries(1):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etags[url])
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+            self.assertEqual(response.headers["ETag"], etags[url])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            DiagnosticFactory.create(canteen=canteen, year=2023)
+        for url in urls:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etags[url])
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotEqual(response.headers["ETag"], etags[url])
+
+    def test_conditional_requests_canteen_changes(self):
+        """
+        The changes of the canteen itself and of its images invalidate the validators
+        """
+        with self.captureOnCommitCallbacks(execute=True):
+            canteen = CanteenFactory.create(publication_status="published", name="Cantine")
+            with open(os.path.join(CURRENT_DIR, "files/test-image-1.jpg"), "rb") as image:
+                file = File(image)
+                file.name = "test-image-1.jpg"
+                canteen_image = CanteenImage.objects.create(canteen=canteen, image=file)
+        urls = [
+            reverse("single_published_canteen", kwargs={"pk": canteen.id}),
+            reverse("single_public_canteen_preview", kwargs={"pk": canteen.id}),
+            reverse("published_canteens"),
+        ]
+        etags = {url: self.client.get(url).headers["ETag"] for url in urls}
+
+        with self.captureOnCommitCallbacks(execute=True):
+            canteen.name = "Cantine renommée"
+            canteen.save()
+        for url in urls:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etags[url])
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotEqual(response.headers["ETag"], etags[url])
+            etags[url] = response.headers["ETag"]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            canteen_image.alt_text = "La salle de restauration"
+            canteen_image.save()
+        for url in urls:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etags[url])
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotEqual(response.headers["ETag"], etags[url])
+
+    @authenticate
+    def test_conditional_requests_authenticated(self):
+        """
+        The responses depend on the user, they are neither validated nor stored by shared caches
+        """
+        with self.captureOnCommitCallbacks(execute=True):
+            canteen = CanteenFactory.create(publication_status="published")
+        response = self.client.get(reverse("single_published_canteen", kwargs={"pk": canteen.id}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn("ETag", response.headers)
+        self.assertIn("private", response.headers["Cache-Control"])
+
     @authenticate
     def test_canteen_image_serialization(self):
         """
@@ -1,9 +1,13 @@
+from datetime import datetime
+from io import BytesIO
+from openpyxl import load_workbook
 from django.urls import reverse
 from django.utils import timezone
 from rest_framework import status
 from rest_framework.test import APITestCase
 from data.factories import UserFactory, PurchaseFactory, CanteenFactory, DiagnosticFactory
 from data.models import Purchase, Diagnostic, Canteen
+from api.views.purchase import canteen_summary, canteen_summary_for_year
 from .utils import authenticate
 
 
@@ -364,6 +368,11 @@ class TestPurchaseApi(APITestCase):
         self.assertEqual(body["valueViandesVolaillesNonEgalim"], 90.0)
         self.assertEqual(body["valueExternalityPerformanceHt"], 0.0)
 
+        # Every total is a filtered sum of the same statement
+        with self.assertNumQueries(1):
+            summary = canteen_summary_for_year(canteen, 2020)
+        self.assertEqual(summary["value_fruits_et_legumes_aocaop_igp_stg"], 80)
+
     def test_purchase_summary_unauthenticated(self):
         canteen = CanteenFactory.create()
         response = self.client.get(
@@ -559,6 +568,11 @@ class TestPurchaseApi(APITestCase):
         self.assertEquals(body["results"][1]["year"], 2021)
         self.assertEquals(body["results"][1]["valueTotalHt"], 450)
 
+        # The totals of every year come from a single grouped query
+        with self.assertNumQueries(1):
+            summary = canteen_summary(canteen)
+        self.assertEqual([year["value_total_ht"] for year in summary["results"]], [150, 450])
+
     @authenticate
     def test_delete_purchase(self):
         """
@@ -849,6 +863,12 @@ class TestPurchaseApi(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.data), 3)
 
+        sheet = load_workbook(BytesIO(response.content)).active
+        self.assertEqual(sheet.max_row, 4)
+        self.assertEqual(sheet["A1"].value, "Date")
+        self.assertIsInstance(sheet["A2"].value, datetime)
+        self.assertIsInstance(sheet["G2"].value, (int, float))
+
     @authenticate
     def test_excel_export_search(self):
         canteen = CanteenFactory.create()
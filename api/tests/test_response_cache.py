@@ -0,0 +1,118 @@
+import requests_mock
+from django.core.cache import cache
+from django.test.utils import override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+from data.factories import CanteenFactory, PartnerFactory, SectorFactory
+from data.models import Canteen, Sector
+from .utils import authenticate
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}, PUBLISH_BY_DEFAULT=False
+)
+class TestResponseCache(APITestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_cached_published_canteens(self):
+        """
+        The anonymous reads are served from the cache until a canteen is written
+        """
+        with self.captureOnCommitCallbacks(execute=True):
+            CanteenFactory.create(publication_status="published", name="Shiso")
+
+        response = self.client.get(reverse("published_canteens"), {"limit": 5, "offset": 0})
+        self.assertEqual(response.json()["count"], 1)
+
+        # The query parameters are normalised
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse("published_canteens"), {"offset": 0, "limit": 5})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["count"], 1)
+        self.assertEqual(response.json()["results"][0]["name"], "Shiso")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            canteen = CanteenFactory.create(publication_status="published", name="Wasabi")
+        response = self.client.get(reverse("published_canteens"), {"limit": 5, "offset": 0})
+        self.assertEqual(response.json()["count"], 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            canteen.publication_status = Canteen.PublicationStatus.DRAFT
+            canteen.save()
+        response = self.client.get(reverse("published_canteens"), {"limit": 5, "offset": 0})
+        self.assertEqual(response.json()["count"], 1)
+
+    def test_cached_conditional_requests(self):
+        """
+        The validators of the cached responses are served with them
+        """
+        with self.captureOnCommitCallbacks(execute=True):
+            CanteenFactory.create(publication_status="published")
+        etag = self.client.get(reverse("published_canteens")).headers["ETag"]
+
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse("published_canteens"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_invalidation_groups(self):
+        """
+        The sectors are cached separately from the canteens, and invalidated by the sectors only
+        """
+        with self.captureOnCommitCallbacks(execute=True):
+            SectorFactory.create(name="School")
+        self.assertEqual(len(self.client.get(reverse("sectors_list")).json()), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            CanteenFactory.create(publication_status="published", sectors=[])
+        with self.assertNumQueries(0):
+            self.assertEqual(len(self.client.get(reverse("sectors_list")).json()), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            SectorFactory.create(name="Hospital")
+        self.assertEqual(len(self.client.get(reverse("sectors_list")).json()), 2)
+
+    @authenticate
+    def test_authenticated_reads_not_cached(self):
+        """
+        Only the anonymous reads are cached. The writes without signals, e.g. bulk inserts, are only visible
+        once the cached responses expire
+        """
+        with self.captureOnCommitCallbacks(execute=True):
+            SectorFactory.create(name="School")
+        self.assertEqual(len(self.client.get(reverse("sectors_list")).json()), 1)
+
+        Sector.objects.bulk_create([SectorFactory.build(name="Hospital")])
+        self.assertEqual(len(self.client.get(reverse("sectors_list")).json()), 2)
+
+        self.client.logout()
+        self.assertEqual(len(self.client.get(reverse("sectors_list")).json()), 2)
+        Sector.objects.bulk_create([SectorFactory.build(name="Prison")])
+        self.assertEqual(len(self.client.get(reverse("sectors_list")).json()), 2)
+
+    @requests_mock.Mocker()
+    def test_statistics_epci_error_not_cached(self, mock):
+        """
+        The statistics computed without the EPCI filter, the geo API having failed, are not cached
+        """
+        mock.get("https://geo.api.gouv.fr/epcis/242900793/communes?fields=code", status_code=500)
+        params = {"year": 2023, "epci": "242900793"}
+        response = self.client.get(reverse("canteen_statistics"), params)
+        self.assertEqual(response.json()["epciError"], "Une erreur est survenue")
+        self.assertIn("no-store", response.headers["Cache-Control"])
+
+        mock.get("https://geo.api.gouv.fr/epcis/242900793/communes?fields=code", json=[{"code": "29021"}])
+        response = self.client.get(reverse("canteen_statistics"), params)
+        self.assertNotIn("epciError", response.json())
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(reverse("canteen_statistics"), params).json(), response.json())
+
+    def test_partners_not_cached(self):
+        """
+        The order of the partners is random for each session, their list is not cached
+        """
+        PartnerFactory.create(published=True)
+        self.client.get(reverse("partners_list"))
+        PartnerFactory.create(published=True)
+        self.assertEqual(self.client.get(reverse("partners_list")).json()["count"], 2)
@@ -17,7 +17,7 @@ from api.views import (
     ImportCompleteCentralKitchenView,
     TerritoryCanteensListView,
 )
-from api.views import UpdateUserView, UserCanteensView, CanteenStatisticsView
+from api.views import UpdateUserView, UserCanteensView, CanteenStatisticsView, CanteenStatisticsTimeSeriesView
 from api.views import (
     PublishedCanteensView,
     PublicCanteenPreviewView,
@@ -92,6 +92,11 @@ urlpatterns = {
         name="unlink_satellite",
     ),
     path("canteenStatistics/", CanteenStatisticsView.as_view(), name="canteen_statistics"),
+    path(
+        "canteenStatistics/timeSeries/",
+        CanteenStatisticsTimeSeriesView.as_view(),
+        name="canteen_statistics_time_series",
+    ),
     path("sectors/", SectorListView.as_view(), name="sectors_list"),
     path("partnerTypes/", PartnerTypeListView.as_view(), name="partner_types_list"),
     path("blogPosts/", BlogPostsView.as_view(), name="blog_posts_list"),
@@ -19,6 +19,7 @@ from .canteen import (  # noqa: F401
     SendCanteenNotFoundEmail,
     UserCanteenPreviews,
     CanteenStatisticsView,
+    CanteenStatisticsTimeSeriesView,
     CanteenLocationsView,
     TeamJoinRequestView,
     ClaimCanteenView,
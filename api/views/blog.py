@@ -6,7 +6,7 @@ from rest_framework.response import Response
 from api.serializers import BlogPostSerializer
 from data.models import BlogPost
 from django_filters import rest_framework as django_filters
-from .utils import UnaccentSearchFilter
+from .utils import CachedResponseMixin, UnaccentSearchFilter
 
 logger = logging.getLogger(__name__)
 
@@ -32,7 +32,7 @@ class BlogPostsPagination(LimitOffsetPagination):
         )
 
 
-class BlogPostsView(ListAPIView):
+class BlogPostsView(CachedResponseMixin, ListAPIView):
     model = BlogPost
     serializer_class = BlogPostSerializer
     queryset = BlogPost.objects.filter(published=True)
@@ -40,6 +40,7 @@ class BlogPostsView(ListAPIView):
 
     filter_backends = [django_filters.DjangoFilterBackend, UnaccentSearchFilter]
     search_fields = ["title", "tagline", "body"]
+    cache_groups = ["blog"]
 
     def get_queryset(self):
         queryset = self.queryset
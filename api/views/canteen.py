@@ -1,3 +1,5 @@
+import base64
+import json
 import logging
 from collections import OrderedDict
 from datetime import date
@@ -5,23 +7,26 @@ import redis as r
 from django.apps import apps
 from django.conf import settings
 from django.http import JsonResponse
+from django.utils.cache import add_never_cache_headers
 import requests
 from common.utils import send_mail
+from macantine.geo import get_geo_referential
 from macantine.utils import complete_location_data, complete_canteen_data
 from django.core.validators import validate_email
-from django.core.exceptions import ValidationError, BadRequest
+from django.core.exceptions import ValidationError, BadRequest, EmptyResultSet
 from django.contrib.auth import get_user_model
-from django.db import transaction, IntegrityError
-from django.db.models.functions import Cast
-from django.db.models import Sum, FloatField, Avg, Func, F, Q, Case, When, Value, Subquery, OuterRef, Exists, Count
+from django.db import connection, transaction, IntegrityError
+from django.db.models import Sum, Avg, F, Q, Case, When, Value, Subquery, OuterRef, Exists, Count, Max
+from django.db.models.functions import Greatest
 from django_filters import rest_framework as django_filters
 from django_filters import BaseInFilter, CharFilter
 from drf_spectacular.utils import extend_schema_view, extend_schema
 from rest_framework.generics import RetrieveAPIView, ListAPIView, ListCreateAPIView
 from rest_framework.generics import RetrieveUpdateDestroyAPIView
 from rest_framework import status
-from rest_framework.exceptions import PermissionDenied
+from rest_framework.exceptions import NotFound, PermissionDenied
 from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from api.views.utils import update_change_reason_with_auth
@@ -38,9 +43,10 @@ from api.serializers import (
     MinimalCanteenSerializer,
     CanteenSummarySerializer,
 )
-from data.models import Canteen, ManagerInvitation, Sector, Diagnostic, Teledeclaration, Purchase
-from data.region_choices import Region
-from data.department_choices import Department
+from data.models import Canteen, ManagerInvitation, Sector, Diagnostic, Teledeclaration, Purchase, PublicCanteenCard
+from data.models import CanteenStatisticsCell
+from data.models.canteenstatisticscell import diagnostic_sustainable_share
+from data.models.canteen import prefetch_diagnostics
 from api.permissions import (
     IsCanteenManager,
     IsAuthenticated,
@@ -49,65 +55,260 @@ from api.permissions import (
     IsElectedOfficial,
 )
 from api.exceptions import DuplicateException
-from .utils import camelize, UnaccentSearchFilter, MaCantineOrderingFilter
+from .utils import (
+    camelize,
+    CachedResponseMixin,
+    ConditionalGetMixin,
+    IndexedSearchFilter,
+    UnaccentSearchFilter,
+    MaCantineOrderingFilter,
+)
 
 logger = logging.getLogger(__name__)
 redis = r.from_url(settings.REDIS_URL, decode_responses=True)
 
 
-class PublishedCanteenSingleView(RetrieveAPIView):
+def public_card_validators(canteen_id):
+    """
+    The card of a canteen is refreshed whenever its data, diagnostics, teledeclarations or images change
+    (see data/signals.py), so the latest modification date of the canteen and its card validates the public
+    representations of the canteen
+    """
+    modification_date = (
+        PublicCanteenCard.objects.filter(canteen_id=canteen_id)
+        .values_list(Greatest("modification_date", "canteen__modification_date"), flat=True)
+        .first()
+    )
+    if not modification_date:
+        return None
+    return f"{canteen_id}-{modification_date.timestamp()}", modification_date
+
+
+class PublishedCanteenSingleView(ConditionalGetMixin, RetrieveAPIView):
     model = Canteen
     serializer_class = PublicCanteenSerializer
 
     def get_queryset(self):
-        return Canteen.objects.publicly_visible()
+        return Canteen.objects.publicly_visible().select_related("public_card")
+
+    def get_validators(self, request, *args, **kwargs):
+        return public_card_validators(kwargs.get("pk"))
 
 
 class ProductionTypeInFilter(BaseInFilter, CharFilter):
     pass
 
 
-class PublishedCanteensPagination(LimitOffsetPagination):
+class CanteenFacets:
+    """
+    Computes the filter options of a list of canteens in a single query : the distinct values of the facet fields
+    are aggregated over the filtered canteens, and the sectors over the canteens of the sector queryset.
+    The sectors are computed separately because the user can select multiple sectors (unlike other filter options)
+    """
+
+    fields = ["department", "region", "management_type", "production_type"]
+
+    def __init__(self, queryset, sector_queryset):
+        self.queryset = queryset
+        self.sector_queryset = sector_queryset
+
+    def get_facets(self):
+        quote_name = connection.ops.quote_name
+        columns = [quote_name(Canteen._meta.get_field(field).column) for field in self.fields]
+        table = quote_name(Canteen._meta.db_table)
+        canteens_sql, canteens_params = self._get_sql(
+            self.queryset.order_by().values(*self.fields), f"SELECT {', '.join(columns)} FROM {table} WHERE false"
+        )
+        sector_canteens_sql, sector_canteens_params = self._get_sql(
+            self.sector_queryset.order_by().values("id"), f"SELECT id FROM {table} WHERE false"
+        )
+        facets = [
+            f"COALESCE(ARRAY_AGG(DISTINCT {column}) FILTER (WHERE {column} <> ''), '{{}}')" for column in columns
+        ]
+        sectors = (
+            f"ARRAY(SELECT DISTINCT sector_id FROM {quote_name(Canteen.sectors.through._meta.db_table)} "
+            f"WHERE canteen_id IN ({sector_canteens_sql}) ORDER BY sector_id)"
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT {', '.join(facets)}, {sectors} FROM ({canteens_sql}) AS canteens",
+                sector_canteens_params + canteens_params,
+            )
+            values = cursor.fetchone()
+        return dict(zip(self.fields + ["sectors"], values))
+
+    @staticmethod
+    def _get_sql(queryset, empty_sql):
+        try:
+            sql, params = queryset.query.sql_with_params()
+            return sql, tuple(params)
+        except EmptyResultSet:
+            return empty_sql, ()
+
+
+class KeysetPaginationMixin:
+    """
+    Opt-in keyset pagination for a LimitOffsetPagination : when the `cursor` query param is given (empty for the
+    first page), the page is fetched after the last row of the previous one instead of with an OFFSET.
+    The order follows the ordering filter of the view (nulls being the smallest values) with the id as tiebreaker,
+    and the count of the first page is carried in the cursor so that the deep pages do not count the rows again
+    """
+
+    cursor_query_param = "cursor"
+    keyset = False
+
+    def is_cursor_page(self, request):
+        """
+        The pages after the first one of a keyset pagination
+        """
+        return bool(request.query_params.get(self.cursor_query_param))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = self.cursor_query_param in request.query_params
+        if not self.keyset:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        self.limit = self.get_limit(request)
+        ordering = self.get_keyset_ordering(request, queryset, view)
+        descending = ordering[-1][1]
+        queryset = queryset.order_by(
+            *[F(field).desc(nulls_last=True) if desc else F(field).asc(nulls_first=True) for field, desc in ordering],
+            "-id" if descending else "id",
+        )
+
+        cursor = self.decode_cursor(request.query_params[self.cursor_query_param])
+        if cursor:
+            self.count = cursor["count"]
+            queryset = queryset.filter(
+                self.get_keyset_filter(queryset.model, ordering, cursor["values"], cursor["id"])
+            )
+        else:
+            self.count = self.get_count(queryset)
+
+        results = list(queryset[: self.limit + 1])
+        self.next_cursor = None
+        if len(results) > self.limit:
+            results = results[: self.limit]
+            last = results[-1]
+            self.next_cursor = self.encode_cursor(
+                {"values": [getattr(last, field) for field, _ in ordering], "id": last.id, "count": self.count}
+            )
+        return results
+
+    def get_keyset_ordering(self, request, queryset, view):
+        ordering = MaCantineOrderingFilter().get_ordering(request, queryset, view) or queryset.model._meta.ordering
+        return [(field.lstrip("-"), field.startswith("-")) for field in ordering]
+
+    @staticmethod
+    def get_keyset_filter(model, ordering, values, last_id):
+        """
+        The rows after (field_1, ..., field_n, id) in lexicographic order. The predicate is bounded by the first
+        field, so that the (field, id) indexes of the ordering are scanned from the cursor, and the nulls are only
+        looked for in the nullable fields
+        """
+        descending = ordering[-1][1]
+        after = Q(id__lt=last_id) if descending else Q(id__gt=last_id)
+        for (field, desc), value in reversed(list(zip(ordering, values))):
+            nullable = model._meta.get_field(field).null
+            if value is None:
+                # The nulls come first in an ascending order and last in a descending one
+                greater = Q(pk__in=[]) if desc else Q(**{f"{field}__isnull": False})
+                equal = Q(**{f"{field}__isnull": True})
+            else:
+                greater = Q(**{f"{field}__lt": value}) if desc else Q(**{f"{field}__gt": value})
+                if desc and nullable:
+                    greater |= Q(**{f"{field}__isnull": True})
+                equal = Q(**{field: value})
+            after = greater | (equal & after)
+
+        field, desc = ordering[0]
+        value, nullable = values[0], model._meta.get_field(field).null
+        if value is None:
+            bound = Q(**{f"{field}__isnull": True}) if desc else Q()
+        elif desc:
+            bound = Q(**{f"{field}__lte": value})
+            if nullable:
+                bound |= Q(**{f"{field}__isnull": True})
+        else:
+            bound = Q(**{f"{field}__gte": value})
+        return bound & after
+
+    @staticmethod
+    def encode_cursor(cursor):
+        return base64.urlsafe_b64encode(json.dumps(cursor, default=str).encode()).decode()
+
+    @staticmethod
+    def decode_cursor(encoded):
+        if not encoded:
+            return None
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            if (
+                isinstance(cursor["values"], list)
+                and isinstance(cursor["id"], int)
+                and isinstance(cursor["count"], int)
+            ):
+                return cursor
+        except (ValueError, TypeError, KeyError):
+            pass
+        raise NotFound("Curseur invalide")
+
+    def get_next_link(self):
+        if not self.keyset:
+            return super().get_next_link()
+        if not self.next_cursor:
+            return None
+        url = remove_query_param(self.request.build_absolute_uri(), self.offset_query_param)
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_previous_link(self):
+        if not self.keyset:
+            return super().get_previous_link()
+        # The keyset pages are only browsed forwards
+        return None
+
+
+class PublishedCanteensPagination(KeysetPaginationMixin, LimitOffsetPagination):
     default_limit = 12
     max_limit = 30
     departments = []
+    regions = []
     sectors = []
     management_types = []
     production_types = []
 
     def paginate_queryset(self, queryset, request, view=None):
-        # Performance improvements possible
-        self.departments = set(filter(lambda x: x, queryset.values_list("department", flat=True)))
-        self.regions = set(filter(lambda x: x, queryset.values_list("region", flat=True)))
-        self.management_types = set(filter(lambda x: x, queryset.values_list("management_type", flat=True)))
-        self.production_types = set(filter(lambda x: x, queryset.values_list("production_type", flat=True)))
-
-        # Prepare sector filter options:
-        # we want to return all sectors that are available after the other filters,
-        # because the user can select multiple sectors (unlike other filter options)
-        all_sector_canteens = Canteen.objects.publicly_visible()
+        # The filter options of the first page of a keyset pagination are kept by the client, like its count
+        if self.is_cursor_page(request):
+            self.departments = self.regions = self.sectors = self.management_types = self.production_types = None
+            return super().paginate_queryset(queryset, request, view)
+        facets = CanteenFacets(queryset, self.get_sector_queryset(request, view)).get_facets()
+        self.departments = facets["department"]
+        self.regions = facets["region"]
+        self.management_types = facets["management_type"]
+        self.production_types = facets["production_type"]
+        self.sectors = facets["sectors"]
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_sector_queryset(self, request, view):
+        """
+        The sector options are all the sectors available after the filters other than the sectors,
+        the search and the production types
+        """
+        sector_queryset = view.get_queryset() if view else Canteen.objects.publicly_visible()
         query_params = request.query_params
         if query_params.get("department"):
-            all_sector_canteens = all_sector_canteens.filter(department=query_params.get("department"))
+            sector_queryset = sector_queryset.filter(department=query_params.get("department"))
         if query_params.get("region"):
-            all_sector_canteens = all_sector_canteens.filter(region=query_params.get("region"))
+            sector_queryset = sector_queryset.filter(region=query_params.get("region"))
         if query_params.get("min_daily_meal_count"):
-            all_sector_canteens = all_sector_canteens.filter(
-                daily_meal_count__gte=query_params.get("min_daily_meal_count")
-            )
+            sector_queryset = sector_queryset.filter(daily_meal_count__gte=query_params.get("min_daily_meal_count"))
         if query_params.get("max_daily_meal_count"):
-            all_sector_canteens = all_sector_canteens.filter(
-                daily_meal_count__lte=query_params.get("max_daily_meal_count")
-            )
+            sector_queryset = sector_queryset.filter(daily_meal_count__lte=query_params.get("max_daily_meal_count"))
         if query_params.get("management_type"):
-            all_sector_canteens = all_sector_canteens.filter(management_type=query_params.get("management_type"))
-        all_sector_canteens = filter_by_diagnostic_params(all_sector_canteens, query_params)
-
-        self.sectors = (
-            Sector.objects.filter(canteen__in=list(all_sector_canteens)).values_list("id", flat=True).distinct()
-        )
-
-        return super().paginate_queryset(queryset, request, view)
+            sector_queryset = sector_queryset.filter(management_type=query_params.get("management_type"))
+        return filter_by_diagnostic_params(sector_queryset, query_params)
 
     def get_paginated_response(self, data):
         return Response(
@@ -203,41 +404,12 @@ def filter_by_diagnostic_params(queryset, query_params):
     if bio or combined or appro_badge_requested:
         publication_year = date.today().year - 1
         qs_diag = Diagnostic.objects.filter(year=publication_year, value_total_ht__gt=0)
-        if bio or appro_badge_requested:
-            qs_diag = qs_diag.annotate(
-                bio_share=Cast(Sum("value_bio_ht", default=0) / Sum("value_total_ht"), FloatField())
-            )
-            if bio:
-                qs_diag = qs_diag.filter(bio_share__gte=bio)
-        if combined or appro_badge_requested:
-            qs_diag = qs_diag.annotate(
-                combined_share=Cast(
-                    (
-                        Sum("value_bio_ht", default=0)
-                        + Sum("value_sustainable_ht", default=0)
-                        + Sum("value_externality_performance_ht", default=0)
-                        + Sum("value_egalim_others_ht", default=0)
-                    )
-                    / Sum("value_total_ht"),
-                    FloatField(),
-                )
-            )
-            if combined:
-                qs_diag = qs_diag.filter(combined_share__gte=combined)
+        if bio:
+            qs_diag = qs_diag.filter(bio_share__gte=bio)
+        if combined:
+            qs_diag = qs_diag.filter(combined_share__gte=combined)
         if appro_badge_requested:
-            group_1 = [Region.guadeloupe, Region.martinique, Region.guyane, Region.la_reunion]
-            group_2 = [Region.mayotte]
-            qs_diag = qs_diag.filter(
-                Q(combined_share__gte=0.5, bio_share__gte=0.2)
-                | Q(canteen__region__in=group_1, combined_share__gte=0.2, bio_share__gte=0.05)
-                | Q(canteen__department=Department.saint_martin, combined_share__gte=0.2, bio_share__gte=0.05)
-                | Q(canteen__region__in=group_2, combined_share__gte=0.05, bio_share__gte=0.02)
-                | Q(
-                    canteen__department=Department.saint_pierre_et_miquelon,
-                    combined_share__gte=0.3,
-                    bio_share__gte=0.1,
-                )
-            ).distinct()
+            qs_diag = qs_diag.filter(has_appro_badge=True)
         canteen_ids = qs_diag.values_list("canteen", flat=True)
         canteen_sirets = qs_diag.values_list("canteen__siret", flat=True)
         queryset = queryset.exclude(redacted_appro_years__contains=[publication_year])
@@ -245,32 +417,56 @@ def filter_by_diagnostic_params(queryset, query_params):
     return queryset
 
 
-class PublishedCanteensView(ListAPIView):
+class PublishedCanteensView(CachedResponseMixin, ConditionalGetMixin, ListAPIView):
     model = Canteen
     serializer_class = PublicCanteenPreviewSerializer
     pagination_class = PublishedCanteensPagination
     filter_backends = [
         django_filters.DjangoFilterBackend,
-        UnaccentSearchFilter,
+        IndexedSearchFilter,
         MaCantineOrderingFilter,
     ]
     # TODO: maybe add city/region/department name?
     search_fields = ["name", "siret"]
     ordering_fields = ["name", "creation_date", "modification_date", "daily_meal_count"]
     filterset_class = PublishedCanteenFilterSet
+    cache_groups = ["canteens"]
 
     def get_queryset(self):
-        return Canteen.objects.publicly_visible()
+        return Canteen.objects.publicly_visible().select_related("public_card__lead_image")
 
     def filter_queryset(self, queryset):
         new_queryset = filter_by_diagnostic_params(queryset, self.request.query_params)
         return super().filter_queryset(new_queryset)
 
+    def paginate_queryset(self, queryset):
+        page = super().paginate_queryset(queryset)
+        # The canteens without a stored public card have it built from their diagnostics
+        prefetch_diagnostics([canteen for canteen in page or [] if not hasattr(canteen, "public_card")])
+        return page
+
+    def get_validators(self, request, *args, **kwargs):
+        """
+        Any change of a listed canteen refreshes its card, and a canteen leaving the list deletes its card.
+        The filters and pages of the list share the same validators
+        """
+        cards = PublicCanteenCard.objects.aggregate(
+            count=Count("pk"), modification_date=Max(Greatest("modification_date", "canteen__modification_date"))
+        )
+        if not cards["modification_date"]:
+            return None
+        return f"{cards['count']}-{cards['modification_date'].timestamp()}", cards["modification_date"]
 
-class PublicCanteenPreviewView(RetrieveAPIView):
+
+class PublicCanteenPreviewView(ConditionalGetMixin, RetrieveAPIView):
     model = Canteen
     serializer_class = PublicCanteenPreviewSerializer
-    queryset = Canteen.objects.filter(publication_status=Canteen.PublicationStatus.PUBLISHED)
+    queryset = Canteen.objects.filter(publication_status=Canteen.PublicationStatus.PUBLISHED).select_related(
+        "public_card__lead_image"
+    )
+
+    def get_validators(self, request, *args, **kwargs):
+        return public_card_validators(kwargs.get("pk"))
 
 
 class UserCanteensFilterSet(django_filters.FilterSet):
@@ -766,132 +962,107 @@ class TeamJoinRequestView(APIView):
             )
 
 
-def badges_for_queryset(diagnostic_year_queryset):
-    badge_querysets = {}
-    appro_total = diagnostic_year_queryset
-    appro_total = diagnostic_year_queryset.count()
-    if appro_total:
-        appro_share_query = diagnostic_year_queryset.filter(value_total_ht__gt=0)
-        appro_share_query = appro_share_query.annotate(
-            bio_share=Cast(
-                Sum("value_bio_ht", default=0) / Sum("value_total_ht"),
-                FloatField(),
-            )
-        )
-        appro_share_query = appro_share_query.annotate(
-            combined_share=Cast(
-                (
-                    Sum("value_bio_ht", default=0)
-                    + Sum("value_sustainable_ht", default=0)
-                    + Sum("value_externality_performance_ht", default=0)
-                    + Sum("value_egalim_others_ht", default=0)
-                )
-                / Sum("value_total_ht"),
-                FloatField(),
-            )
-        )
-        # Saint-Martin should be in group 1
-        group_1 = [Region.guadeloupe, Region.martinique, Region.guyane, Region.la_reunion]
-        group_2 = [Region.mayotte]
-        # should have a group 3 with Saint-Pierre-et-Miquelon
-        badge_querysets["appro"] = appro_share_query.filter(
-            Q(combined_share__gte=0.5, bio_share__gte=0.2)
-            | Q(canteen__region__in=group_1, combined_share__gte=0.2, bio_share__gte=0.05)
-            | Q(canteen__department=Department.saint_martin, combined_share__gte=0.2, bio_share__gte=0.05)
-            | Q(canteen__region__in=group_2, combined_share__gte=0.05, bio_share__gte=0.02)
-            | Q(canteen__department=Department.saint_pierre_et_miquelon, combined_share__gte=0.3, bio_share__gte=0.1)
-        ).distinct()
-
-    # waste
-    waste_badge_query = diagnostic_year_queryset.filter(has_waste_diagnostic=True)
-    waste_badge_query = waste_badge_query.annotate(waste_actions_len=Func(F("waste_actions"), function="CARDINALITY"))
-    waste_badge_query = waste_badge_query.filter(waste_actions_len__gt=0)
-    waste_badge_query = waste_badge_query.filter(
-        Q(canteen__daily_meal_count__lt=3000) | Q(has_donation_agreement=True)
-    )
-    badge_querysets["waste"] = waste_badge_query
+BADGES = ["appro", "waste", "diversification", "plastic", "info"]
+
+
+def diagnostic_statistics_aggregates():
+    """
+    The diagnostic count, the average appro shares of the diagnostics with a total and the badge counts, as filtered
+    aggregates computed in a single pass. The diagnostics must not be joined with a multi-valued relation
+    """
+    appro_q = Q(value_total_ht__gt=0)
+    return {
+        "diagnostics_count": Count("id"),
+        "bio_share_avg": Avg("bio_share", filter=appro_q),
+        "sustainable_share_avg": Avg(diagnostic_sustainable_share(), filter=appro_q),
+        **{f"{badge}_badge_count": Count("id", filter=Q(**{f"has_{badge}_badge": True})) for badge in BADGES},
+    }
 
-    # diversification
-    diversification_badge_query = diagnostic_year_queryset.exclude(vegetarian_weekly_recurrence__isnull=True)
-    diversification_badge_query = diversification_badge_query.exclude(vegetarian_weekly_recurrence="")
-    diversification_badge_query = diversification_badge_query.exclude(
-        vegetarian_weekly_recurrence=Diagnostic.MenuFrequency.LOW
-    )
-    scolaire_sectors = Sector.objects.filter(category="education")
-    if scolaire_sectors.count():
-        diversification_badge_query = diversification_badge_query.filter(
-            Q(
-                canteen__sectors__in=scolaire_sectors,
-                vegetarian_weekly_recurrence__in=[
-                    Diagnostic.MenuFrequency.MID,
-                    Diagnostic.MenuFrequency.HIGH,
-                ],
-            )
-            | Q(vegetarian_weekly_recurrence=Diagnostic.MenuFrequency.DAILY)
-        ).distinct()
-    badge_querysets["diversification"] = diversification_badge_query
-
-    # plastic
-    badge_querysets["plastic"] = diagnostic_year_queryset.filter(
-        cooking_plastic_substituted=True,
-        serving_plastic_substituted=True,
-        plastic_bottles_substituted=True,
-        plastic_tableware_substituted=True,
-    )
 
-    # info
-    badge_querysets["info"] = diagnostic_year_queryset.filter(communicates_on_food_quality=True)
-    return badge_querysets
+def diagnostic_statistics_for_queryset(diagnostic_year_queryset):
+    return diagnostic_year_queryset.aggregate(**diagnostic_statistics_aggregates())
 
 
-class CanteenStatisticsView(APIView):
+def badges_for_queryset(diagnostic_year_queryset):
+    """
+    The badges are stored on the diagnostics when they are saved, see Diagnostic.populate_badges
+    """
+    return {
+        "appro": diagnostic_year_queryset.filter(has_appro_badge=True),
+        "waste": diagnostic_year_queryset.filter(has_waste_badge=True),
+        "diversification": diagnostic_year_queryset.filter(has_diversification_badge=True),
+        "plastic": diagnostic_year_queryset.filter(has_plastic_badge=True),
+        "info": diagnostic_year_queryset.filter(has_info_badge=True),
+    }
+
+
+class CanteenStatisticsView(CachedResponseMixin, APIView):
+    cache_groups = ["canteens"]
+
     def get(self, request):
-        regions = request.query_params.getlist("region")
-        departments = request.query_params.getlist("department")
-        sector_categories = request.query_params.getlist("sectors")
-        epcis = request.query_params.getlist("epci")
-        city_insee_codes = None
         year = request.query_params.get("year")
         if not year:
             return JsonResponse({"error": "Expected year"}, status=status.HTTP_400_BAD_REQUEST)
 
         data = {}
-        try:
-            city_insee_codes = CanteenStatisticsView._get_city_insee_codes(epcis)
-        except Exception as e:
-            logger.warning(f"Error when fetching INSEE codes for EPCI for canteen stats: {str(e)}")
-            data["epci_error"] = "Une erreur est survenue"
-
-        canteens = CanteenStatisticsView._filter_canteens(regions, departments, city_insee_codes, sector_categories)
-        data["canteen_count"] = canteens.count()
-        data["published_canteen_count"] = canteens.publicly_visible().count()
-
-        diagnostics = CanteenStatisticsView._filter_diagnostics(
-            year, regions, departments, city_insee_codes, sector_categories
-        )
-
-        appro_share_query = diagnostics.filter(value_total_ht__gt=0)
-        appro_share_query = appro_share_query.annotate(
-            bio_share=Cast(Sum("value_bio_ht", default=0) / Sum("value_total_ht"), FloatField())
-        )
-        appro_share_query = appro_share_query.annotate(
-            sustainable_share=Cast(
-                (
-                    Sum("value_sustainable_ht", default=0)
-                    + Sum("value_externality_performance_ht", default=0)
-                    + Sum("value_egalim_others_ht", default=0)
-                )
-                / Sum("value_total_ht"),
-                FloatField(),
-            )
-        )
-        agg = appro_share_query.aggregate(Avg("bio_share"), Avg("sustainable_share"))
+        filters = CanteenStatisticsView._get_filters(request.query_params, data)
+        if CanteenStatisticsView._use_cube(filters):
+            statistics = CanteenStatisticsView._cube_statistics(year, filters)
+        else:
+            statistics = CanteenStatisticsView._table_statistics(year, filters)
+
+        data["canteen_count"] = statistics["canteen_count"]
+        data["published_canteen_count"] = statistics["published_canteen_count"]
+        data.update(CanteenStatisticsView._diagnostic_percentages(statistics))
+        data["sector_categories"] = statistics["sector_categories"]
+        return CanteenStatisticsView._statistics_response(data)
+
+    def _statistics_response(data):
+        """
+        The statistics computed without the failed EPCI filter are neither cached by the browsers nor by the views
+        """
+        response = JsonResponse(camelize(data), status=status.HTTP_200_OK)
+        if "epci_error" in data:
+            add_never_cache_headers(response)
+        return response
+
+    def _get_filters(query_params, data):
+        """
+        The geographic and sector filters of the statistics. An error resolving the EPCIs is reported in `data`
+        """
+        filters = {
+            "regions": query_params.getlist("region"),
+            "departments": query_params.getlist("department"),
+            "epcis": None,
+            "city_insee_codes": None,
+            "sectors": query_params.getlist("sectors"),
+        }
+        epcis = query_params.getlist("epci")
+        if epcis and get_geo_referential():
+            # The canteens store the EPCI of their commune in the referential, see Canteen.refresh_epcis
+            filters["epcis"] = epcis
+        elif epcis:
+            try:
+                filters["city_insee_codes"] = CanteenStatisticsView._get_city_insee_codes(epcis)
+            except Exception as e:
+                logger.warning(f"Error when fetching INSEE codes for EPCI for canteen stats: {str(e)}")
+                data["epci_error"] = "Une erreur est survenue"
+        return filters
+
+    def _use_cube(filters):
+        """
+        The cells are keyed by the stored EPCIs, the communes fetched from the geo API are filtered in the tables
+        """
+        return filters["city_insee_codes"] is None and CanteenStatisticsCell.is_built()
+
+    def _diagnostic_percentages(statistics):
+        data = {}
         # no need for particularly fancy rounding
-        data["bio_percent"] = int((agg["bio_share__avg"] or 0) * 100)
-        data["sustainable_percent"] = int((agg["sustainable_share__avg"] or 0) * 100)
+        data["bio_percent"] = int((statistics["bio_share_avg"] or 0) * 100)
+        data["sustainable_percent"] = int((statistics["sustainable_share_avg"] or 0) * 100)
 
         # --- badges ---
-        total_diag = diagnostics.count()
+        total_diag = statistics["diagnostics_count"]
         data["diagnostics_count"] = total_diag
         data["approPercent"] = 0
         data["wastePercent"] = 0
@@ -900,24 +1071,78 @@ class CanteenStatisticsView(APIView):
         data["infoPercent"] = 0
 
         if total_diag:  # maybe we shouldn't be able to get to 0 diags this point with the endpoint?
-            badge_querysets = badges_for_queryset(diagnostics)
-            data["approPercent"] = int(badge_querysets["appro"].count() / total_diag * 100)
-            data["wastePercent"] = int(badge_querysets["waste"].count() / total_diag * 100)
-            data["diversificationPercent"] = int(badge_querysets["diversification"].count() / total_diag * 100)
-            data["plasticPercent"] = int(badge_querysets["plastic"].count() / total_diag * 100)
-            data["infoPercent"] = int(badge_querysets["info"].count() / total_diag * 100)
-
-        # count breakdown by sector category
-        sector_categories = {}
-        for category in Sector.Categories:
-            sectors = Sector.objects.filter(category=category)
-            sector_categories[category] = canteens.filter(sectors__in=sectors).count()
-        sectors = Sector.objects.filter(category=None)
-        sector_categories["inconnu"] = canteens.filter(sectors__in=sectors).count()
-        data["sector_categories"] = sector_categories
-        return JsonResponse(camelize(data), status=status.HTTP_200_OK)
+            data["approPercent"] = int(statistics["appro_badge_count"] / total_diag * 100)
+            data["wastePercent"] = int(statistics["waste_badge_count"] / total_diag * 100)
+            data["diversificationPercent"] = int(statistics["diversification_badge_count"] / total_diag * 100)
+            data["plasticPercent"] = int(statistics["plastic_badge_count"] / total_diag * 100)
+            data["infoPercent"] = int(statistics["info_badge_count"] / total_diag * 100)
+        return data
+
+    def _table_statistics(year, filters):
+        """
+        The statistics computed from the canteens and diagnostics tables, until the cube has been built
+        """
+        canteens = CanteenStatisticsView._filter_canteens(**filters)
+        diagnostics = CanteenStatisticsView._filter_diagnostics([year], **filters)
+        statistics = diagnostic_statistics_for_queryset(diagnostics)
+        statistics["canteen_count"] = canteens.count()
+        statistics["published_canteen_count"] = canteens.publicly_visible().count()
+
+        statistics["sector_categories"] = canteens.sector_category_counts()
+        return statistics
+
+    def _cube_statistics(year, filters):
+        """
+        The same statistics summed from the cells of the cube, see CanteenStatisticsCell
+        """
+        cells = CanteenStatisticsView._filter_cells(**filters)
+
+        category_sector_ids = {category: [] for category in Sector.Categories}
+        category_sector_ids["inconnu"] = []
+        for sector_id, category in Sector.objects.values_list("id", "category"):
+            if (category or "inconnu") in category_sector_ids:
+                category_sector_ids[category or "inconnu"].append(sector_id)
+
+        canteen_sums = cells.filter(year=None).aggregate(
+            total_canteen_count=Sum("canteen_count", default=0),
+            total_published_canteen_count=Sum("published_canteen_count", default=0),
+            **{
+                category: Sum("canteen_count", filter=Q(sector_ids__overlap=sector_ids), default=0)
+                for category, sector_ids in category_sector_ids.items()
+            },
+        )
+        diagnostic_sums = cells.filter(year=year).aggregate(**CanteenStatisticsView._cell_sums())
+
+        statistics = CanteenStatisticsView._cell_statistics(diagnostic_sums)
+        statistics["canteen_count"] = canteen_sums["total_canteen_count"]
+        statistics["published_canteen_count"] = canteen_sums["total_published_canteen_count"]
+        statistics["sector_categories"] = {category: canteen_sums[category] for category in category_sector_ids}
+        return statistics
+
+    def _cell_sums():
+        return {f"total_{field}": Sum(field, default=0) for field in CanteenStatisticsCell.diagnostic_measure_fields}
+
+    def _cell_statistics(sums):
+        """
+        The diagnostic statistics of the sums of the measures of the cells
+        """
+        return {
+            "diagnostics_count": sums["total_diagnostic_count"],
+            "bio_share_avg": (
+                sums["total_bio_share_sum"] / sums["total_bio_share_count"] if sums["total_bio_share_count"] else None
+            ),
+            "sustainable_share_avg": (
+                sums["total_sustainable_share_sum"] / sums["total_appro_diagnostic_count"]
+                if sums["total_appro_diagnostic_count"]
+                else None
+            ),
+            **{f"{badge}_badge_count": sums[f"total_{badge}_badge_count"] for badge in BADGES},
+        }
 
     def _get_city_insee_codes(epcis):
+        """
+        Without the geo referential, the communes of the EPCIs are fetched from the geo API
+        """
         city_insee_codes = []
         for e in epcis:
             response = requests.get(f"https://geo.api.gouv.fr/epcis/{e}/communes?fields=code", timeout=5)
@@ -927,9 +1152,11 @@ class CanteenStatisticsView(APIView):
                 city_insee_codes.append(commune["code"])
         return city_insee_codes
 
-    def _filter_canteens(regions, departments, city_insee_codes, sectors):
+    def _filter_canteens(regions, departments, epcis, city_insee_codes, sectors):
         canteens = Canteen.objects
-        if city_insee_codes:
+        if epcis:
+            canteens = canteens.filter(epci__in=epcis)
+        elif city_insee_codes:
             canteens = canteens.filter(city_insee_code__in=city_insee_codes)
         elif departments:
             canteens = canteens.filter(department__in=departments)
@@ -940,20 +1167,105 @@ class CanteenStatisticsView(APIView):
             canteens = canteens.filter(sectors__in=sectors)
         return canteens.distinct()
 
-    def _filter_diagnostics(year, regions, departments, city_insee_codes, sectors):
-        diagnostics = Diagnostic.objects.filter(year=year)
-        if city_insee_codes:
+    def _filter_diagnostics(years, regions, departments, epcis, city_insee_codes, sectors):
+        diagnostics = Diagnostic.objects.filter(year__in=years)
+        if epcis:
+            diagnostics = diagnostics.filter(canteen__epci__in=epcis)
+        elif city_insee_codes:
             diagnostics = diagnostics.filter(canteen__city_insee_code__in=city_insee_codes)
         elif departments:
             diagnostics = diagnostics.filter(canteen__department__in=departments)
         elif regions:
             diagnostics = diagnostics.filter(canteen__region__in=regions)
         if sectors:
-            diagnostics = diagnostics.filter(canteen__sectors__in=sectors)
-        return diagnostics.distinct()
+            # A semi-join rather than a join, each diagnostic being counted once
+            canteen_ids = Canteen.sectors.through.objects.filter(sector_id__in=sectors).values("canteen_id")
+            diagnostics = diagnostics.filter(canteen_id__in=canteen_ids)
+        return diagnostics
+
+    def _filter_cells(regions, departments, epcis, city_insee_codes, sectors):
+        """
+        The cells are only read without the communes of the geo API, see _use_cube
+        """
+        cells = CanteenStatisticsCell.objects.all()
+        if epcis:
+            cells = cells.filter(epci__in=epcis)
+        elif departments:
+            cells = cells.filter(department__in=departments)
+        elif regions:
+            cells = cells.filter(region__in=regions)
+        if sectors:
+            cells = cells.filter(sector_ids__overlap=[int(s) for s in sectors if s.isdigit()])
+        return cells
+
+
+class CanteenStatisticsTimeSeriesView(CanteenStatisticsView):
+    """
+    The diagnostic statistics of several years, e.g. for year-over-year comparisons. The years are either repeated
+    `year` parameters or the `min_year` to `max_year` range, and their statistics come from a single query grouped by
+    year, the geographic and sector filters being resolved once
+    """
 
+    max_years = 30
+
+    def get(self, request):
+        years = CanteenStatisticsTimeSeriesView._get_years(request.query_params, self.max_years)
+        if not years:
+            return JsonResponse(
+                {"error": f"Expected up to {self.max_years} years, or a range"}, status=status.HTTP_400_BAD_REQUEST
+            )
+
+        data = {}
+        filters = CanteenStatisticsView._get_filters(request.query_params, data)
+        if CanteenStatisticsView._use_cube(filters):
+            rows = (
+                CanteenStatisticsView._filter_cells(**filters)
+                .filter(year__in=years)
+                .values("year")
+                .annotate(**CanteenStatisticsView._cell_sums())
+                .order_by()
+            )
+            statistics_by_year = {row["year"]: CanteenStatisticsView._cell_statistics(row) for row in rows}
+        else:
+            rows = (
+                CanteenStatisticsView._filter_diagnostics(years, **filters)
+                .values("year")
+                .annotate(**diagnostic_statistics_aggregates())
+                .order_by()
+            )
+            statistics_by_year = {row["year"]: row for row in rows}
+
+        no_statistics = {"diagnostics_count": 0, "bio_share_avg": None, "sustainable_share_avg": None}
+        data["years"] = [
+            {
+                "year": year,
+                **CanteenStatisticsView._diagnostic_percentages(statistics_by_year.get(year, no_statistics)),
+            }
+            for year in years
+        ]
+        return CanteenStatisticsView._statistics_response(data)
+
+    def _get_years(query_params, max_years):
+        """
+        The requested years, None when they are invalid or more than `max_years`, checked before building them
+        """
+        try:
+            if query_params.get("min_year") and query_params.get("max_year"):
+                min_year, max_year = int(query_params["min_year"]), int(query_params["max_year"])
+                if max_year - min_year + 1 > max_years:
+                    return None
+                return list(range(min_year, max_year + 1))
+            years = query_params.getlist("year")
+            if len(years) > max_years:
+                return None
+            return sorted({int(year) for year in years})
+        except ValueError:
+            return None
+
+
+class CanteenLocationsView(CachedResponseMixin, APIView):
+    cache_groups = ["canteens"]
 
-class CanteenLocationsView(APIView):
     def get(self, _):
         canteens = Canteen.objects
         data = {}
@@ -1287,7 +1599,12 @@ class TerritoryCanteensListView(ListAPIView):
 
     def get_queryset(self):
         departments = self.request.user.departments
-        return Canteen.objects.filter(department__in=departments)
+        return Canteen.objects.filter(department__in=departments).prefetch_related("sectors", "managers")
+
+    def paginate_queryset(self, queryset):
+        page = super().paginate_queryset(queryset)
+        prefetch_diagnostics(page or [])
+        return page
 
 
 @extend_schema_view(
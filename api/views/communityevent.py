@@ -2,9 +2,11 @@ from api.serializers import CommunityEventSerializer
 from data.models import CommunityEvent
 from django.utils import timezone
 from rest_framework.generics import ListAPIView
+from .utils import CachedResponseMixin
 
 
-class CommunityEventsView(ListAPIView):
+class CommunityEventsView(CachedResponseMixin, ListAPIView):
     model = CommunityEvent
     serializer_class = CommunityEventSerializer
     queryset = CommunityEvent.objects.filter(end_date__gt=timezone.now())
+    cache_groups = ["community_events"]
@@ -371,8 +371,8 @@ class ImportDiagnosticsView(ABC, APIView):
         canteen.city_insee_code = row[2].strip()
         canteen.postal_code = row[3].strip()
         canteen.central_producer_siret = normalise_siret(row[4])
-        canteen.daily_meal_count = row[5].strip()
-        canteen.yearly_meal_count = row[6].strip()
+        canteen.daily_meal_count = int(row[5].strip())
+        canteen.yearly_meal_count = int(row[6].strip())
         canteen.production_type = row[8].strip().lower()
         canteen.management_type = row[9].strip().lower()
         canteen.economic_model = row[10].strip().lower() if len(row) > 10 else None
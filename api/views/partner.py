@@ -8,7 +8,7 @@ from rest_framework.pagination import LimitOffsetPagination
 from rest_framework.response import Response
 from api.serializers import PartnerSerializer, PartnerShortSerializer, PartnerContactSerializer
 from data.models import Partner
-from .utils import UnaccentSearchFilter
+from .utils import IndexedSearchFilter
 
 logger = logging.getLogger(__name__)
 
@@ -59,7 +59,7 @@ class PartnersPagination(LimitOffsetPagination):
 class PartnersView(ListCreateAPIView):
     model = Partner
     pagination_class = PartnersPagination
-    filter_backends = [DjangoFilterBackend, UnaccentSearchFilter]
+    filter_backends = [DjangoFilterBackend, IndexedSearchFilter]
     search_fields = ["name"]
 
     def get_serializer_class(self):
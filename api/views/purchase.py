@@ -4,7 +4,6 @@ from rest_framework.pagination import LimitOffsetPagination
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from drf_excel.renderers import XLSXRenderer
 from drf_excel.mixins import XLSXFileMixin
 from django.core.exceptions import BadRequest, ObjectDoesNotExist, ValidationError
 from django.db.models import Sum, Q
@@ -19,9 +18,11 @@ from api.serializers import (
     PurchaseExportSerializer,
 )
 from data.models import Purchase, Canteen, Diagnostic
-from .utils import MaCantineOrderingFilter, UnaccentSearchFilter
+from .utils import MaCantineOrderingFilter, StreamingXLSXRenderer, IndexedSearchFilter
 from collections import OrderedDict
+from functools import reduce
 import logging
+import operator
 
 
 logger = logging.getLogger(__name__)
@@ -98,7 +99,7 @@ class PurchaseListCreateView(ListCreateAPIView):
     pagination_class = PurchasesPagination
     filter_backends = [
         MaCantineOrderingFilter,
-        UnaccentSearchFilter,
+        IndexedSearchFilter,
         django_filters.DjangoFilterBackend,
     ]
     ordering_fields = [
@@ -233,32 +234,23 @@ class CanteenPurchasesPercentageSummaryView(APIView):
 
 
 def canteen_summary_for_year(canteen, year):
-    purchases = Purchase.objects.only("id", "family", "characteristics", "price_ht").filter(
-        canteen=canteen, date__year=year
-    )
-    data = {}
-    simple_diag_data(purchases, data)
-    complete_diag_data(purchases, data)
-    misc_totals(purchases, data)
-
-    return data
+    purchases = Purchase.objects.filter(canteen=canteen, date__year=year)
+    aggregates = {**simple_diag_aggregates(), **complete_diag_aggregates(), **misc_totals_aggregates()}
+    return purchase_totals(purchases, aggregates)
 
 
 def canteen_summary(canteen):
-    data = {"results": []}
+    """
+    The simple totals of every year with purchases, from a single query grouped by year
+    """
+    aggregates = simple_diag_aggregates()
     years = (
-        Purchase.objects.filter(canteen=canteen).annotate(year=ExtractYear("date")).order_by("year").distinct("year")
+        Purchase.objects.filter(canteen=canteen)
+        .values(year=ExtractYear("date"))
+        .annotate(**aggregates)
+        .order_by("year")
     )
-    years = [y["year"] for y in years.values()]
-    for year in years:
-        year_data = {"year": year}
-        purchases = Purchase.objects.only("id", "family", "characteristics", "price_ht").filter(
-            canteen=canteen, date__year=year
-        )
-        simple_diag_data(purchases, year_data)
-        data["results"].append(year_data)
-
-    return data
+    return {"results": [{"year": row["year"], **{key: row[key] or 0 for key in aggregates}} for row in years]}
 
 
 # the order of EGALIM_LABELS is significant - determines which labels trump others when aggregating purchases
@@ -291,51 +283,59 @@ PURCHASE_EGALIM_LABELS = [
 ]
 
 
-def simple_diag_data(purchases, data):
+def _contains_any(characteristics):
+    return reduce(operator.or_, [Q(characteristics__contains=[characteristic]) for characteristic in characteristics])
+
+
+def purchase_totals(purchases, aggregates):
+    """
+    Compute the totals of the purchases in a single statement, each total being a sum filtered on the purchases it
+    counts (SUM(price_ht) FILTER (WHERE ...)). The totals without purchases are 0
+    """
+    totals = purchases.aggregate(**aggregates)
+    return {key: totals[key] or 0 for key in aggregates}
+
+
+def simple_diag_aggregates():
     # TODO: is CONVERSION_BIO used?
-    bio_filter = Q(characteristics__contains=[Purchase.Characteristic.BIO]) | Q(
-        characteristics__contains=[Purchase.Characteristic.CONVERSION_BIO]
-    )
-    siqo_filter = (
-        Q(characteristics__contains=[Purchase.Characteristic.LABEL_ROUGE])
-        | Q(characteristics__contains=[Purchase.Characteristic.AOCAOP])
-        | Q(characteristics__contains=[Purchase.Characteristic.IGP])
-        | Q(characteristics__contains=[Purchase.Characteristic.STG])
+    bio_filter = _contains_any([Purchase.Characteristic.BIO, Purchase.Characteristic.CONVERSION_BIO])
+    siqo_filter = _contains_any(
+        [
+            Purchase.Characteristic.LABEL_ROUGE,
+            Purchase.Characteristic.AOCAOP,
+            Purchase.Characteristic.IGP,
+            Purchase.Characteristic.STG,
+        ]
     )
-    egalim_others_filter = (
-        Q(characteristics__contains=[Purchase.Characteristic.HVE])
-        | Q(characteristics__contains=[Purchase.Characteristic.PECHE_DURABLE])
-        | Q(characteristics__contains=[Purchase.Characteristic.RUP])
-        | Q(characteristics__contains=[Purchase.Characteristic.FERMIER])
-        | Q(characteristics__contains=[Purchase.Characteristic.COMMERCE_EQUITABLE])
+    egalim_others_filter = _contains_any(
+        [
+            Purchase.Characteristic.HVE,
+            Purchase.Characteristic.PECHE_DURABLE,
+            Purchase.Characteristic.RUP,
+            Purchase.Characteristic.FERMIER,
+            Purchase.Characteristic.COMMERCE_EQUITABLE,
+        ]
     )
-    externalities_performance_filter = Q(characteristics__contains=[Purchase.Characteristic.EXTERNALITES]) | Q(
-        characteristics__contains=[Purchase.Characteristic.PERFORMANCE]
+    externalities_performance_filter = _contains_any(
+        [Purchase.Characteristic.EXTERNALITES, Purchase.Characteristic.PERFORMANCE]
     )
 
-    data["value_total_ht"] = purchases.aggregate(total=Sum("price_ht"))["total"] or 0
-    bio_purchases = purchases.filter(bio_filter).distinct()
-    data["value_bio_ht"] = bio_purchases.aggregate(total=Sum("price_ht"))["total"] or 0
-
-    # the remaining stats should ignore any bio products
-    purchases_no_bio = purchases.exclude(bio_filter)
-    siqo_purchases = purchases_no_bio.filter(siqo_filter).distinct()
-    data["value_sustainable_ht"] = siqo_purchases.aggregate(total=Sum("price_ht"))["total"] or 0
-
-    # the remaining stats should ignore any SIQO products
-    purchases_no_siqo = purchases_no_bio.exclude(siqo_filter)
-    egalim_others_purchases = purchases_no_siqo.filter(egalim_others_filter).distinct()
-    data["value_egalim_others_ht"] = egalim_others_purchases.aggregate(total=Sum("price_ht"))["total"] or 0
-
-    # the remaining stats should ignore any "other Egalim" products
-    purchases_no_other = purchases_no_siqo.exclude(egalim_others_filter)
-    externalities_performance_purchases = purchases_no_other.filter(externalities_performance_filter).distinct()
-    data["value_externality_performance_ht"] = (
-        externalities_performance_purchases.aggregate(total=Sum("price_ht"))["total"] or 0
-    )
+    return {
+        "value_total_ht": Sum("price_ht"),
+        "value_bio_ht": Sum("price_ht", filter=bio_filter),
+        # the remaining stats should ignore any bio products
+        "value_sustainable_ht": Sum("price_ht", filter=~bio_filter & siqo_filter),
+        # the remaining stats should ignore any SIQO products
+        "value_egalim_others_ht": Sum("price_ht", filter=~bio_filter & ~siqo_filter & egalim_others_filter),
+        # the remaining stats should ignore any "other Egalim" products
+        "value_externality_performance_ht": Sum(
+            "price_ht",
+            filter=~bio_filter & ~siqo_filter & ~egalim_others_filter & externalities_performance_filter,
+        ),
+    }
 
 
-def complete_diag_data(purchases, data):
+def complete_diag_aggregates():
     # summary for detailed teledeclaration totals, by family and label
     families = [
         "VIANDES_VOLAILLES",
@@ -349,69 +349,58 @@ def complete_diag_data(purchases, data):
     ]
     other_labels = ["FRANCE", "SHORT_DISTRIBUTION", "LOCAL"]
 
+    aggregates = {}
     for family in families:
-        purchase_family = purchases.filter(family=family)
+        family_filter = Q(family=family)
+        counted_characteristics = []
         for label in DIAGNOSTIC_EGALIM_LABELS:
             if label == "AOCAOP_IGP_STG":
-                fam_label = purchase_family.filter(
-                    Q(characteristics__contains=[Purchase.Characteristic.AOCAOP])
-                    | Q(characteristics__contains=[Purchase.Characteristic.IGP])
-                    | Q(characteristics__contains=[Purchase.Characteristic.STG])
-                ).distinct()
-                # the remaining stats should ignore already counted labels
-                purchase_family = purchase_family.exclude(
-                    Q(characteristics__contains=[Purchase.Characteristic.AOCAOP])
-                    | Q(characteristics__contains=[Purchase.Characteristic.IGP])
-                    | Q(characteristics__contains=[Purchase.Characteristic.STG])
-                )
+                characteristics = [
+                    Purchase.Characteristic.AOCAOP,
+                    Purchase.Characteristic.IGP,
+                    Purchase.Characteristic.STG,
+                ]
             else:
-                fam_label = purchase_family.filter(Q(characteristics__contains=[Purchase.Characteristic[label]]))
-                # the remaining stats should ignore already counted labels
-                purchase_family = purchase_family.exclude(
-                    Q(characteristics__contains=[Purchase.Characteristic[label]])
-                )
+                characteristics = [Purchase.Characteristic[label]]
+            label_filter = family_filter & _contains_any(characteristics)
+            # the remaining stats should ignore already counted labels
+            if counted_characteristics:
+                label_filter &= ~_contains_any(counted_characteristics)
+            counted_characteristics += characteristics
             key = "value_" + family.lower() + "_" + label.lower()
-            data[key] = fam_label.aggregate(total=Sum("price_ht"))["total"] or 0
+            aggregates[key] = Sum("price_ht", filter=label_filter)
         # outside of EGAlim, products can be counted twice across characteristics
-        purchase_family = purchases.filter(family=family)
         other_labels_characteristics = []
         for label in other_labels:
             characteristic = Purchase.Characteristic[label]
-            fam_label = purchase_family.filter(Q(characteristics__contains=[characteristic]))
             key = "value_" + family.lower() + "_" + label.lower()
-            data[key] = fam_label.aggregate(total=Sum("price_ht"))["total"] or 0
+            aggregates[key] = Sum("price_ht", filter=family_filter & Q(characteristics__contains=[characteristic]))
             other_labels_characteristics.append(characteristic)
         # Non-EGAlim totals: contains no labels or only one or more of other_labels
-        non_egalim_purchases = purchase_family.filter(
+        non_egalim_filter = family_filter & (
             Q(characteristics__contained_by=(other_labels_characteristics + [""])) | Q(characteristics__len=0)
-        ).distinct()
+        )
         key = "value_" + family.lower() + "_non_egalim"
-        data[key] = non_egalim_purchases.aggregate(total=Sum("price_ht"))["total"] or 0
-
-
-def misc_totals(purchases, data):
-    meat_poultry_purchases = purchases.filter(
-        family=Purchase.Family.VIANDES_VOLAILLES,
-    )
-    data["value_meat_poultry_ht"] = meat_poultry_purchases.aggregate(total=Sum("price_ht"))["total"] or 0
-
-    meat_poultry_egalim = meat_poultry_purchases.filter(characteristics__overlap=PURCHASE_EGALIM_LABELS)
-    data["value_meat_poultry_egalim_ht"] = meat_poultry_egalim.aggregate(total=Sum("price_ht"))["total"] or 0
-
-    meat_poultry_france = meat_poultry_purchases.filter(
-        characteristics__contains=[
-            "FRANCE",
-        ]
-    )
-    data["value_meat_poultry_france_ht"] = meat_poultry_france.aggregate(total=Sum("price_ht"))["total"] or 0
-
-    fish_purchases = purchases.filter(
-        family=Purchase.Family.PRODUITS_DE_LA_MER,
-    )
-    data["value_fish_ht"] = fish_purchases.aggregate(total=Sum("price_ht"))["total"] or 0
-
-    fish_egalim = fish_purchases.filter(characteristics__overlap=PURCHASE_EGALIM_LABELS)
-    data["value_fish_egalim_ht"] = fish_egalim.aggregate(total=Sum("price_ht"))["total"] or 0
+        aggregates[key] = Sum("price_ht", filter=non_egalim_filter)
+    return aggregates
+
+
+def misc_totals_aggregates():
+    meat_poultry_filter = Q(family=Purchase.Family.VIANDES_VOLAILLES)
+    fish_filter = Q(family=Purchase.Family.PRODUITS_DE_LA_MER)
+    return {
+        "value_meat_poultry_ht": Sum("price_ht", filter=meat_poultry_filter),
+        "value_meat_poultry_egalim_ht": Sum(
+            "price_ht", filter=meat_poultry_filter & Q(characteristics__overlap=PURCHASE_EGALIM_LABELS)
+        ),
+        "value_meat_poultry_france_ht": Sum(
+            "price_ht", filter=meat_poultry_filter & Q(characteristics__contains=["FRANCE"])
+        ),
+        "value_fish_ht": Sum("price_ht", filter=fish_filter),
+        "value_fish_egalim_ht": Sum(
+            "price_ht", filter=fish_filter & Q(characteristics__overlap=PURCHASE_EGALIM_LABELS)
+        ),
+    }
 
 
 class DiagnosticsFromPurchasesView(APIView):
@@ -455,7 +444,7 @@ class DiagnosticsFromPurchasesView(APIView):
 
 
 class PurchaseListExportView(PurchaseListCreateView, XLSXFileMixin):
-    renderer_classes = (XLSXRenderer,)
+    renderer_classes = (StreamingXLSXRenderer,)
     pagination_class = None
     serializer_class = PurchaseExportSerializer
 
@@ -470,20 +459,6 @@ class PurchaseListExportView(PurchaseListCreateView, XLSXFileMixin):
             "Prix HT",
         ],
         "column_width": [18, 25, 25, 20, 35, 35, 10],
-        "style": {
-            "font": {
-                "bold": True,
-            },
-        },
-    }
-    body = {
-        "style": {
-            "alignment": {
-                "horizontal": "left",
-                "vertical": "center",
-            },
-        },
-        "height": 20,
     }
 
     def post(self, request, *args, **kwargs):
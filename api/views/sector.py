@@ -2,6 +2,7 @@ import logging
 from rest_framework.generics import ListAPIView
 from drf_spectacular.utils import extend_schema_view, extend_schema
 from api.serializers import SectorSerializer
+from api.views.utils import CachedResponseMixin
 from data.models import Sector
 
 logger = logging.getLogger(__name__)
@@ -13,9 +14,10 @@ logger = logging.getLogger(__name__)
         description="Une cantine peut s'assigner un ou plusieurs secteurs d'activité.",
     ),
 )
-class SectorListView(ListAPIView):
+class SectorListView(CachedResponseMixin, ListAPIView):
     include_in_documentation = True
     required_scopes = ["canteen"]
     model = Sector
     serializer_class = SectorSerializer
     queryset = Sector.objects.all()
+    cache_groups = ["sectors"]
@@ -1,12 +1,25 @@
+import hashlib
 import logging
 import json
+import operator
+from functools import reduce
+from io import BytesIO
+from urllib.parse import urlencode
+from django.contrib.postgres.search import SearchRank
 from django.db.models.constants import LOOKUP_SEP
-from django.db.models import F
-from rest_framework import filters
+from django.db.models import F, Q, Value
+from django.db.models.lookups import IContains
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from rest_framework import filters, renderers, status
 from djangorestframework_camel_case.render import CamelCaseJSONRenderer
 from djangorestframework_camel_case.util import camel_to_underscore
 from djangorestframework_camel_case.settings import api_settings
 from simple_history.utils import update_change_reason
+from common.utils.response_cache import get_cached_response, set_cached_response
+from common.utils.xlsx import write_xlsx
+from data.search import ImmutableUnaccent, PrefixSearchQuery, SearchDocument, SearchMatch
 
 logger = logging.getLogger(__name__)
 
@@ -81,3 +94,173 @@ class UnaccentSearchFilter(filters.SearchFilter):
                 lookup,
             ]
         )
+
+
+class IndexedSearchFilter(filters.SearchFilter):
+    """
+    Unaccented search on the `search_fields`, backed by the indexes of the models :
+    - by default each term is searched within the fields, as with UnaccentSearchFilter, on the
+      UPPER(immutable_unaccent(field)) expression covered by the trigram indexes
+    - with `search_mode=prefix`, for search-as-you-type, the words of the fields must start with the terms, which
+      uses the full text index of the SearchDocument of the fields
+    Unless an ordering is requested, the results are ranked by relevance before the default ordering, the rank being
+    divided by the length of the document so that the shortest names matching the words come first.
+    """
+
+    search_mode_param = "search_mode"
+    prefix_mode = "prefix"
+
+    def filter_queryset(self, request, queryset, view):
+        search_fields = self.get_search_fields(view, request)
+        search_terms = self.get_search_terms(request)
+        if not search_fields or not search_terms:
+            return queryset
+
+        document = SearchDocument(*search_fields)
+        prefix_query = PrefixSearchQuery(search_terms)
+        if request.query_params.get(self.search_mode_param) == self.prefix_mode and prefix_query.has_words:
+            queryset = queryset.filter(SearchMatch(document, prefix_query))
+        else:
+            for term in search_terms:
+                queryset = queryset.filter(
+                    reduce(
+                        operator.or_,
+                        [
+                            Q(IContains(ImmutableUnaccent(field_name), ImmutableUnaccent(Value(term))))
+                            for field_name in search_fields
+                        ],
+                    )
+                )
+
+        if prefix_query.has_words and not request.query_params.get(filters.OrderingFilter.ordering_param):
+            ordering = queryset.query.order_by or queryset.model._meta.ordering
+            queryset = queryset.order_by(SearchRank(document, prefix_query, normalization=1).desc(), *ordering)
+        return queryset
+
+
+class ConditionalGetMixin:
+    """
+    Answers the conditional GETs of anonymous users with a 304 Not Modified before the data is queried and
+    serialised. The view implements `get_validators`, returning the ETag and the last modification datetime of the
+    response, or None when they cannot be computed cheaply, e.g. for an object that does not exist.
+    The responses of authenticated users can depend on the user (e.g. is_managed_by_user) and are not cached.
+    """
+
+    cache_max_age = 60
+
+    def get(self, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            response = super().get(request, *args, **kwargs)
+            patch_cache_control(response, private=True, no_cache=True)
+            patch_vary_headers(response, ["Accept", "Authorization", "Cookie"])
+            return response
+
+        validators = self.get_validators(request, *args, **kwargs)
+        etag, last_modified = validators or (None, None)
+        if etag:
+            # The browsable API and the JSON renderings of a resource are different representations
+            etag = quote_etag(f"{request.accepted_renderer.format}-{etag}")
+        last_modified = int(last_modified.timestamp()) if last_modified else None
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+        if response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            if etag:
+                response.headers["ETag"] = etag
+            if last_modified:
+                response.headers["Last-Modified"] = http_date(last_modified)
+            patch_cache_control(response, public=True, max_age=self.cache_max_age)
+        patch_vary_headers(response, ["Accept", "Authorization", "Cookie"])
+        return response
+
+    def get_validators(self, request, *args, **kwargs):
+        raise NotImplementedError
+
+
+class CachedResponseMixin:
+    """
+    Caches the JSON responses of the anonymous GETs, keyed by the view, its arguments and the normalised query
+    parameters. The view lists the `cache_groups` of the data it reads, whose generation counters are bumped by
+    the signals of data/signals.py after each write : a cached response is only served if it was built with the
+    current generations. A cache hit costs a single cache round trip, before the request reaches the view.
+    The `cache_timeout` bounds the staleness of the data changed without signals, e.g. by bulk updates
+    """
+
+    cache_groups = []
+    cache_timeout = 60 * 15
+
+    def dispatch(self, request, *args, **kwargs):
+        if not self.is_cacheable_request(request):
+            return super().dispatch(request, *args, **kwargs)
+
+        key = self.get_response_cache_key(request, *args, **kwargs)
+        cached, generations = get_cached_response(key, self.cache_groups)
+        if cached:
+            response = HttpResponse(cached["content"])
+            for header, value in cached["headers"].items():
+                response.headers[header] = value
+            last_modified = parse_http_date_safe(response.headers.get("Last-Modified", ""))
+            return get_conditional_response(
+                request, etag=response.headers.get("ETag"), last_modified=last_modified, response=response
+            )
+
+        response = super().dispatch(request, *args, **kwargs)
+        if generations is not None and self.is_cacheable_response(response):
+            accepted_renderer = getattr(response, "accepted_renderer", None)
+            if getattr(response, "is_rendered", True):
+                set_cached_response(key, generations, response, self.cache_timeout)
+            elif accepted_renderer and accepted_renderer.format == "json":
+                response.add_post_render_callback(
+                    lambda rendered: set_cached_response(key, generations, rendered, self.cache_timeout)
+                )
+        return response
+
+    def is_cacheable_request(self, request):
+        """
+        Only the JSON responses of the anonymous users are cached, the browsable API being rendered as HTML
+        """
+        if request.method != "GET" or "HTTP_AUTHORIZATION" in request.META or request.user.is_authenticated:
+            return False
+        return "format" not in request.GET and "text/html" not in request.META.get("HTTP_ACCEPT", "")
+
+    def is_cacheable_response(self, response):
+        """
+        The responses marked as not storable, e.g. computed despite an error, are not cached either
+        """
+        return response.status_code == status.HTTP_200_OK and "no-store" not in response.get("Cache-Control", "")
+
+    def get_response_cache_key(self, request, *args, **kwargs):
+        params = sorted((key, value) for key in request.GET for value in request.GET.getlist(key))
+        arguments = sorted(kwargs.items())
+        digest = hashlib.md5(f"{arguments}?{urlencode(params)}".encode(), usedforsecurity=False).hexdigest()
+        return f"{self.__class__.__name__}:{digest}"
+
+
+class StreamingXLSXRenderer(renderers.BaseRenderer):
+    """
+    Renders a list of serialized objects as a spreadsheet with the shared write-only xlsx writer.
+    The view can define `column_header = {"titles": [...], "column_width": [...]}`
+    """
+
+    media_type = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    format = "xlsx"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        renderer_context = renderer_context or {}
+        response = renderer_context.get("response")
+        rows = data if isinstance(data, list) else [data]
+        column_header = getattr(renderer_context.get("view"), "column_header", {})
+        header = column_header.get("titles") if not (response and response.exception) else None
+        if not header:
+            header = list(rows[0].keys()) if rows else []
+
+        output = BytesIO()
+        write_xlsx(
+            output,
+            header,
+            (list(row.values()) for row in rows),
+            column_widths=column_header.get("column_width"),
+        )
+        return output.getvalue()
@@ -1,9 +1,11 @@
 from rest_framework.generics import ListAPIView
 from data.models import VideoTutorial
 from api.serializers import VideoTutorialSerializer
+from .utils import CachedResponseMixin
 
 
-class VideoTutorialListView(ListAPIView):
+class VideoTutorialListView(CachedResponseMixin, ListAPIView):
     model = VideoTutorial
     serializer_class = VideoTutorialSerializer
     queryset = VideoTutorial.objects.filter(published=True)
+    cache_groups = ["video_tutorials"]
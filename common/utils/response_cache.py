@@ -0,0 +1,62 @@
+import logging
+import time
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_KEY_PREFIX = "response-cache"
+GENERATION_KEY_PREFIX = "response-cache-generation"
+
+
+def _generation_keys(groups):
+    return [f"{GENERATION_KEY_PREFIX}:{group}" for group in groups]
+
+
+def bump_generations(groups):
+    """
+    Invalidate the cached responses built from the data of the groups, e.g. "canteens" when a canteen is saved.
+    A counter that is missing, e.g. evicted, restarts from the current time so that it cannot take a value
+    a cached response was stored with
+    """
+    for key in _generation_keys(groups):
+        try:
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.set(key, time.time_ns(), timeout=None)
+        except Exception as e:
+            logger.exception(f"Unable to bump the response cache generation {key}: {e}")
+
+
+def get_cached_response(key, groups):
+    """
+    Fetch the cached response and the current generations of its groups in a single round trip.
+    Returns the response, None if missing or stored with other generations, and the current generations
+    """
+    generation_keys = _generation_keys(groups)
+    try:
+        values = cache.get_many([f"{RESPONSE_KEY_PREFIX}:{key}", *generation_keys])
+    except Exception as e:
+        logger.exception(f"Unable to read the response cache: {e}")
+        return None, None
+    generations = [values.get(generation_key) for generation_key in generation_keys]
+    cached = values.get(f"{RESPONSE_KEY_PREFIX}:{key}")
+    if cached and cached["generations"] == generations:
+        return cached, generations
+    return None, generations
+
+
+def set_cached_response(key, generations, response, timeout):
+    """
+    The response is stored with the generations read before it was built : if the data changed meanwhile,
+    the generations have been bumped and the response is never served
+    """
+    cached = {
+        "generations": generations,
+        "content": response.content,
+        "headers": dict(response.headers.items()),
+    }
+    try:
+        cache.set(f"{RESPONSE_KEY_PREFIX}:{key}", cached, timeout=timeout)
+    except Exception as e:
+        logger.exception(f"Unable to write the response cache: {e}")
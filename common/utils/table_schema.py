@@ -0,0 +1,148 @@
+import json
+import pandas as pd
+
+TRUE_VALUES = ["true", "True", "TRUE", "1"]
+FALSE_VALUES = ["false", "False", "FALSE", "0"]
+MISSING_VALUES = [""]
+ROW_NUMBERS_SAMPLE_SIZE = 10
+
+
+def validate_dataframe(df, schema):
+    """
+    Validate a dataframe against a Table Schema (https://specs.frictionlessdata.io/table-schema/), column by column.
+    The report follows the shape of the validata/frictionless report : the errors of the table are grouped by
+    field and error type, with the number of faulty cells and the first row numbers (the header being row 1)
+    """
+    errors = _validate_labels(df, schema["fields"])
+    for field in schema["fields"]:
+        if field["name"] in df.columns:
+            errors += _validate_field(df[field["name"]], field)
+    return {
+        "valid": not errors,
+        "errors": [],
+        "stats": {"errors": len(errors), "fields": len(schema["fields"]), "rows": len(df)},
+        "tasks": [{"valid": not errors, "errors": errors}],
+    }
+
+
+def _error(error_type, note, field_name=None, invalid=None):
+    error = {"type": error_type, "fieldName": field_name, "note": note}
+    if invalid is not None:
+        row_numbers = invalid.to_numpy().nonzero()[0]
+        error["count"] = len(row_numbers)
+        error["rowNumbers"] = [int(position) + 2 for position in row_numbers[:ROW_NUMBERS_SAMPLE_SIZE]]
+    return error
+
+
+def _validate_labels(df, fields):
+    """
+    The labels are compared case sensitively, as with the header_case option of validata
+    """
+    names = [field["name"] for field in fields]
+    columns = list(df.columns)
+    errors = [_error("missing-label", "the column is missing", name) for name in names if name not in columns]
+    errors += [
+        _error("extra-label", "the column is not in the schema", column) for column in columns if column not in names
+    ]
+    expected_order = [name for name in names if name in columns]
+    actual_order = [column for column in columns if column in names]
+    if expected_order != actual_order:
+        errors.append(_error("incorrect-label", f"the columns should be ordered as {expected_order}"))
+    return errors
+
+
+def _missing(values):
+    missing = values.isna()
+    if values.dtype == object:
+        missing |= values.isin(MISSING_VALUES)
+    return missing
+
+
+def _validate_field(values, field):
+    constraints = field.get("constraints", {})
+    missing = _missing(values)
+    errors = []
+    if constraints.get("required") and missing.any():
+        errors.append(_error("constraint-error", 'constraint "required" is "True"', field["name"], missing))
+
+    present = values[~missing]
+    type_errors = _invalid_type(present, field)
+    if type_errors.any():
+        errors.append(
+            _error(
+                "type-error",
+                f'type is "{field["type"]}"',
+                field["name"],
+                type_errors.reindex(values.index, fill_value=False),
+            )
+        )
+    # The constraints are only checked on the values of the right type, as frictionless does
+    present = present[~type_errors]
+    for constraint, value in constraints.items():
+        if constraint == "required":
+            continue
+        invalid = _invalid_constraint(present, constraint, value, field)
+        if invalid is not None and invalid.any():
+            errors.append(
+                _error(
+                    "constraint-error",
+                    f'constraint "{constraint}" is "{value}"',
+                    field["name"],
+                    invalid.reindex(values.index, fill_value=False),
+                )
+            )
+    return errors
+
+
+def _is_json_array(value):
+    if isinstance(value, (list, tuple)):
+        return True
+    if not isinstance(value, str):
+        return False
+    # The arrays are written as quoted csv cells by the ETLs, e.g. "[""a"", ""b""]"
+    if len(value) > 1 and value.startswith('"') and value.endswith('"'):
+        value = value[1:-1].replace('""', '"')
+    try:
+        return isinstance(json.loads(value), list)
+    except ValueError:
+        return False
+
+
+def _invalid_type(values, field):
+    field_type = field["type"]
+    if field_type in ["integer", "number"]:
+        if pd.api.types.is_bool_dtype(values):
+            return pd.Series(True, index=values.index)
+        numbers = pd.to_numeric(values, errors="coerce")
+        invalid = numbers.isna()
+        if field_type == "integer":
+            invalid |= numbers.mod(1).fillna(0) != 0
+        return invalid
+    if field_type == "boolean":
+        if pd.api.types.is_bool_dtype(values):
+            return pd.Series(False, index=values.index)
+        return ~values.isin(TRUE_VALUES + FALSE_VALUES + [True, False])
+    if field_type in ["date", "datetime"]:
+        if pd.api.types.is_datetime64_any_dtype(values):
+            return pd.Series(False, index=values.index)
+        return pd.to_datetime(values, errors="coerce", format="ISO8601").isna()
+    if field_type == "array":
+        return ~values.map(_is_json_array).astype(bool)
+    # Any value written in a csv cell is a valid string
+    return pd.Series(False, index=values.index)
+
+
+def _invalid_constraint(values, constraint, value, field):
+    if constraint == "unique" and value:
+        return values.duplicated(keep=False)
+    if constraint == "enum":
+        return ~values.astype(str).isin([str(item) for item in value])
+    if constraint in ["minimum", "maximum"] and field["type"] in ["integer", "number"]:
+        numbers = pd.to_numeric(values, errors="coerce")
+        return numbers < value if constraint == "minimum" else numbers > value
+    if constraint in ["minLength", "maxLength"] and field["type"] == "string":
+        lengths = values.astype(str).str.len()
+        return lengths < value if constraint == "minLength" else lengths > value
+    if constraint == "pattern":
+        return ~values.astype(str).str.fullmatch(value)
+    return None
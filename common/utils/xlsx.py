@@ -0,0 +1,67 @@
+import io
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+from openpyxl.utils import get_column_letter
+
+XLSX_DATETIME_FORMAT = "%Y-%m-%d %H:%M"
+
+
+class _UnseekableStream(io.RawIOBase):
+    """
+    Hides the seek of the underlying file so that zipfile writes the archive sequentially.
+    This way the storage backend (e.g. the s3 multipart upload) receives the bytes as they are produced
+    """
+
+    def __init__(self, file):
+        self.file = file
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.file.write(b)
+        return len(b)
+
+
+def write_xlsx(file, header, rows, column_widths=None):
+    """
+    Stream rows into an xlsx file with openpyxl's write-only mode, keeping a constant memory footprint.
+    The file can be any writable file-like object, including a file opened from default_storage
+    """
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    for index, width in enumerate(column_widths or [], start=1):
+        sheet.column_dimensions[get_column_letter(index)].width = width
+
+    header_cells = []
+    for title in header:
+        cell = WriteOnlyCell(sheet, value=title)
+        cell.font = Font(bold=True)
+        header_cells.append(cell)
+    sheet.append(header_cells)
+
+    for row in rows:
+        sheet.append(row)
+    workbook.save(_UnseekableStream(file))
+
+
+def write_dataframe_xlsx(file, df, chunk_size=1000):
+    """
+    Stream a dataframe into an xlsx file, converting it to python values one chunk at a time.
+    Timezone aware datetimes are not supported by Excel: they are formatted as strings once for the whole column
+    """
+    datetime_columns = {
+        column: df[column].dt.strftime(XLSX_DATETIME_FORMAT)
+        for column in df.select_dtypes(include=["datetimetz"]).columns
+    }
+
+    def dataframe_rows():
+        for start in range(0, len(df), chunk_size):
+            chunk = df.iloc[start : start + chunk_size].astype(object)
+            for column, values in datetime_columns.items():
+                chunk[column] = values.iloc[start : start + chunk_size]
+            chunk = chunk.where(chunk.notna(), None)
+            yield from chunk.itertuples(index=False, name=None)
+
+    write_xlsx(file, list(df.columns), dataframe_rows())
@@ -0,0 +1,94 @@
+# Generated by Django 5.0.7 on 2026-10-18 19:40
+
+import django.contrib.postgres.fields
+import django.db.models.deletion
+import rest_framework.utils.encoders
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("data", "0148_alter_canteen_line_ministry_and_more"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PublicCanteenCard",
+            fields=[
+                (
+                    "canteen",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="public_card",
+                        serialize=False,
+                        to="data.canteen",
+                        verbose_name="cantine",
+                    ),
+                ),
+                (
+                    "modification_date",
+                    models.DateTimeField(auto_now=True, verbose_name="date de modification"),
+                ),
+                (
+                    "latest_published_year",
+                    models.IntegerField(blank=True, null=True, verbose_name="dernière année publiée"),
+                ),
+                (
+                    "appro_diagnostic",
+                    models.JSONField(
+                        blank=True,
+                        encoder=rest_framework.utils.encoders.JSONEncoder,
+                        null=True,
+                        verbose_name="résumé du dernier diagnostic appro publié",
+                    ),
+                ),
+                (
+                    "appro_badge",
+                    models.BooleanField(blank=True, null=True, verbose_name="badge appro"),
+                ),
+                (
+                    "waste_badge",
+                    models.BooleanField(blank=True, null=True, verbose_name="badge gaspillage"),
+                ),
+                (
+                    "diversification_badge",
+                    models.BooleanField(blank=True, null=True, verbose_name="badge diversification"),
+                ),
+                (
+                    "plastic_badge",
+                    models.BooleanField(blank=True, null=True, verbose_name="badge plastique"),
+                ),
+                (
+                    "info_badge",
+                    models.BooleanField(blank=True, null=True, verbose_name="badge information"),
+                ),
+                (
+                    "sector_ids",
+                    django.contrib.postgres.fields.ArrayField(
+                        base_field=models.IntegerField(),
+                        blank=True,
+                        default=list,
+                        size=None,
+                        verbose_name="secteurs",
+                    ),
+                ),
+                (
+                    "lead_image",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="+",
+                        to="data.canteenimage",
+                        verbose_name="image principale",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "carte publique de cantine",
+                "verbose_name_plural": "cartes publiques de cantines",
+            },
+        ),
+    ]
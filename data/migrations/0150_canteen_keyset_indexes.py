@@ -0,0 +1,45 @@
+# Generated by Django 5.0.7 on 2026-10-18 19:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("data", "0149_publiccanteencard"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="canteen",
+            index=models.Index(
+                models.OrderBy(models.F("name"), nulls_first=True),
+                models.OrderBy(models.F("id")),
+                name="canteen_name_keyset_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="canteen",
+            index=models.Index(
+                models.OrderBy(models.F("creation_date"), nulls_first=True),
+                models.OrderBy(models.F("id")),
+                name="canteen_creation_keyset_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="canteen",
+            index=models.Index(
+                models.OrderBy(models.F("modification_date"), nulls_first=True),
+                models.OrderBy(models.F("id")),
+                name="canteen_modif_keyset_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="canteen",
+            index=models.Index(
+                models.OrderBy(models.F("daily_meal_count"), nulls_first=True),
+                models.OrderBy(models.F("id")),
+                name="canteen_meal_count_keyset_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 5.0.7 on 2026-10-18 20:01
+
+import data.search
+import django.contrib.postgres.indexes
+from django.db import migrations
+
+# unaccent is STABLE as its dictionary could change : the wrapper is declared IMMUTABLE so it can be indexed
+CREATE_IMMUTABLE_UNACCENT = """
+CREATE OR REPLACE FUNCTION immutable_unaccent(text) RETURNS text
+LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+AS $$ SELECT public.unaccent($1) $$;
+"""
+
+TRIGRAM_INDEXES = {
+    "canteen_name_trgm_idx": ("data_canteen", "name"),
+    "canteen_siret_trgm_idx": ("data_canteen", "siret"),
+    "purchase_description_trgm_idx": ("data_purchase", "description"),
+    "purchase_provider_trgm_idx": ("data_purchase", "provider"),
+    "partner_name_trgm_idx": ("data_partner", "name"),
+}
+
+# The contains searches of api.views.utils.IndexedSearchFilter are run on UPPER(immutable_unaccent(field)).
+# pg_trgm is shipped with the contrib modules of Postgres, the indexes are skipped where it is not available
+CREATE_TRIGRAM_INDEXES = (
+    "DO $do$ BEGIN "
+    "IF EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm') THEN "
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm; "
+    + " ".join(
+        f"CREATE INDEX IF NOT EXISTS {name} ON {table} USING gin (UPPER(immutable_unaccent({column})) gin_trgm_ops);"
+        for name, (table, column) in TRIGRAM_INDEXES.items()
+    )
+    + " END IF; END $do$;"
+)
+
+DROP_TRIGRAM_INDEXES = " ".join(f"DROP INDEX IF EXISTS {name};" for name in TRIGRAM_INDEXES)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("data", "0150_canteen_keyset_indexes"),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_IMMUTABLE_UNACCENT, "DROP FUNCTION IF EXISTS immutable_unaccent(text);"),
+        migrations.AddIndex(
+            model_name="canteen",
+            index=django.contrib.postgres.indexes.GinIndex(
+                data.search.SearchDocument("name", "siret"), name="canteen_search_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="partner",
+            index=django.contrib.postgres.indexes.GinIndex(
+                data.search.SearchDocument("name"), name="partner_search_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="purchase",
+            index=django.contrib.postgres.indexes.GinIndex(
+                data.search.SearchDocument("description", "provider"),
+                name="purchase_search_idx",
+            ),
+        ),
+        migrations.RunSQL(CREATE_TRIGRAM_INDEXES, DROP_TRIGRAM_INDEXES),
+    ]
@@ -0,0 +1,202 @@
+# Generated by Django 5.0.7 on 2026-10-18 20:07
+
+from django.db import migrations, models
+from data.department_choices import Department
+from data.region_choices import Region
+
+
+def _appro_badge(diagnostic, bio_share, combined_share):
+    canteen = diagnostic.canteen
+    bio_threshold, combined_threshold = 20, 50
+    if canteen.region in [Region.guadeloupe, Region.martinique, Region.guyane, Region.la_reunion]:
+        bio_threshold, combined_threshold = 5, 20
+    elif canteen.department == Department.saint_martin:
+        bio_threshold, combined_threshold = 5, 20
+    elif canteen.region == Region.mayotte:
+        bio_threshold, combined_threshold = 2, 5
+    elif canteen.department == Department.saint_pierre_et_miquelon:
+        bio_threshold, combined_threshold = 1, 3
+    return bio_share * 100 >= bio_threshold and combined_share * 100 >= combined_threshold
+
+
+def populate_badges(apps, schema_editor):
+    """
+    The rules of the Diagnostic badge properties at the time of this migration, applied to the existing diagnostics
+    """
+    Diagnostic = apps.get_model("data", "Diagnostic")
+    fields = [
+        "bio_share",
+        "combined_share",
+        "has_appro_badge",
+        "has_waste_badge",
+        "has_diversification_badge",
+        "has_plastic_badge",
+        "has_info_badge",
+    ]
+    diagnostics = Diagnostic.objects.select_related("canteen").prefetch_related("canteen__sectors").order_by("id")
+    batch = []
+    for diagnostic in diagnostics.iterator(chunk_size=1000):
+        canteen = diagnostic.canteen
+        total = diagnostic.value_total_ht
+        if total:
+            bio = diagnostic.value_bio_ht or 0
+            combined = (
+                bio
+                + (diagnostic.value_sustainable_ht or 0)
+                + (diagnostic.value_externality_performance_ht or 0)
+                + (diagnostic.value_egalim_others_ht or 0)
+            )
+            diagnostic.bio_share = float(bio / total)
+            diagnostic.combined_share = float(combined / total)
+            diagnostic.has_appro_badge = _appro_badge(diagnostic, bio / total, combined / total)
+        diagnostic.has_waste_badge = bool(
+            diagnostic.has_waste_diagnostic
+            and diagnostic.waste_actions
+            and (diagnostic.has_donation_agreement or (canteen.daily_meal_count and canteen.daily_meal_count < 3000))
+        )
+        in_education = any(sector.category == "education" for sector in canteen.sectors.all())
+        diagnostic.has_diversification_badge = diagnostic.vegetarian_weekly_recurrence == "DAILY" or (
+            diagnostic.vegetarian_weekly_recurrence in ["MID", "HIGH"] and in_education
+        )
+        diagnostic.has_plastic_badge = bool(
+            diagnostic.cooking_plastic_substituted
+            and diagnostic.serving_plastic_substituted
+            and diagnostic.plastic_bottles_substituted
+            and diagnostic.plastic_tableware_substituted
+        )
+        diagnostic.has_info_badge = bool(diagnostic.communicates_on_food_quality)
+        batch.append(diagnostic)
+        if len(batch) >= 1000:
+            Diagnostic.objects.bulk_update(batch, fields)
+            batch = []
+    if batch:
+        Diagnostic.objects.bulk_update(batch, fields)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("data", "0151_search_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="diagnostic",
+            name="bio_share",
+            field=models.FloatField(blank=True, null=True, verbose_name="part bio"),
+        ),
+        migrations.AddField(
+            model_name="diagnostic",
+            name="combined_share",
+            field=models.FloatField(blank=True, null=True, verbose_name="part EGalim (bio comprise)"),
+        ),
+        migrations.AddField(
+            model_name="diagnostic",
+            name="has_appro_badge",
+            field=models.BooleanField(default=False, verbose_name="badge appro"),
+        ),
+        migrations.AddField(
+            model_name="diagnostic",
+            name="has_diversification_badge",
+            field=models.BooleanField(default=False, verbose_name="badge diversification"),
+        ),
+        migrations.AddField(
+            model_name="diagnostic",
+            name="has_info_badge",
+            field=models.BooleanField(default=False, verbose_name="badge information"),
+        ),
+        migrations.AddField(
+            model_name="diagnostic",
+            name="has_plastic_badge",
+            field=models.BooleanField(default=False, verbose_name="badge plastique"),
+        ),
+        migrations.AddField(
+            model_name="diagnostic",
+            name="has_waste_badge",
+            field=models.BooleanField(default=False, verbose_name="badge gaspillage"),
+        ),
+        migrations.AddField(
+            model_name="historicaldiagnostic",
+            name="bio_share",
+            field=models.FloatField(blank=True, null=True, verbose_name="part bio"),
+        ),
+        migrations.AddField(
+            model_name="historicaldiagnostic",
+            name="combined_share",
+            field=models.FloatField(blank=True, null=True, verbose_name="part EGalim (bio comprise)"),
+        ),
+        migrations.AddField(
+            model_name="historicaldiagnostic",
+            name="has_appro_badge",
+            field=models.BooleanField(default=False, verbose_name="badge appro"),
+        ),
+        migrations.AddField(
+            model_name="historicaldiagnostic",
+            name="has_diversification_badge",
+            field=models.BooleanField(default=False, verbose_name="badge diversification"),
+        ),
+        migrations.AddField(
+            model_name="historicaldiagnostic",
+            name="has_info_badge",
+            field=models.BooleanField(default=False, verbose_name="badge information"),
+        ),
+        migrations.AddField(
+            model_name="historicaldiagnostic",
+            name="has_plastic_badge",
+            field=models.BooleanField(default=False, verbose_name="badge plastique"),
+        ),
+        migrations.AddField(
+            model_name="historicaldiagnostic",
+            name="has_waste_badge",
+            field=models.BooleanField(default=False, verbose_name="badge gaspillage"),
+        ),
+        migrations.AddIndex(
+            model_name="diagnostic",
+            index=models.Index(fields=["year", "bio_share"], name="diag_bio_share_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="diagnostic",
+            index=models.Index(fields=["year", "combined_share"], name="diag_combined_share_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="diagnostic",
+            index=models.Index(
+                condition=models.Q(("has_appro_badge", True)),
+                fields=["year"],
+                name="diag_appro_badge_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="diagnostic",
+            index=models.Index(
+                condition=models.Q(("has_waste_badge", True)),
+                fields=["year"],
+                name="diag_waste_badge_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="diagnostic",
+            index=models.Index(
+                condition=models.Q(("has_diversification_badge", True)),
+                fields=["year"],
+                name="diag_diversification_badge_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="diagnostic",
+            index=models.Index(
+                condition=models.Q(("has_plastic_badge", True)),
+                fields=["year"],
+                name="diag_plastic_badge_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="diagnostic",
+            index=models.Index(
+                condition=models.Q(("has_info_badge", True)),
+                fields=["year"],
+                name="diag_info_badge_idx",
+            ),
+        ),
+        migrations.RunPython(populate_badges, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.0.7 on 2026-10-18 20:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("data", "0152_diagnostic_badges"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="publiccanteencard",
+            index=models.Index(fields=["modification_date"], name="data_public_modific_63854f_idx"),
+        ),
+    ]
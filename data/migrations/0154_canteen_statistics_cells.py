@@ -0,0 +1,104 @@
+# Generated by Django 5.0.7 on 2026-10-18 20:38
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("data", "0153_publiccanteencard_modification_date_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CanteenStatisticsCell",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "year",
+                    models.IntegerField(blank=True, null=True, verbose_name="année"),
+                ),
+                (
+                    "region",
+                    models.TextField(blank=True, null=True, verbose_name="région"),
+                ),
+                (
+                    "department",
+                    models.TextField(blank=True, null=True, verbose_name="département"),
+                ),
+                ("epci", models.TextField(blank=True, null=True, verbose_name="EPCI")),
+                (
+                    "sector_ids",
+                    django.contrib.postgres.fields.ArrayField(
+                        base_field=models.IntegerField(),
+                        blank=True,
+                        default=list,
+                        size=None,
+                        verbose_name="secteurs",
+                    ),
+                ),
+                (
+                    "canteen_count",
+                    models.IntegerField(default=0, verbose_name="nombre de cantines"),
+                ),
+                (
+                    "published_canteen_count",
+                    models.IntegerField(default=0, verbose_name="nombre de cantines publiées"),
+                ),
+                (
+                    "diagnostic_count",
+                    models.IntegerField(default=0, verbose_name="nombre de diagnostics"),
+                ),
+                (
+                    "appro_diagnostic_count",
+                    models.IntegerField(default=0, verbose_name="nombre de diagnostics avec un total"),
+                ),
+                (
+                    "bio_share_count",
+                    models.IntegerField(default=0, verbose_name="nombre de parts bio"),
+                ),
+                (
+                    "bio_share_sum",
+                    models.FloatField(default=0, verbose_name="somme des parts bio"),
+                ),
+                (
+                    "sustainable_share_sum",
+                    models.FloatField(default=0, verbose_name="somme des parts durables (hors bio)"),
+                ),
+                (
+                    "appro_badge_count",
+                    models.IntegerField(default=0, verbose_name="nombre de badges appro"),
+                ),
+                (
+                    "waste_badge_count",
+                    models.IntegerField(default=0, verbose_name="nombre de badges gaspillage"),
+                ),
+                (
+                    "diversification_badge_count",
+                    models.IntegerField(default=0, verbose_name="nombre de badges diversification"),
+                ),
+                (
+                    "plastic_badge_count",
+                    models.IntegerField(default=0, verbose_name="nombre de badges plastique"),
+                ),
+                (
+                    "info_badge_count",
+                    models.IntegerField(default=0, verbose_name="nombre de badges information"),
+                ),
+            ],
+            options={
+                "verbose_name": "cellule des statistiques des cantines",
+                "verbose_name_plural": "cellules des statistiques des cantines",
+                "indexes": [models.Index(fields=["year", "department"], name="stats_cell_year_dept_idx")],
+            },
+        ),
+    ]
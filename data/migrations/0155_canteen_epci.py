@@ -0,0 +1,27 @@
+# Generated by Django 5.0.7 on 2026-10-18 20:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("data", "0154_canteen_statistics_cells"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="canteen",
+            name="epci",
+            field=models.TextField(blank=True, null=True, verbose_name="EPCI"),
+        ),
+        migrations.AddField(
+            model_name="historicalcanteen",
+            name="epci",
+            field=models.TextField(blank=True, null=True, verbose_name="EPCI"),
+        ),
+        migrations.AddIndex(
+            model_name="canteen",
+            index=models.Index(fields=["epci"], name="data_cantee_epci_0e4e9c_idx"),
+        ),
+    ]
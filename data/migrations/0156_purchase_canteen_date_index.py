@@ -0,0 +1,19 @@
+# Generated by Django 5.0.7 on 2026-10-18 21:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("data", "0155_canteen_epci"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="purchase",
+            index=models.Index(
+                fields=["canteen", "date"], name="purchase_canteen_date_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.7 on 2026-10-18 22:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("data", "0156_purchase_canteen_date_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="publiccanteencard",
+            name="canteen_modification_date",
+            field=models.DateTimeField(blank=True, null=True, verbose_name="date de modification de la cantine"),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.0.7 on 2026-10-18 23:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("data", "0157_publiccanteencard_canteen_modification_date"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StaleStatisticsDepartment",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "department",
+                    models.TextField(blank=True, null=True, verbose_name="département"),
+                ),
+            ],
+            options={
+                "verbose_name": "département aux statistiques à rafraîchir",
+                "verbose_name_plural": "départements aux statistiques à rafraîchir",
+            },
+        ),
+    ]
@@ -1,6 +1,7 @@
 from .user import User  # noqa: F401
 from .historyauthenticationmethod import AuthenticationMethodHistoricalRecords  # noqa: F401
 from .canteen import Canteen, CanteenImage  # noqa: F401
+from .publiccanteencard import PublicCanteenCard  # noqa: F401
 from .diagnostic import Diagnostic  # noqa: F401
 from .sector import Sector  # noqa: F401
 from .blogpost import BlogPost  # noqa: F401
@@ -18,3 +19,4 @@ from .partnertype import PartnerType  # noqa: F401
 from .videotutorial import VideoTutorial  # noqa: F401
 from .importtype import ImportType  # noqa: F401
 from .importfailure import ImportFailure  # noqa: F401
+from .canteenstatisticscell import CanteenStatisticsCell, StaleStatisticsDepartment  # noqa: F401
@@ -1,6 +1,9 @@
+from collections import defaultdict
 from urllib.parse import quote
 from django.db import models
+from django.db.models import F, Prefetch, prefetch_related_objects
 from django.conf import settings
+from django.contrib.postgres.indexes import GinIndex
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
 from django.utils import timezone
@@ -9,8 +12,10 @@ from simple_history.models import HistoricalRecords
 from data.department_choices import Department
 from data.region_choices import Region
 from data.fields import ChoiceArrayField
+from data.search import SearchDocument
 from data.utils import get_region, optimize_image
 from data.utils import get_diagnostic_lower_limit_year, get_diagnostic_upper_limit_year
+from macantine.geo import get_geo_referential
 from .sector import Sector
 from .softdeletionmodel import SoftDeletionModel, SoftDeletionManager, SoftDeletionQuerySet
 
@@ -58,6 +63,24 @@ class CanteenQuerySet(SoftDeletionQuerySet):
             else self.exclude(publication_status=Canteen.PublicationStatus.PUBLISHED)
         )
 
+    def sector_category_counts(self):
+        """
+        The number of canteens with at least one sector of each category, "inconnu" counting the sectors without
+        category, from a single aggregate grouped by category over the sectors of the canteens
+        """
+        counts = {category: 0 for category in Sector.Categories}
+        counts["inconnu"] = 0
+        rows = (
+            Canteen.sectors.through.objects.filter(canteen_id__in=self.values("id"))
+            .values(category=F("sector__category"))
+            .annotate(canteen_count=models.Count("canteen_id", distinct=True))
+            .order_by()
+        )
+        for row in rows:
+            if (row["category"] or "inconnu") in counts:
+                counts[row["category"] or "inconnu"] = row["canteen_count"]
+        return counts
+
 
 class CanteenManager(SoftDeletionManager):
     queryset_model = CanteenQuerySet
@@ -68,6 +91,9 @@ class CanteenManager(SoftDeletionManager):
     def publicly_hidden(self):
         return self.get_queryset().publicly_hidden()
 
+    def sector_category_counts(self):
+        return self.get_queryset().sector_category_counts()
+
 
 class Canteen(SoftDeletionModel):
     objects = CanteenManager()
@@ -80,6 +106,17 @@ class Canteen(SoftDeletionModel):
         indexes = [
             models.Index(fields=["siret"]),
             models.Index(fields=["central_producer_siret"]),
+            # EPCI filter of the statistics, see api.views.canteen.CanteenStatisticsView
+            models.Index(fields=["epci"]),
+            # Keyset pagination of the public and territory lists, see api.views.canteen.KeysetPaginationMixin
+            models.Index(F("name").asc(nulls_first=True), F("id").asc(), name="canteen_name_keyset_idx"),
+            models.Index(F("creation_date").asc(nulls_first=True), F("id").asc(), name="canteen_creation_keyset_idx"),
+            models.Index(F("modification_date").asc(nulls_first=True), F("id").asc(), name="canteen_modif_keyset_idx"),
+            models.Index(
+                F("daily_meal_count").asc(nulls_first=True), F("id").asc(), name="canteen_meal_count_keyset_idx"
+            ),
+            # Search of the public list, see api.views.utils.IndexedSearchFilter
+            GinIndex(SearchDocument("name", "siret"), name="canteen_search_idx"),
         ]
 
     class ManagementType(models.TextChoices):
@@ -156,6 +193,7 @@ class Canteen(SoftDeletionModel):
 
     department = models.TextField(null=True, blank=True, choices=Department.choices, verbose_name="département")
     region = models.TextField(null=True, blank=True, choices=Region.choices, verbose_name="région")
+    epci = models.TextField(null=True, blank=True, verbose_name="EPCI")
     postal_code = models.CharField(max_length=20, null=True, blank=True, verbose_name="code postal")
     sectors = models.ManyToManyField(Sector, blank=True, verbose_name="secteurs d'activité")
     line_ministry = models.TextField(
@@ -276,12 +314,26 @@ class Canteen(SoftDeletionModel):
     )
 
     def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
+        # The meal counts are read back by the badges of the diagnostics, which must not see e.g. the raw "12"
+        for field in ["daily_meal_count", "yearly_meal_count"]:
+            setattr(self, field, self._meta.get_field(field).to_python(getattr(self, field)))
         max_image_size = 1024
         if self.logo:
             self.logo = optimize_image(self.logo, self.logo.name, max_image_size)
         if self.department:
             self.region = self._get_region()
+        # The EPCI is only resolved when the commune changes, the refresh of the geo referential updating the others
+        if not hasattr(self, "_loaded_city_insee_code") or self._loaded_city_insee_code != self.city_insee_code:
+            self.epci = self._get_epci()
         super(Canteen, self).save(force_insert, force_update, using, update_fields)
+        self._loaded_city_insee_code = self.city_insee_code
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if "city_insee_code" in instance.__dict__:
+            instance._loaded_city_insee_code = instance.city_insee_code
+        return instance
 
     # Automatic tasks
     geolocation_bot_attempts = models.IntegerField(default=0)
@@ -327,6 +379,8 @@ class Canteen(SoftDeletionModel):
 
     @property
     def central_kitchen(self):
+        if hasattr(self, "_prefetched_central_kitchen"):
+            return self._prefetched_central_kitchen
         if self.is_satellite and self.central_producer_siret:
             central_types = [Canteen.ProductionType.CENTRAL, Canteen.ProductionType.CENTRAL_SERVING]
             try:
@@ -336,6 +390,11 @@ class Canteen(SoftDeletionModel):
 
     @property
     def central_kitchen_diagnostics(self):
+        """
+        A list once assigned by prefetch_diagnostics, a queryset otherwise : the callers iterate over it
+        """
+        if hasattr(self, "_prefetched_central_kitchen_diagnostics"):
+            return self._prefetched_central_kitchen_diagnostics
         if self.central_kitchen:
             return self.central_kitchen.diagnostic_set.filter(central_kitchen_diagnostic_mode__isnull=False)
 
@@ -345,8 +404,8 @@ class Canteen(SoftDeletionModel):
 
     def has_diagnostic_for_year(self, year):
         has_diagnostics = self.diagnostic_set.filter(year=year).exists()
-        has_central_kitchen_diagnostic = (
-            self.central_kitchen_diagnostics and self.central_kitchen_diagnostics.filter(year=year).exists()
+        has_central_kitchen_diagnostic = any(
+            diagnostic.year == year for diagnostic in self.central_kitchen_diagnostics or []
         )
         return has_diagnostics or has_central_kitchen_diagnostic
 
@@ -379,18 +438,36 @@ class Canteen(SoftDeletionModel):
     def _get_region(self):
         return get_region(self.department)
 
+    def _get_epci(self):
+        referential = get_geo_referential()
+        return referential.epci(self.city_insee_code) if referential else self.epci
+
+    @classmethod
+    def refresh_epcis(cls, referential):
+        """
+        Store the EPCIs of the communes of the referential on the canteens, e.g. when it is refreshed.
+        Returns the number of canteens updated
+        """
+        canteens = cls.all_objects.all()
+        count = canteens.exclude(epci=None).exclude(epci__in=referential.epci_communes.keys()).update(epci=None)
+        for epci_code, communes in referential.epci_communes.items():
+            count += canteens.filter(epci=epci_code).exclude(city_insee_code__in=communes).update(epci=None)
+            count += canteens.filter(city_insee_code__in=communes).exclude(epci=epci_code).update(epci=epci_code)
+        return count
+
     @cached_property
     def appro_diagnostics(self):
         diag_ids = list_properties(self.diagnostic_set, "id")
 
-        if self.central_kitchen_diagnostics:
+        central_kitchen_diagnostics = self.central_kitchen_diagnostics
+        if central_kitchen_diagnostics:
             # for any given year, could have own diag or CC diag
             # CC diag always takes precedent TODO: do we consistently assume this?
             # if don't have own diag, include CC diag in set
-            cc_diag_years = list_properties(self.central_kitchen_diagnostics, "year")
+            cc_diag_years = [diagnostic.year for diagnostic in central_kitchen_diagnostics]
             own_diagnostics = self.diagnostic_set.exclude(year__in=cc_diag_years)
 
-            diag_ids = list_properties(self.central_kitchen_diagnostics, "id")
+            diag_ids = [diagnostic.id for diagnostic in central_kitchen_diagnostics]
             diag_ids += list_properties(own_diagnostics, "id")
 
         from data.models import Diagnostic
@@ -402,15 +479,20 @@ class Canteen(SoftDeletionModel):
     def service_diagnostics(self):
         diag_ids = list_properties(self.diagnostic_set, "id")
 
-        if self.central_kitchen_diagnostics:
-            cc_service_diagnostics = self.central_kitchen_diagnostics.filter(central_kitchen_diagnostic_mode="ALL")
+        central_kitchen_diagnostics = self.central_kitchen_diagnostics
+        if central_kitchen_diagnostics:
+            cc_service_diagnostics = [
+                diagnostic
+                for diagnostic in central_kitchen_diagnostics
+                if diagnostic.central_kitchen_diagnostic_mode == "ALL"
+            ]
             # for any given year, could have own diag or CC diag
             # CC diag always takes precedent, if ALL TODO: do we consistently assume this?
             # if don't have own diag, include CC diag in set
-            cc_diag_years = list_properties(cc_service_diagnostics, "year")
+            cc_diag_years = [diagnostic.year for diagnostic in cc_service_diagnostics]
             own_diagnostics = self.diagnostic_set.exclude(year__in=cc_diag_years)
 
-            diag_ids = list_properties(cc_service_diagnostics, "id")
+            diag_ids = [diagnostic.id for diagnostic in cc_service_diagnostics]
             diag_ids += list_properties(own_diagnostics, "id")
 
         from data.models import Diagnostic
@@ -456,6 +538,9 @@ class Canteen(SoftDeletionModel):
 
     @property
     def in_education(self):
+        if "sectors" in getattr(self, "_prefetched_objects_cache", {}):
+            # e.g. Diagnostic.refresh_badges
+            return any(sector.category == "education" for sector in self.sectors.all()) or None
         scolaire_sectors = Sector.objects.filter(category="education")
         if scolaire_sectors.count() and self.sectors.intersection(scolaire_sectors).exists():
             return True
@@ -464,6 +549,117 @@ class Canteen(SoftDeletionModel):
     def lead_image(self):
         return self.images.first()
 
+    @cached_property
+    def card(self):
+        """
+        The denormalised public card of the canteen, built on the fly when it has not been stored yet
+        """
+        from .publiccanteencard import PublicCanteenCard  # Circular import
+
+        try:
+            return self.public_card
+        except PublicCanteenCard.DoesNotExist:
+            return PublicCanteenCard(canteen_id=self.id, **PublicCanteenCard.values_for(self))
+
+
+def prefetch_diagnostics(canteens):
+    """
+    Resolve the diagnostics of a page of canteens in a constant number of queries : their central kitchens, the
+    diagnostics of the canteens and of the kitchens, and the submitted teledeclarations of these diagnostics.
+    The results are assigned to the instances, applying the central kitchen precedence rules of
+    appro_diagnostics and service_diagnostics, so that the serializers stop querying each canteen
+    """
+    from data.models import Diagnostic, Teledeclaration  # Circular import
+
+    canteens = list(canteens)
+    central_producer_sirets = {canteen.central_producer_siret for canteen in canteens if canteen.is_satellite}
+    central_producer_sirets.discard(None)
+    central_producer_sirets.discard("")
+    central_kitchens = defaultdict(list)
+    if central_producer_sirets:
+        central_types = [Canteen.ProductionType.CENTRAL, Canteen.ProductionType.CENTRAL_SERVING]
+        for central_kitchen in Canteen.objects.filter(
+            siret__in=central_producer_sirets, production_type__in=central_types
+        ):
+            central_kitchens[central_kitchen.siret].append(central_kitchen)
+
+    for canteen in canteens:
+        # Like Canteen.central_kitchen, a siret shared by several central kitchens is ignored
+        candidates = central_kitchens.get(canteen.central_producer_siret, []) if canteen.is_satellite else []
+        canteen._prefetched_central_kitchen = candidates[0] if len(candidates) == 1 else None
+
+    submitted_teledeclarations = Teledeclaration.objects.filter(status=Teledeclaration.TeledeclarationStatus.SUBMITTED)
+    prefetch_related_objects(
+        canteens + [central_kitchen for candidates in central_kitchens.values() for central_kitchen in candidates],
+        Prefetch(
+            "diagnostic_set",
+            queryset=Diagnostic.objects.prefetch_related(
+                Prefetch("teledeclaration_set", queryset=submitted_teledeclarations)
+            ),
+        ),
+    )
+
+    this_year = timezone.now().date().year
+    for canteen in canteens:
+        _assign_diagnostics(canteen, this_year)
+    return canteens
+
+
+def _assign_diagnostics(canteen, this_year):
+    def previous_years(diagnostics):
+        return sorted((d for d in diagnostics if d.year < this_year), key=lambda d: d.year, reverse=True)
+
+    own_diagnostics = list(canteen.diagnostic_set.all())
+    central_kitchen_diagnostics = None
+    if canteen._prefetched_central_kitchen:
+        central_kitchen_diagnostics = [
+            diagnostic
+            for diagnostic in canteen._prefetched_central_kitchen.diagnostic_set.all()
+            if diagnostic.central_kitchen_diagnostic_mode is not None
+        ]
+    canteen._prefetched_central_kitchen_diagnostics = central_kitchen_diagnostics
+
+    appro_diagnostics = own_diagnostics
+    service_diagnostics = own_diagnostics
+    if central_kitchen_diagnostics:
+        cc_diag_years = {diagnostic.year for diagnostic in central_kitchen_diagnostics}
+        appro_diagnostics = central_kitchen_diagnostics + [d for d in own_diagnostics if d.year not in cc_diag_years]
+        cc_service_diagnostics = [d for d in central_kitchen_diagnostics if d.central_kitchen_diagnostic_mode == "ALL"]
+        cc_diag_years = {diagnostic.year for diagnostic in cc_service_diagnostics}
+        service_diagnostics = cc_service_diagnostics + [d for d in own_diagnostics if d.year not in cc_diag_years]
+    appro_diagnostics = previous_years(appro_diagnostics)
+    service_diagnostics = previous_years(service_diagnostics)
+
+    redacted_ids = set()
+    for year in canteen.redacted_appro_years or []:
+        diagnostic = next((d for d in appro_diagnostics if d.year == year), None)
+        if diagnostic and not diagnostic.is_teledeclared:
+            redacted_ids.add(diagnostic.id)
+    published_appro_diagnostics = [d for d in appro_diagnostics if d.id not in redacted_ids]
+
+    latest_published_year = None
+    if published_appro_diagnostics or service_diagnostics:
+        years = [
+            diagnostics[0].year for diagnostics in [published_appro_diagnostics, service_diagnostics] if diagnostics
+        ]
+        latest_published_year = max(years)
+
+    canteen.__dict__.update(
+        {
+            "appro_diagnostics": appro_diagnostics,
+            "service_diagnostics": service_diagnostics,
+            "published_appro_diagnostics": published_appro_diagnostics,
+            "published_service_diagnostics": service_diagnostics,
+            "latest_published_year": latest_published_year,
+            "latest_published_appro_diagnostic": next(
+                (d for d in published_appro_diagnostics if d.year == latest_published_year), None
+            ),
+            "latest_published_service_diagnostic": next(
+                (d for d in service_diagnostics if d.year == latest_published_year), None
+            ),
+        }
+    )
+
 
 class CanteenImage(models.Model):
     canteen = models.ForeignKey(Canteen, related_name="images", on_delete=models.CASCADE, null=True)
@@ -0,0 +1,206 @@
+from collections import defaultdict
+from django.contrib.postgres.expressions import ArraySubquery
+from django.contrib.postgres.fields import ArrayField
+from django.db import connection, models, transaction
+from django.db.models import Count, F, FloatField, OuterRef, Q, Sum
+from django.db.models.functions import Cast, Coalesce
+from .canteen import Canteen
+from .diagnostic import Diagnostic
+
+# Serialises the refreshes of the cells, see CanteenStatisticsCell.refresh
+STATISTICS_CUBE_LOCK = 31415
+
+
+def _canteen_sector_ids(canteen_id):
+    return ArraySubquery(
+        Canteen.sectors.through.objects.filter(canteen_id=canteen_id).order_by("sector_id").values("sector_id")
+    )
+
+
+def diagnostic_sustainable_share():
+    """
+    The share of the sustainable products other than bio in the total of a diagnostic, which must not be zero
+    """
+    return Cast(
+        (
+            Coalesce("value_sustainable_ht", 0, output_field=models.DecimalField())
+            + Coalesce("value_externality_performance_ht", 0, output_field=models.DecimalField())
+            + Coalesce("value_egalim_others_ht", 0, output_field=models.DecimalField())
+        )
+        / F("value_total_ht"),
+        FloatField(),
+    )
+
+
+class CanteenStatisticsCell(models.Model):
+    """
+    Cell of the statistics cube read by api.views.canteen.CanteenStatisticsView : the additive numerators and
+    denominators of the canteens sharing a region, department, EPCI and set of sectors. The cells without year hold
+    the canteen counts, the others the diagnostics of their year.
+    Keying the cells by the whole set of sectors of the canteens keeps the sums exact when a statistic is filtered on
+    several sectors, a canteen belonging to a single cell. The cells of a department are refreshed when its canteens
+    or their diagnostics change (see data/signals.py) and the cube is rebuilt nightly.
+    """
+
+    class Meta:
+        verbose_name = "cellule des statistiques des cantines"
+        verbose_name_plural = "cellules des statistiques des cantines"
+        indexes = [models.Index(fields=["year", "department"], name="stats_cell_year_dept_idx")]
+
+    year = models.IntegerField(null=True, blank=True, verbose_name="année")
+    region = models.TextField(null=True, blank=True, verbose_name="région")
+    department = models.TextField(null=True, blank=True, verbose_name="département")
+    epci = models.TextField(null=True, blank=True, verbose_name="EPCI")
+    sector_ids = ArrayField(models.IntegerField(), default=list, blank=True, verbose_name="secteurs")
+
+    canteen_count = models.IntegerField(default=0, verbose_name="nombre de cantines")
+    published_canteen_count = models.IntegerField(default=0, verbose_name="nombre de cantines publiées")
+    diagnostic_count = models.IntegerField(default=0, verbose_name="nombre de diagnostics")
+    appro_diagnostic_count = models.IntegerField(default=0, verbose_name="nombre de diagnostics avec un total")
+    bio_share_count = models.IntegerField(default=0, verbose_name="nombre de parts bio")
+    bio_share_sum = models.FloatField(default=0, verbose_name="somme des parts bio")
+    sustainable_share_sum = models.FloatField(default=0, verbose_name="somme des parts durables (hors bio)")
+    appro_badge_count = models.IntegerField(default=0, verbose_name="nombre de badges appro")
+    waste_badge_count = models.IntegerField(default=0, verbose_name="nombre de badges gaspillage")
+    diversification_badge_count = models.IntegerField(default=0, verbose_name="nombre de badges diversification")
+    plastic_badge_count = models.IntegerField(default=0, verbose_name="nombre de badges plastique")
+    info_badge_count = models.IntegerField(default=0, verbose_name="nombre de badges information")
+
+    canteen_measure_fields = ["canteen_count", "published_canteen_count"]
+    diagnostic_measure_fields = [
+        "diagnostic_count",
+        "appro_diagnostic_count",
+        "bio_share_count",
+        "bio_share_sum",
+        "sustainable_share_sum",
+        "appro_badge_count",
+        "waste_badge_count",
+        "diversification_badge_count",
+        "plastic_badge_count",
+        "info_badge_count",
+    ]
+    measure_fields = canteen_measure_fields + diagnostic_measure_fields
+
+    @classmethod
+    def is_built(cls):
+        return cls.objects.exists()
+
+    @classmethod
+    def rebuild(cls):
+        """
+        Rebuild the whole cube, e.g. nightly to include the writes made without signals. Returns the number of cells
+        """
+        with transaction.atomic():
+            cls._lock()
+            cls.objects.all().delete()
+            return len(cls.objects.bulk_create(cls._compute_cells(Q())))
+
+    @classmethod
+    def refresh(cls, departments):
+        """
+        Rebuild the cells of the given departments, None standing for the canteens without department.
+        Nothing is done until the cube has been built, the statistics being computed from the tables meanwhile
+        """
+        departments = set(departments)
+        if not departments or not cls.is_built():
+            return 0
+        department_q = Q(department__in=[d for d in departments if d is not None])
+        if None in departments:
+            department_q |= Q(department__isnull=True)
+        with transaction.atomic():
+            cls._lock()
+            cls.objects.filter(department_q).delete()
+            return len(cls.objects.bulk_create(cls._compute_cells(department_q)))
+
+    @staticmethod
+    def mark_stale(departments):
+        """
+        Record, within the transaction of the changes, the departments whose cells are to be refreshed by
+        `refresh_stale`
+        """
+        StaleStatisticsDepartment.objects.bulk_create(
+            [StaleStatisticsDepartment(department=department) for department in set(departments)]
+        )
+
+    @classmethod
+    def refresh_stale(cls):
+        """
+        Refresh the cells of the departments marked as stale since the last call. Returns these departments
+        """
+        with transaction.atomic():
+            cls._lock()
+            stale = dict(StaleStatisticsDepartment.objects.values_list("id", "department"))
+            if not stale:
+                return set()
+            # The departments marked in between are kept for the next call
+            StaleStatisticsDepartment.objects.filter(id__in=stale.keys()).delete()
+            departments = set(stale.values())
+            cls.refresh(departments)
+            return departments
+
+    @staticmethod
+    def _lock():
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", [STATISTICS_CUBE_LOCK])
+
+    @classmethod
+    def _compute_cells(cls, department_q):
+        """
+        Group the canteens and the diagnostics of the canteens matching `department_q` by cell. The diagnostics of
+        the deleted canteens are counted, as they are by the statistics computed from the tables
+        """
+        geo_fields = ("region", "department", "epci", "cell_sector_ids")
+        canteens = Canteen.objects.filter(department_q).annotate(cell_sector_ids=_canteen_sector_ids(OuterRef("id")))
+        canteen_rows = canteens.values(*geo_fields).annotate(canteen_count=Count("id")).order_by()
+        published_rows = (
+            canteens.publicly_visible().values(*geo_fields).annotate(published_canteen_count=Count("id")).order_by()
+        )
+
+        appro_q = Q(value_total_ht__gt=0)
+        diagnostic_rows = (
+            Diagnostic.objects.filter(canteen__in=Canteen.all_objects.filter(department_q))
+            .values(
+                "year",
+                region=F("canteen__region"),
+                department=F("canteen__department"),
+                epci=F("canteen__epci"),
+                cell_sector_ids=_canteen_sector_ids(OuterRef("canteen_id")),
+            )
+            .annotate(
+                diagnostic_count=Count("id"),
+                appro_diagnostic_count=Count("id", filter=appro_q),
+                bio_share_count=Count("bio_share", filter=appro_q),
+                bio_share_sum=Sum("bio_share", filter=appro_q, default=0),
+                sustainable_share_sum=Sum(diagnostic_sustainable_share(), filter=appro_q, default=0),
+                appro_badge_count=Count("id", filter=Q(has_appro_badge=True)),
+                waste_badge_count=Count("id", filter=Q(has_waste_badge=True)),
+                diversification_badge_count=Count("id", filter=Q(has_diversification_badge=True)),
+                plastic_badge_count=Count("id", filter=Q(has_plastic_badge=True)),
+                info_badge_count=Count("id", filter=Q(has_info_badge=True)),
+            )
+            .order_by()
+        )
+
+        cells = defaultdict(lambda: defaultdict(int))
+        for rows in [canteen_rows, published_rows, diagnostic_rows]:
+            for row in rows:
+                key = (row.get("year"), row["region"], row["department"], row["epci"], tuple(row["cell_sector_ids"]))
+                for field in cls.measure_fields:
+                    cells[key][field] += row.get(field, 0)
+        return [
+            cls(year=year, region=region, department=department, epci=epci, sector_ids=list(sector_ids), **measures)
+            for (year, region, department, epci, sector_ids), measures in cells.items()
+        ]
+
+
+class StaleStatisticsDepartment(models.Model):
+    """
+    Department whose statistics cells are out of date, see CanteenStatisticsCell.refresh_stale. A department can be
+    marked several times until it is refreshed
+    """
+
+    class Meta:
+        verbose_name = "département aux statistiques à rafraîchir"
+        verbose_name_plural = "départements aux statistiques à rafraîchir"
+
+    department = models.TextField(null=True, blank=True, verbose_name="département")
@@ -17,6 +17,20 @@ class Diagnostic(models.Model):
         constraints = [
             models.UniqueConstraint(fields=["canteen", "year"], name="annual_diagnostic"),
         ]
+        indexes = [
+            # Filters of the public list and statistics on the stored shares and badges, see populate_badges
+            models.Index(fields=["year", "bio_share"], name="diag_bio_share_idx"),
+            models.Index(fields=["year", "combined_share"], name="diag_combined_share_idx"),
+            models.Index(fields=["year"], condition=models.Q(has_appro_badge=True), name="diag_appro_badge_idx"),
+            models.Index(fields=["year"], condition=models.Q(has_waste_badge=True), name="diag_waste_badge_idx"),
+            models.Index(
+                fields=["year"],
+                condition=models.Q(has_diversification_badge=True),
+                name="diag_diversification_badge_idx",
+            ),
+            models.Index(fields=["year"], condition=models.Q(has_plastic_badge=True), name="diag_plastic_badge_idx"),
+            models.Index(fields=["year"], condition=models.Q(has_info_badge=True), name="diag_info_badge_idx"),
+        ]
 
     # NB: if the label of the choice changes, double check that the teledeclaration PDF
     # doesn't need an update as well, since the logic in the templates is based on the label
@@ -1260,6 +1274,26 @@ class Diagnostic(models.Model):
         null=True,
         verbose_name="Autres produits frais, surgelés et d’épicerie, Produit local",
     )
+
+    # Derived from the values above and the canteen when the diagnostic is saved, see populate_badges
+    bio_share = models.FloatField(blank=True, null=True, verbose_name="part bio")
+    combined_share = models.FloatField(blank=True, null=True, verbose_name="part EGalim (bio comprise)")
+    has_appro_badge = models.BooleanField(default=False, verbose_name="badge appro")
+    has_waste_badge = models.BooleanField(default=False, verbose_name="badge gaspillage")
+    has_diversification_badge = models.BooleanField(default=False, verbose_name="badge diversification")
+    has_plastic_badge = models.BooleanField(default=False, verbose_name="badge plastique")
+    has_info_badge = models.BooleanField(default=False, verbose_name="badge information")
+
+    badge_fields = [
+        "bio_share",
+        "combined_share",
+        "has_appro_badge",
+        "has_waste_badge",
+        "has_diversification_badge",
+        "has_plastic_badge",
+        "has_info_badge",
+    ]
+
     complete_fields = [
         "value_viandes_volailles_bio",
         "value_produits_de_la_mer_bio",
@@ -1377,6 +1411,10 @@ class Diagnostic(models.Model):
 
     @property
     def latest_submitted_teledeclaration(self):
+        if "teledeclaration_set" in getattr(self, "_prefetched_objects_cache", {}):
+            # e.g. data.models.canteen.prefetch_diagnostics
+            submitted_teledeclarations = [td for td in self.teledeclaration_set.all() if td.status == "SUBMITTED"]
+            return max(submitted_teledeclarations, key=lambda td: td.creation_date, default=None)
         submitted_teledeclarations = self.teledeclaration_set.filter(status="SUBMITTED")
         if submitted_teledeclarations.count() == 0:
             return None
@@ -1651,17 +1689,26 @@ class Diagnostic(models.Model):
         return self.family_sum("autres")
 
     @property
-    def appro_badge(self):
+    def appro_shares(self):
+        """
+        The bio share and the combined share of the EGalim products (bio included) in the total, None without total
+        """
         total = self.value_total_ht
-        if total:
-            bio_share = (self.value_bio_ht or 0) / total
-            combined_share = (
-                (self.value_bio_ht or 0)
-                + (self.value_sustainable_ht or 0)
-                + (self.value_externality_performance_ht or 0)
-                + (self.value_egalim_others_ht or 0)
-            ) / total
+        if not total:
+            return None, None
+        bio_share = (self.value_bio_ht or 0) / total
+        combined_share = (
+            (self.value_bio_ht or 0)
+            + (self.value_sustainable_ht or 0)
+            + (self.value_externality_performance_ht or 0)
+            + (self.value_egalim_others_ht or 0)
+        ) / total
+        return bio_share, combined_share
 
+    @property
+    def appro_badge(self):
+        bio_share, combined_share = self.appro_shares
+        if bio_share is not None:
             bio_threshold = 20
             combined_threshold = 50
             group_1_regions = [Region.guadeloupe, Region.martinique, Region.guyane, Region.la_reunion]
@@ -1712,3 +1759,44 @@ class Diagnostic(models.Model):
     def info_badge(self):
         if self.communicates_on_food_quality:
             return True
+
+    def populate_badges(self):
+        """
+        Store the appro shares and the badges, so that the lists and statistics filter on indexed columns
+        with the same rules as the properties above
+        """
+        bio_share, combined_share = self.appro_shares
+        self.bio_share = float(bio_share) if bio_share is not None else None
+        self.combined_share = float(combined_share) if combined_share is not None else None
+        self.has_appro_badge = bool(self.appro_badge)
+        self.has_waste_badge = bool(self.waste_badge)
+        self.has_diversification_badge = bool(self.diversification_badge)
+        self.has_plastic_badge = bool(self.plastic_badge)
+        self.has_info_badge = bool(self.info_badge)
+
+    def save(self, *args, **kwargs):
+        self.populate_badges()
+        if kwargs.get("update_fields") is not None:
+            kwargs["update_fields"] = {*kwargs["update_fields"], *self.badge_fields}
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def refresh_badges(cls, queryset, batch_size=1000):
+        """
+        Recompute the stored shares and badges of the diagnostics, e.g. when their canteen changes region, meal
+        count or sectors. Returns the number of diagnostics updated
+        """
+        diagnostics = queryset.select_related("canteen").prefetch_related("canteen__sectors").order_by("id")
+        updated = 0
+        batch = []
+        for diagnostic in diagnostics.iterator(chunk_size=batch_size):
+            previous = [getattr(diagnostic, field) for field in cls.badge_fields]
+            diagnostic.populate_badges()
+            if previous != [getattr(diagnostic, field) for field in cls.badge_fields]:
+                batch.append(diagnostic)
+            if len(batch) >= batch_size:
+                updated += cls.objects.bulk_update(batch, cls.badge_fields)
+                batch = []
+        if batch:
+            updated += cls.objects.bulk_update(batch, cls.badge_fields)
+        return updated
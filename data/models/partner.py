@@ -1,10 +1,12 @@
 from urllib.parse import quote
+from django.contrib.postgres.indexes import GinIndex
 from django.db import models
 from django.utils.translation import gettext_lazy as _
 from ckeditor_uploader.fields import RichTextUploadingField
 from data.department_choices import Department
 from data.utils import optimize_image
 from data.fields import ChoiceArrayField
+from data.search import SearchDocument
 from .partnertype import PartnerType
 from .sector import Sector
 
@@ -33,6 +35,10 @@ class Partner(models.Model):
     class Meta:
         verbose_name = "partenaire"
         verbose_name_plural = "partenaires"
+        indexes = [
+            # Search of the partners list, see api.views.utils.IndexedSearchFilter
+            GinIndex(SearchDocument("name"), name="partner_search_idx"),
+        ]
 
     creation_date = models.DateTimeField(auto_now_add=True)
     modification_date = models.DateTimeField(auto_now=True)
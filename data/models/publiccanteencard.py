@@ -0,0 +1,110 @@
+import json
+from django.contrib.postgres.fields import ArrayField
+from django.db import models
+from rest_framework.utils.encoders import JSONEncoder
+from .canteen import Canteen, CanteenImage, prefetch_diagnostics
+
+
+class PublicCanteenCard(models.Model):
+    """
+    Denormalised card of a publicly visible canteen : its badges, latest published year, appro summary, lead image
+    and sectors. It is refreshed when the canteen, its diagnostics, teledeclarations or images change (see
+    data/signals.py), so that the public list is serialised without querying the diagnostics of each canteen
+    """
+
+    class Meta:
+        verbose_name = "carte publique de cantine"
+        verbose_name_plural = "cartes publiques de cantines"
+        # Validators of the conditional requests of the public list, see api.views.canteen.PublishedCanteensView
+        indexes = [models.Index(fields=["modification_date"])]
+
+    canteen = models.OneToOneField(
+        Canteen, primary_key=True, on_delete=models.CASCADE, related_name="public_card", verbose_name="cantine"
+    )
+    modification_date = models.DateTimeField(auto_now=True, verbose_name="date de modification")
+    # Any change of the public data of the canteen modifies the card, see `refresh`
+    canteen_modification_date = models.DateTimeField(
+        null=True, blank=True, verbose_name="date de modification de la cantine"
+    )
+
+    latest_published_year = models.IntegerField(null=True, blank=True, verbose_name="dernière année publiée")
+    appro_diagnostic = models.JSONField(
+        null=True, blank=True, encoder=JSONEncoder, verbose_name="résumé du dernier diagnostic appro publié"
+    )
+    appro_badge = models.BooleanField(null=True, blank=True, verbose_name="badge appro")
+    waste_badge = models.BooleanField(null=True, blank=True, verbose_name="badge gaspillage")
+    diversification_badge = models.BooleanField(null=True, blank=True, verbose_name="badge diversification")
+    plastic_badge = models.BooleanField(null=True, blank=True, verbose_name="badge plastique")
+    info_badge = models.BooleanField(null=True, blank=True, verbose_name="badge information")
+    lead_image = models.ForeignKey(
+        CanteenImage,
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name="+",
+        verbose_name="image principale",
+    )
+    sector_ids = ArrayField(models.IntegerField(), default=list, blank=True, verbose_name="secteurs")
+
+    @staticmethod
+    def values_for(canteen):
+        from api.serializers import PublicApproDiagnosticSerializer  # Circular import
+
+        appro_diagnostic = canteen.latest_published_appro_diagnostic
+        service_diagnostic = canteen.latest_published_service_diagnostic
+        return {
+            "canteen_modification_date": canteen.modification_date,
+            "latest_published_year": canteen.latest_published_year,
+            "appro_diagnostic": PublicApproDiagnosticSerializer(appro_diagnostic).data if appro_diagnostic else None,
+            "appro_badge": appro_diagnostic.appro_badge if appro_diagnostic else False,
+            "waste_badge": service_diagnostic.waste_badge if service_diagnostic else False,
+            "diversification_badge": service_diagnostic.diversification_badge if service_diagnostic else False,
+            "plastic_badge": service_diagnostic.plastic_badge if service_diagnostic else False,
+            "info_badge": service_diagnostic.info_badge if service_diagnostic else False,
+            "lead_image": canteen.lead_image,
+            "sector_ids": [sector.id for sector in canteen.sectors.all()],
+        }
+
+    def has_values(self, values):
+        for field, value in values.items():
+            if field == "lead_image":
+                if self.lead_image_id != (value.id if value else None):
+                    return False
+            elif field == "appro_diagnostic":
+                # As read back from the JSON column
+                if self.appro_diagnostic != json.loads(json.dumps(value, cls=JSONEncoder)):
+                    return False
+            elif getattr(self, field) != value:
+                return False
+        return True
+
+    @classmethod
+    def refresh(cls, canteen_ids, touch=False):
+        """
+        Rebuild the cards of the given canteens, deleting the cards of the canteens that are no longer visible.
+        The images have no modification date, so `touch` modifies the cards even if their values are unchanged
+        """
+        refreshed_ids = []
+        cards = cls.objects.in_bulk(canteen_ids)
+        canteens = Canteen.objects.publicly_visible().filter(id__in=canteen_ids).prefetch_related("sectors")
+        for canteen in prefetch_diagnostics(canteens):
+            values = cls.values_for(canteen)
+            # Unchanged cards keep their modification date, which validates the conditional requests
+            if touch or canteen.id not in cards or not cards[canteen.id].has_values(values):
+                cls.objects.update_or_create(canteen=canteen, defaults=values)
+            refreshed_ids.append(canteen.id)
+        cls.objects.filter(canteen_id__in=canteen_ids).exclude(canteen_id__in=refreshed_ids).delete()
+        return len(refreshed_ids)
+
+    @classmethod
+    def rebuild(cls, batch_size=500):
+        """
+        Rebuild the cards of all the publicly visible canteens, e.g. when the year changes and new diagnostics
+        are published. Returns the number of cards
+        """
+        canteen_ids = list(Canteen.objects.publicly_visible().order_by("id").values_list("id", flat=True))
+        count = 0
+        for start in range(0, len(canteen_ids), batch_size):
+            count += cls.refresh(canteen_ids[start : start + batch_size])
+        cls.objects.exclude(canteen_id__in=Canteen.objects.publicly_visible().values("id")).delete()
+        return count
@@ -1,6 +1,8 @@
 from datetime import date
+from django.contrib.postgres.indexes import GinIndex
 from django.db import models
 from data.fields import ChoiceArrayField
+from data.search import SearchDocument
 from .canteen import Canteen
 from .softdeletionmodel import SoftDeletionModel
 
@@ -10,7 +12,13 @@ class Purchase(SoftDeletionModel):
         verbose_name = "achat"
         verbose_name_plural = "achats"
         ordering = ["-date", "-creation_date"]
-        indexes = [models.Index(fields=["import_source"])]
+        indexes = [
+            models.Index(fields=["import_source"]),
+            # Purchases of a canteen within a date range, e.g. the yearly summaries of api.views.purchase
+            models.Index(fields=["canteen", "date"], name="purchase_canteen_date_idx"),
+            # Search of the purchases list, see api.views.utils.IndexedSearchFilter
+            GinIndex(SearchDocument("description", "provider"), name="purchase_search_idx"),
+        ]
 
     class Category(models.TextChoices):
         VIANDES_VOLAILLES = "VIANDES_VOLAILLES", "Viandes, volailles"
@@ -0,0 +1,58 @@
+import re
+from django.contrib.postgres.search import SearchQueryField, SearchVectorField
+from django.db.models import F, Func, Lookup, TextField, Value
+from django.db.models.functions import Coalesce
+
+
+class ImmutableUnaccent(Func):
+    """
+    Postgres' unaccent is only STABLE, so it cannot be used in an index. The immutable_unaccent wrapper created
+    in migration 0151 can, which lets the search lookups use the trigram and full text indexes
+    """
+
+    function = "immutable_unaccent"
+    output_field = TextField()
+
+
+class SearchDocument(Func):
+    """
+    Unaccented full text document of the given fields, with the 'simple' configuration as the names of canteens,
+    providers or partners are not French sentences to stem. The GIN indexes of the models are built on the same
+    expression, so the search queries must use the fields in the same order
+    """
+
+    template = "to_tsvector('simple'::regconfig, immutable_unaccent(%(expressions)s))"
+    arg_joiner = " || ' ' || "
+
+    def __init__(self, *field_names):
+        fields = [Coalesce(F(field_name), Value("")) for field_name in field_names]
+        super().__init__(*fields, output_field=SearchVectorField())
+
+
+class PrefixSearchQuery(Func):
+    """
+    Matches the documents containing words starting with each of the terms, e.g. "cant mou" matches
+    "Cantine du Moulin"
+    """
+
+    template = "to_tsquery('simple'::regconfig, immutable_unaccent(%(expressions)s))"
+
+    def __init__(self, terms):
+        words = [word for term in terms for word in re.findall(r"\w+", term)]
+        self.has_words = bool(words)
+        query = " & ".join(f"{word}:*" for word in words)
+        super().__init__(Value(query), output_field=SearchQueryField())
+
+
+class SearchMatch(Lookup):
+    """
+    The document matches the query. Unlike the exact lookup of the search vectors, the query is not wrapped in a
+    plainto_tsquery
+    """
+
+    lookup_name = "search_match"
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f"{lhs} @@ {rhs}", (*lhs_params, *rhs_params)
@@ -1,9 +1,14 @@
 import logging
-from django.db.models.signals import post_save, pre_save
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
 from django.dispatch import receiver
 from simple_history.signals import pre_create_historical_record
 from simple_history.models import HistoricalRecords
-from .models import User, ManagerInvitation, Canteen
+from common.utils.response_cache import bump_generations
+from .models import User, ManagerInvitation, Canteen, CanteenImage, Diagnostic, PublicCanteenCard, Teledeclaration
+from .models import CanteenStatisticsCell
+from .models import BlogPost, BlogTag, CommunityEvent, Sector, VideoTutorial
 
 logger = logging.getLogger(__name__)
 
@@ -75,3 +80,184 @@ def pre_historical_record_save(sender, **kwargs):
         historical_record_add_auth_method(history_instance)
     except Exception as e:
         logger.error("Error when attempting to set authentication method on a history object", e)
+
+
+def refresh_public_canteen_cards(canteen_id, include_satellites=False, touch=False):
+    """
+    The cards are refreshed once the transaction is committed, the satellites following the diagnostics of
+    their central kitchen
+    """
+    if not canteen_id:
+        return
+
+    def refresh():
+        canteen_ids = [canteen_id]
+        canteen = Canteen.objects.filter(id=canteen_id).first()
+        if include_satellites and canteen and canteen.is_central_cuisine:
+            canteen_ids += list(canteen.satellites.values_list("id", flat=True))
+        PublicCanteenCard.refresh(canteen_ids, touch=touch)
+
+    transaction.on_commit(refresh)
+
+
+@receiver(post_save, sender=Canteen)
+@receiver(post_delete, sender=Canteen)
+def refresh_canteen_card(sender, instance, raw=False, **kwargs):
+    if not raw:
+        refresh_public_canteen_cards(instance.id, include_satellites=True)
+
+
+@receiver(post_save, sender=Diagnostic)
+@receiver(post_delete, sender=Diagnostic)
+@receiver(post_save, sender=Teledeclaration)
+def refresh_diagnostic_canteen_card(sender, instance, raw=False, **kwargs):
+    if not raw:
+        refresh_public_canteen_cards(instance.canteen_id, include_satellites=True)
+
+
+@receiver(post_save, sender=CanteenImage)
+@receiver(post_delete, sender=CanteenImage)
+def refresh_image_canteen_card(sender, instance, raw=False, **kwargs):
+    if not raw:
+        refresh_public_canteen_cards(instance.canteen_id, touch=True)
+
+
+@receiver(m2m_changed, sender=Canteen.sectors.through)
+def refresh_sectors_canteen_card(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ["post_add", "post_remove", "post_clear"]:
+        return
+    if not reverse:
+        refresh_public_canteen_cards(instance.id)
+    else:
+        for canteen_id in pk_set or []:
+            refresh_public_canteen_cards(canteen_id)
+
+
+@receiver(post_save, sender=Canteen)
+def refresh_canteen_diagnostic_badges(sender, instance, created, raw=False, **kwargs):
+    """
+    The badges stored on the diagnostics depend on the region, department and meal count of the canteen
+    """
+    if not raw and not created:
+        Diagnostic.refresh_badges(Diagnostic.objects.filter(canteen=instance))
+
+
+@receiver(m2m_changed, sender=Canteen.sectors.through)
+def refresh_sectors_diagnostic_badges(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    The diversification badge depends on the sectors of the canteen
+    """
+    if action not in ["post_add", "post_remove", "post_clear"]:
+        return
+    canteen_ids = [instance.id] if not reverse else pk_set
+    if canteen_ids:
+        Diagnostic.refresh_badges(Diagnostic.objects.filter(canteen_id__in=canteen_ids))
+
+
+# The refreshes of the statistics cells are debounced, see schedule_statistics_refresh
+STATISTICS_REFRESH_DELAY = 30
+STATISTICS_REFRESH_SCHEDULED_KEY = "statistics_refresh_scheduled"
+
+
+def schedule_statistics_refresh():
+    """
+    A single task refreshes the departments marked as stale during its countdown, the following commits only
+    scheduling a new one once it has started
+    """
+    from macantine.tasks import refresh_statistics_cells  # Circular import
+
+    # The key expires in case the task is lost
+    if cache.add(STATISTICS_REFRESH_SCHEDULED_KEY, True, timeout=STATISTICS_REFRESH_DELAY * 10):
+        refresh_statistics_cells.apply_async(countdown=STATISTICS_REFRESH_DELAY)
+
+
+def refresh_statistics_cells(departments=(), canteen_ids=()):
+    """
+    The departments are marked as stale by the transaction of the changes, and refreshed by a task once it is
+    committed, so that e.g. a CSV import saving many rows refreshes each department once
+    """
+    departments = set(departments)
+    if canteen_ids:
+        departments |= set(Canteen.all_objects.filter(id__in=canteen_ids).values_list("department", flat=True))
+    CanteenStatisticsCell.mark_stale(departments)
+    transaction.on_commit(schedule_statistics_refresh, robust=True)
+
+
+@receiver(pre_save, sender=Canteen)
+def store_previous_statistics_department(sender, instance, raw, **kwargs):
+    if not raw and instance.pk:
+        instance._previous_department = (
+            Canteen.all_objects.filter(pk=instance.pk).values_list("department", flat=True).first()
+        )
+
+
+@receiver(post_save, sender=Canteen)
+@receiver(post_delete, sender=Canteen)
+def refresh_canteen_statistics_cells(sender, instance, raw=False, **kwargs):
+    """
+    The cells of the previous department of a canteen that moved are refreshed too
+    """
+    if not raw:
+        departments = {instance.department, getattr(instance, "_previous_department", instance.department)}
+        refresh_statistics_cells(departments=departments)
+
+
+@receiver(post_save, sender=Diagnostic)
+@receiver(post_delete, sender=Diagnostic)
+def refresh_diagnostic_statistics_cells(sender, instance, raw=False, **kwargs):
+    if not raw:
+        refresh_statistics_cells(canteen_ids=[instance.canteen_id])
+
+
+@receiver(m2m_changed, sender=Canteen.sectors.through)
+def refresh_sectors_statistics_cells(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ["post_add", "post_remove", "post_clear"]:
+        return
+    canteen_ids = [instance.id] if not reverse else pk_set
+    if canteen_ids:
+        refresh_statistics_cells(canteen_ids=canteen_ids)
+
+
+# The groups of cached API responses built from the data of each model, see api.views.utils.CachedResponseMixin
+RESPONSE_CACHE_GROUPS = {
+    Canteen: ["canteens"],
+    CanteenImage: ["canteens"],
+    Diagnostic: ["canteens"],
+    Teledeclaration: ["canteens"],
+    PublicCanteenCard: ["canteens"],
+    Canteen.sectors.through: ["canteens"],
+    Sector: ["canteens", "sectors"],
+    BlogPost: ["blog"],
+    BlogTag: ["blog"],
+    BlogPost.tags.through: ["blog"],
+    CommunityEvent: ["community_events"],
+    VideoTutorial: ["video_tutorials"],
+}
+
+
+def bump_response_cache_generations(model):
+    """
+    The generations are bumped once the transaction is committed : a response built before the commit holds the
+    previous generations and is never served afterwards
+    """
+    groups = RESPONSE_CACHE_GROUPS[model]
+    transaction.on_commit(lambda: bump_generations(groups))
+
+
+def invalidate_cached_responses(sender, raw=False, **kwargs):
+    if not raw:
+        bump_response_cache_generations(sender)
+
+
+def invalidate_m2m_cached_responses(sender, action, **kwargs):
+    if action in ["post_add", "post_remove", "post_clear"]:
+        bump_response_cache_generations(sender)
+
+
+for model in RESPONSE_CACHE_GROUPS:
+    dispatch_uid = f"response_cache_{model.__name__}"
+    if model._meta.auto_created:
+        m2m_changed.connect(invalidate_m2m_cached_responses, sender=model, dispatch_uid=dispatch_uid)
+    else:
+        post_save.connect(invalidate_cached_responses, sender=model, dispatch_uid=dispatch_uid)
+        post_delete.connect(invalidate_cached_responses, sender=model, dispatch_uid=dispatch_uid)
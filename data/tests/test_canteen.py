@@ -1,6 +1,7 @@
 from django.test import TestCase
-from data.models import Canteen
-from data.factories import CanteenFactory, DiagnosticFactory
+from data.models import Canteen, Diagnostic, Sector, Teledeclaration
+from data.models.canteen import prefetch_diagnostics
+from data.factories import CanteenFactory, DiagnosticFactory, SectorFactory, UserFactory
 from freezegun import freeze_time
 
 
@@ -30,3 +31,88 @@ class TestCanteenModel(TestCase):
         self.assertEqual(qs.count(), 0, "Soft deleted canteen is not visible in default queryset")
         qs = Canteen.all_objects.all()
         self.assertEqual(qs.count(), 1, "Soft deleted canteens can be accessed in custom queryset")
+
+    @freeze_time("2024-01-20")
+    def test_prefetch_diagnostics(self):
+        """
+        The diagnostics resolved in bulk should follow the same central kitchen precedence and redaction rules
+        as the canteen properties, in a constant number of queries
+        """
+        applicant = UserFactory.create()
+        central = CanteenFactory.create(siret="96766910375238", production_type=Canteen.ProductionType.CENTRAL)
+        satellites = [
+            CanteenFactory.create(
+                production_type=Canteen.ProductionType.ON_SITE_CENTRAL,
+                central_producer_siret=central.siret,
+                redacted_appro_years=redacted_appro_years,
+            )
+            for redacted_appro_years in [[], [2022], [2021, 2022]]
+        ]
+        canteen = CanteenFactory.create(production_type=Canteen.ProductionType.ON_SITE, redacted_appro_years=[2022])
+        DiagnosticFactory.create(
+            canteen=central, year=2022, central_kitchen_diagnostic_mode=Diagnostic.CentralKitchenDiagnosticMode.ALL
+        )
+        teledeclared = DiagnosticFactory.create(
+            canteen=central, year=2021, central_kitchen_diagnostic_mode=Diagnostic.CentralKitchenDiagnosticMode.APPRO
+        )
+        Teledeclaration.create_from_diagnostic(teledeclared, applicant)
+        DiagnosticFactory.create(canteen=satellites[0], year=2021)
+        DiagnosticFactory.create(canteen=satellites[0], year=2020)
+        DiagnosticFactory.create(canteen=satellites[1], year=2024)
+        DiagnosticFactory.create(canteen=canteen, year=2022)
+        DiagnosticFactory.create(canteen=canteen, year=2021)
+
+        canteen_ids = [central.id, canteen.id] + [satellite.id for satellite in satellites]
+        with self.assertNumQueries(4):
+            resolved = prefetch_diagnostics(Canteen.objects.filter(id__in=canteen_ids))
+            for resolved_canteen in resolved:
+                [diagnostic.is_teledeclared for diagnostic in resolved_canteen.published_appro_diagnostics]
+                resolved_canteen.central_kitchen_diagnostics
+
+        properties = [
+            "appro_diagnostics",
+            "service_diagnostics",
+            "published_appro_diagnostics",
+            "published_service_diagnostics",
+        ]
+        for resolved_canteen in resolved:
+            expected = Canteen.objects.get(id=resolved_canteen.id)
+            for name in properties:
+                self.assertEqual(
+                    [(d.id, d.year) for d in getattr(resolved_canteen, name)],
+                    [(d.id, d.year) for d in getattr(expected, name)],
+                    f"{name} of {expected}",
+                )
+            self.assertEqual(resolved_canteen.latest_published_year, expected.latest_published_year)
+            self.assertEqual(
+                resolved_canteen.latest_published_appro_diagnostic, expected.latest_published_appro_diagnostic
+            )
+            self.assertEqual(
+                resolved_canteen.latest_published_service_diagnostic, expected.latest_published_service_diagnostic
+            )
+            self.assertEqual(resolved_canteen.central_kitchen, expected.central_kitchen)
+            self.assertEqual(
+                {d.id for d in resolved_canteen.central_kitchen_diagnostics or []},
+                {d.id for d in expected.central_kitchen_diagnostics or []},
+            )
+
+    def test_sector_category_counts(self):
+        """
+        Each canteen is counted once per category of its sectors, in a single query
+        """
+        primary = SectorFactory.create(category=Sector.Categories.EDUCATION)
+        secondary = SectorFactory.create(category=Sector.Categories.EDUCATION)
+        enterprise = SectorFactory.create(category=Sector.Categories.ENTERPRISE)
+        unknown = SectorFactory.create(category=None)
+        CanteenFactory.create(sectors=[primary, secondary, enterprise])
+        CanteenFactory.create(sectors=[secondary, unknown])
+        CanteenFactory.create(sectors=[])
+        CanteenFactory.create(sectors=[enterprise]).delete()
+
+        with self.assertNumQueries(1):
+            counts = Canteen.objects.sector_category_counts()
+        self.assertEqual(counts[Sector.Categories.EDUCATION], 2)
+        self.assertEqual(counts[Sector.Categories.ENTERPRISE], 1)
+        self.assertEqual(counts[Sector.Categories.HEALTH], 0)
+        self.assertEqual(counts["inconnu"], 1)
+        self.assertEqual(Canteen.objects.filter(sectors=enterprise).sector_category_counts()["inconnu"], 0)
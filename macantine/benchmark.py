@@ -0,0 +1,251 @@
+import copy
+import datetime
+import logging
+import os
+import random
+import resource
+import subprocess
+import uuid
+from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from api.serializers import (
+    CompleteTeledeclarationDiagnosticSerializer,
+    SectorSerializer,
+    SimpleTeledeclarationDiagnosticSerializer,
+)
+from data.factories import CanteenFactory, DiagnosticFactory, SectorFactory, UserFactory
+from data.models import Canteen, Diagnostic, Teledeclaration
+from macantine.etl import CAMPAIGN_DATES
+from macantine.geo import get_geo_referential
+
+logger = logging.getLogger(__name__)
+
+BENCHMARK_FORMATS = ["csv", "parquet", "xlsx"]
+
+
+def peak_rss_mb():
+    """
+    Peak resident memory of the current process since its start (ru_maxrss is in KB on Linux)
+    """
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def current_commit():
+    commit = os.environ.get("CC_COMMIT_ID")
+    if commit:
+        return commit
+    try:
+        result = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True)
+        return result.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def generate_synthetic_data(
+    canteens=1000,
+    sectors_per_canteen=3,
+    teledeclarations=600,
+    central_kitchens=5,
+    satellites_per_central_kitchen=20,
+    batch_size=5000,
+):
+    """
+    Bulk insert synthetic canteens, with their sectors and managers, and teledeclarations spread across the
+    campaigns. The objects are built with the factories and inserted in batches, without the history records.
+    Returns the number of objects created
+    """
+    run_id = uuid.uuid4().hex[:8]
+    sectors = SectorFactory.create_batch(max(sectors_per_canteen, 10))
+    users = [
+        UserFactory.build(username=f"benchmark_{run_id}_{i}", email=f"benchmark_{run_id}_{i}@example.com")
+        for i in range(max(canteens // 10, 1))
+    ]
+    users = get_user_model().objects.bulk_create(users, batch_size=batch_size)
+
+    canteen_objects, satellites = _create_canteens(
+        canteens, central_kitchens, satellites_per_central_kitchen, batch_size
+    )
+    canteen_sectors = {
+        canteen.id: random.sample(sectors, min(sectors_per_canteen, len(sectors))) for canteen in canteen_objects
+    }
+    Canteen.sectors.through.objects.bulk_create(
+        [
+            Canteen.sectors.through(canteen_id=canteen_id, sector_id=sector.id)
+            for canteen_id, sectors_list in canteen_sectors.items()
+            for sector in sectors_list
+        ],
+        batch_size=batch_size,
+    )
+    # One canteen out of ten has no manager, so that it is not active on ma cantine
+    Canteen.managers.through.objects.bulk_create(
+        [
+            Canteen.managers.through(canteen_id=canteen.id, user_id=random.choice(users).id)
+            for canteen in canteen_objects
+            if random.random() > 0.1
+        ],
+        batch_size=batch_size,
+    )
+
+    teledeclarations_created = _create_teledeclarations(
+        teledeclarations, canteen_objects, canteen_sectors, satellites, users, batch_size
+    )
+    return {
+        "sectors": len(sectors),
+        "users": len(users),
+        "canteens": len(canteen_objects),
+        "central_kitchens": len(satellites),
+        "satellites": sum(len(satellite_list) for satellite_list in satellites.values()),
+        "teledeclarations": teledeclarations_created,
+    }
+
+
+def _create_canteens(canteens, central_kitchens, satellites_per_central_kitchen, batch_size):
+    """
+    The first canteens are the central kitchens, followed by their satellites.
+    Returns the canteens and the satellites of each central kitchen, keyed by its siret
+    """
+    referential = get_geo_referential()
+    insee_codes = list(referential.communes.keys()) if referential else None
+    siret_base = random.randint(10**12, 9 * 10**12)
+    canteen_objects = []
+    for i in range(canteens):
+        canteen = CanteenFactory.build(siret=f"{siret_base + i:014d}", production_type=Canteen.ProductionType.ON_SITE)
+        if insee_codes:
+            canteen.city_insee_code = random.choice(insee_codes)
+        canteen_objects.append(canteen)
+
+    central_kitchens = min(central_kitchens, canteens)
+    satellites_per_central_kitchen = min(
+        satellites_per_central_kitchen, (canteens - central_kitchens) // max(central_kitchens, 1)
+    )
+    satellites = {}
+    for index, central_kitchen in enumerate(canteen_objects[:central_kitchens]):
+        central_kitchen.production_type = Canteen.ProductionType.CENTRAL
+        central_kitchen.satellite_canteens_count = satellites_per_central_kitchen
+        first_satellite = central_kitchens + index * satellites_per_central_kitchen
+        satellites[central_kitchen.siret] = canteen_objects[
+            first_satellite : first_satellite + satellites_per_central_kitchen
+        ]
+        for satellite in satellites[central_kitchen.siret]:
+            satellite.production_type = Canteen.ProductionType.ON_SITE_CENTRAL
+            satellite.central_producer_siret = central_kitchen.siret
+
+    return Canteen.objects.bulk_create(canteen_objects, batch_size=batch_size), satellites
+
+
+def _create_teledeclarations(teledeclarations, canteen_objects, canteen_sectors, satellites, users, batch_size):
+    """
+    Spread the teledeclarations across the campaigns, the central kitchens declaring every year.
+    The declared data is copied from a simple and a complete diagnostic template with randomised values
+    """
+    central_kitchens = [canteen for canteen in canteen_objects if canteen.siret in satellites]
+    others = [canteen for canteen in canteen_objects if canteen.siret not in satellites]
+    years = sorted(CAMPAIGN_DATES.keys())
+    created = 0
+    for index, year in enumerate(years):
+        count = min(teledeclarations // len(years) + (index < teledeclarations % len(years)), len(canteen_objects))
+        declaring = central_kitchens[:count] + random.sample(others, max(count - len(central_kitchens), 0))
+        templates = [
+            serializer(
+                DiagnosticFactory.create(
+                    canteen=canteen_objects[position % len(canteen_objects)],
+                    year=year,
+                    diagnostic_type=diagnostic_type,
+                )
+            ).data
+            for position, (serializer, diagnostic_type) in enumerate(
+                [
+                    (SimpleTeledeclarationDiagnosticSerializer, Diagnostic.DiagnosticType.SIMPLE),
+                    (CompleteTeledeclarationDiagnosticSerializer, Diagnostic.DiagnosticType.COMPLETE),
+                ]
+            )
+        ]
+        teledeclaration_objects = [
+            Teledeclaration(
+                declared_data=_declared_data(year, canteen, canteen_sectors, satellites, random.choice(templates)),
+                year=year,
+                canteen_id=canteen.id,
+                canteen_siret=canteen.siret,
+                applicant=random.choice(users),
+                status=Teledeclaration.TeledeclarationStatus.SUBMITTED,
+                teledeclaration_mode=(
+                    Teledeclaration.TeledeclarationMode.CENTRAL_ALL
+                    if canteen.siret in satellites
+                    else Teledeclaration.TeledeclarationMode.SITE
+                ),
+            )
+            for canteen in declaring
+        ]
+        teledeclaration_objects = Teledeclaration.objects.bulk_create(teledeclaration_objects, batch_size=batch_size)
+
+        # The creation date is set automatically, moving it within the campaign so that the TDs are exported
+        campaign_date = CAMPAIGN_DATES[year]["start_date"] + datetime.timedelta(days=1)
+        ids = [teledeclaration.id for teledeclaration in teledeclaration_objects]
+        for start in range(0, len(ids), batch_size):
+            Teledeclaration.objects.filter(id__in=ids[start : start + batch_size]).update(creation_date=campaign_date)
+        created += len(ids)
+    return created
+
+
+def _declared_data(year, canteen, canteen_sectors, satellites, template):
+    serialized_diagnostic = copy.deepcopy(template)
+    for key, value in serialized_diagnostic.items():
+        if key.startswith("value_") and value is not None:
+            serialized_diagnostic[key] = round(float(value) * random.uniform(0.5, 1.5), 2)
+    serialized_diagnostic["canteen_id"] = canteen.id
+    declared_data = {
+        "version": "10",
+        "year": year,
+        "canteen": {
+            "id": canteen.id,
+            "name": canteen.name,
+            "siret": canteen.siret,
+            "city_insee_code": canteen.city_insee_code,
+            "department": None,
+            "region": None,
+            "sectors": [SectorSerializer(sector).data for sector in canteen_sectors[canteen.id]],
+            "line_ministry": None,
+            "daily_meal_count": canteen.daily_meal_count,
+            "yearly_meal_count": None,
+            "production_type": canteen.production_type,
+            "management_type": None,
+            "economic_model": None,
+            "satellite_canteens_count": canteen.satellite_canteens_count,
+            "central_producer_siret": canteen.central_producer_siret,
+        },
+        "applicant": {"name": "Benchmark", "email": "benchmark@example.com"},
+        "central_kitchen_siret": canteen.central_producer_siret,
+        "teledeclaration": serialized_diagnostic,
+    }
+    if canteen.siret in satellites:
+        declared_data["satellites"] = [
+            {"id": satellite.id, "siret": satellite.siret, "name": satellite.name}
+            for satellite in satellites[canteen.siret]
+        ]
+        declared_data["satellite_canteens_count"] = canteen.satellite_canteens_count
+    return declared_data
+
+
+def benchmark_etl(etl, formats=BENCHMARK_FORMATS):
+    """
+    Run the ETL and return the stages of its report. The files are written under a benchmark name and deleted
+    """
+    etl.dataset_name = f"{etl.dataset_name}_benchmark"
+    try:
+        etl.extract_dataset()
+        etl.transform_dataset()
+        for file_format in formats:
+            etl.load_dataset_format(file_format)
+    finally:
+        for file_format in formats:
+            etl_file = f"open_data/{etl.dataset_name}.{file_format}"
+            if default_storage.exists(etl_file):
+                default_storage.delete(etl_file)
+
+    report = etl.get_report()
+    return {
+        "rows": etl.len_dataset(),
+        "duration_s": report["duration_s"],
+        "peak_rss_mb": peak_rss_mb(),
+        "stages": report["stages"],
+    }
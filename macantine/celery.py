@@ -26,6 +26,12 @@ daily_week = crontab(hour=10, minute=0, day_of_week="1-5")
 nightly = crontab(hour=4, minute=0, day_of_week="*")
 midnights = crontab(hour=0, minute=0, day_of_week="*")
 weekly = crontab(hour=4, minute=0, day_of_week=6)
+# Every night but the one of the weekly full export, which writes the same files
+nightly_except_weekly = crontab(hour=4, minute=0, day_of_week="0-5")
+# Before the nightly rebuild of the statistics cube, which groups the canteens by EPCI
+weekly_geo = crontab(hour=3, minute=0, day_of_week=0)
+# Just after midnight, so that the new year is taken into account on the 1st of January
+after_midnights = crontab(hour=0, minute=5, day_of_week="*")
 every_minute = crontab(minute="*/1")  # For testing purposes
 
 app.conf.beat_schedule = {
@@ -53,10 +59,27 @@ app.conf.beat_schedule = {
         "task": "macantine.tasks.export_datasets",
         "schedule": weekly,
     },
+    "export_datasets_incremental": {
+        "task": "macantine.tasks.export_datasets",
+        "schedule": nightly_except_weekly,
+        "kwargs": {"incremental": True},
+    },
     "update_brevo_contacts": {
         "task": "macantine.tasks.update_brevo_contacts",
         "schedule": midnights,
     },
+    "refresh_geo_referential": {
+        "task": "macantine.tasks.refresh_geo_referential",
+        "schedule": weekly_geo,
+    },
+    "rebuild_statistics_cube": {
+        "task": "macantine.tasks.rebuild_statistics_cube",
+        "schedule": nightly,
+    },
+    "rebuild_public_canteen_cards": {
+        "task": "macantine.tasks.rebuild_public_canteen_cards",
+        "schedule": after_midnights,
+    },
 }
 
 app.conf.timezone = "Europe/Paris"
@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 import datetime
 import zoneinfo
@@ -6,18 +7,29 @@ import requests
 import json
 import os
 import time
+import functools
 import csv
 
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from resource import RUSAGE_SELF, getpagesize, getrusage
 from data.department_choices import Department
 from data.region_choices import Region
-from data.models import Canteen, Teledeclaration, Sector
+from data.models import Canteen, Diagnostic, Teledeclaration, Sector
 from datetime import date
 from api.serializers import SectorSerializer
 from api.views.utils import camelize
+from common.utils.table_schema import validate_dataframe
+from common.utils.xlsx import write_dataframe_xlsx
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.core.files.base import ContentFile
 from django.core.files.storage import default_storage
-from django.db.models import Q
-from io import BytesIO
+from django.db import connection
+from django.db.models import Count, F, FloatField, IntegerField, Max, Q
+from django.db.models.expressions import RawSQL
+from django.db.models.fields.json import KT
+from django.db.models.functions import Cast
+from macantine.geo import GeoReferential, get_geo_referential
 
 logger = logging.getLogger(__name__)
 
@@ -38,49 +50,12 @@ CAMPAIGN_DATES = {
 }
 
 
-def map_communes_infos():
-    """
-    Create a dict that maps cities with their EPCI code
-    """
-    commune_details = {}
-    try:
-        logger.info("Starting communes dl")
-        response_commune = requests.get("https://geo.api.gouv.fr/communes", timeout=50)
-        response_commune.raise_for_status()
-        communes = response_commune.json()
-        for commune in communes:
-            commune_details[commune["code"]] = {}
-            if "codeDepartement" in commune.keys():
-                commune_details[commune["code"]]["department"] = commune["codeDepartement"]
-            if "codeRegion" in commune.keys():
-                commune_details[commune["code"]]["region"] = commune["codeRegion"]
-            if "codeEpci" in commune.keys():
-                commune_details[commune["code"]]["epci"] = commune["codeEpci"]
-    except requests.exceptions.HTTPError as e:
-        logger.info(e)
-        return None
-    return commune_details
-
-
-def map_epcis_code_name():
-    try:
-        epci_names = {}
-        response = requests.get("https://geo.api.gouv.fr/epcis/?fields=nom", timeout=50)
-        response.raise_for_status()
-        epcis = response.json()
-        for epci in epcis:
-            epci_names[epci["code"]] = epci["nom"]
-        return epci_names
-    except requests.exceptions.HTTPError as e:
-        logger.info(e)
-        return {}
-
-
 def map_canteens_td(year):
     """
-    Populate mapper for a given year. The mapper indicates if one canteen has participated in campaign
+    Populate mapper for a given year. The mapper is an array of the ids of the canteens that have participated in campaign,
+    including the satellites declared by a central kitchen
     """
-    # Check and fetch Teledeclaration data from the database
+    # Only fetching the satellites from the declared data, the rest of the json is not needed
     tds = Teledeclaration.objects.filter(
         year=year,
         creation_date__range=(
@@ -88,16 +63,14 @@ def map_canteens_td(year):
             CAMPAIGN_DATES[year]["end_date"],
         ),
         status=Teledeclaration.TeledeclarationStatus.SUBMITTED,
-    ).values("canteen_id", "declared_data")
+        canteen_id__isnull=False,
+    ).values_list("canteen_id", "declared_data__satellites")
 
-    # Populate the mapper for the given year
-    participation = []
-    for td in tds:
-        participation.append(td["canteen_id"])
-        if "satellites" in td["declared_data"]:
-            for satellite in td["declared_data"]["satellites"]:
-                participation.append(satellite["id"])
-    return participation
+    participation = set()
+    for canteen_id, satellites in tds.iterator():
+        participation.add(canteen_id)
+        participation.update(satellite["id"] for satellite in satellites or [])
+    return np.fromiter(participation, dtype=np.int64, count=len(participation))
 
 
 def map_sectors():
@@ -112,21 +85,26 @@ def map_sectors():
     return sectors_mapper
 
 
+def campaign_teledeclarations(year: int):
+    """
+    Queryset of the teledeclarations submitted during the campaign of the given year
+    """
+    return Teledeclaration.objects.filter(
+        year=year,
+        creation_date__range=(
+            CAMPAIGN_DATES[year]["start_date"],
+            CAMPAIGN_DATES[year]["end_date"],
+        ),
+        status=Teledeclaration.TeledeclarationStatus.SUBMITTED,
+        canteen_id__isnull=False,
+    )
+
+
 def fetch_teledeclarations(years: list) -> pd.DataFrame:
     df = pd.DataFrame()
     for year in years:
         if year in CAMPAIGN_DATES.keys():
-            df_year = pd.DataFrame(
-                Teledeclaration.objects.filter(
-                    year=year,
-                    creation_date__range=(
-                        CAMPAIGN_DATES[year]["start_date"],
-                        CAMPAIGN_DATES[year]["end_date"],
-                    ),
-                    status=Teledeclaration.TeledeclarationStatus.SUBMITTED,
-                    canteen_id__isnull=False,
-                ).values()
-            )
+            df_year = pd.DataFrame(campaign_teledeclarations(year).values())
             df = pd.concat([df, df_year])
         else:
             logger.warning(f"TD dataset does not exist for year : {year}")
@@ -135,30 +113,6 @@ def fetch_teledeclarations(years: list) -> pd.DataFrame:
     return df
 
 
-def fetch_commune_detail(code_insee_commune, commune_details, geo_detail_type="epci"):
-    """
-    Provide EPCI code/ Department code/ Region code for a city, given the insee code of the city
-    """
-    if (
-        code_insee_commune
-        and code_insee_commune in commune_details.keys()
-        and geo_detail_type in commune_details[code_insee_commune].keys()
-    ):
-        return commune_details[code_insee_commune][geo_detail_type]
-    else:
-        return None
-
-
-def fetch_epci_name(code_insee_epci, epcis_names):
-    """
-    Provide EPCI code for an epci, given its insee code
-    """
-    if code_insee_epci and code_insee_epci in epcis_names.keys():
-        return epcis_names[code_insee_epci]
-    else:
-        return None
-
-
 def format_geo_name(geo_code: int, geo_names: {}):
     """
     Format the name of a region or department from its code
@@ -189,13 +143,6 @@ def fetch_sector(sector_id, sectors):
         return ""
 
 
-def datetimes_to_str(df):
-    date_columns = df.select_dtypes(include=["datetime64[ns, UTC]"]).columns
-    for date_column in date_columns:
-        df[date_column] = df[date_column].apply(lambda x: x.strftime("%Y-%m-%d %H:%M"))
-    return df
-
-
 def update_datagouv_resources():
     """
     Updating the URL of the different resources dsiplayed on data.gouv.fr in order to force their cache reload and display the correct update dates
@@ -233,11 +180,103 @@ def update_datagouv_resources():
         logger.exception(e)
 
 
+def current_rss_mb():
+    """
+    Resident memory of the current process. Falls back on the peak memory where /proc is not available
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * getpagesize() / 1024**2
+    except OSError:
+        return getrusage(RUSAGE_SELF).ru_maxrss / 1024
+
+
+class QueryCounter:
+    """
+    Database execute wrapper counting the queries
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def etl_stage(name):
+    """
+    Decorator recording an ETL method as a stage of the run report
+    """
+
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.stage(name):
+                return method(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
 class ETL(ABC):
     """
     Interface for the different ETL
     """
 
+    def __init__(self):
+        self.df = None
+        self.stages = []
+        self._running_stages = []
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Record the duration, the rows in and out, the memory delta and the number of queries of a step of the ETL,
+        and its error if it failed. The name of a nested stage is prefixed by the name of its parent
+        """
+        self._running_stages.append(name)
+        full_name = ".".join(self._running_stages)
+        rows_in = len(self.df) if isinstance(self.df, pd.DataFrame) else 0
+        rss_before = current_rss_mb()
+        queries = QueryCounter()
+        start = time.perf_counter()
+        error = None
+        try:
+            with connection.execute_wrapper(queries):
+                yield
+        except Exception as e:
+            error = repr(e)
+            raise
+        finally:
+            self._running_stages.pop()
+            duration = time.perf_counter() - start
+            rows_out = len(self.df) if isinstance(self.df, pd.DataFrame) else 0
+            self.stages.append(
+                {
+                    "stage": full_name,
+                    "duration_s": round(duration, 3),
+                    "rows_in": rows_in,
+                    "rows_out": rows_out,
+                    "memory_delta_mb": round(current_rss_mb() - rss_before, 1),
+                    "queries": queries.count,
+                    **({"error": error} if error else {}),
+                }
+            )
+            logger.info(f"{self.__class__.__name__} {full_name} : {duration:.2f}s, {rows_in} -> {rows_out} rows")
+
+    def get_report(self):
+        """
+        Report of the run, the duration being the sum of the top level stages
+        """
+        return {
+            "etl": self.__class__.__name__,
+            "date": datetime.datetime.now().isoformat(),
+            "duration_s": round(sum(stage["duration_s"] for stage in self.stages if "." not in stage["stage"]), 3),
+            "stages": self.stages,
+        }
+
     @abstractmethod
     def extract_dataset(self):
         pass
@@ -253,11 +292,74 @@ class ETL(ABC):
 
 class ETL_OPEN_DATA(ETL):
 
-    def __init__(self):
-        self.df = None
+    def __init__(self, incremental=False):
+        super().__init__()
         self.schema = None
         self.schema_url = ""
         self.dataset_name = ""
+        self.incremental = incremental
+        self.high_water_mark = None
+        self.extraction_chunk_size = 5000
+
+    def get_high_water_mark(self):
+        """
+        Returns a value identifying the state of the source data, or None if the dataset can not be exported incrementally
+        """
+        return None
+
+    def _state_filepath(self):
+        return f"open_data/{self.dataset_name}_state.json"
+
+    def load_state(self):
+        """
+        Returns the high water mark saved during the last successful export, if any
+        """
+        if not default_storage.exists(self._state_filepath()):
+            return None
+        with default_storage.open(self._state_filepath(), "r") as state_file:
+            return json.load(state_file).get("high_water_mark")
+
+    def save_state(self):
+        if default_storage.exists(self._state_filepath()):
+            default_storage.delete(self._state_filepath())
+        state = {"high_water_mark": self.high_water_mark, "export_date": datetime.datetime.now().isoformat()}
+        default_storage.save(self._state_filepath(), ContentFile(json.dumps(state).encode("utf-8")))
+
+    def save_report(self, part=None):
+        """
+        Save the report of the run along with the previous ones, to follow the stages durations and the dataset size.
+        The part, e.g. the format written by a separate task, keeps the reports of a same run apart
+        """
+        report = {"dataset": self.dataset_name, "rows": self.len_dataset(), **self.get_report()}
+        filename = f"{datetime.datetime.now():%Y-%m-%d_%H%M%S}{f'_{part}' if part else ''}"
+        filepath = f"etl_reports/{self.dataset_name}/{filename}.json"
+        try:
+            default_storage.save(filepath, ContentFile(json.dumps(report).encode("utf-8")))
+        except Exception as e:
+            logger.exception(f"Error saving the report of the {self.dataset_name} dataset: {e}")
+
+    def load_previous_snapshot(self):
+        """
+        Returns the dataset exported during the last run, read from its parquet file
+        """
+        filepath = f"open_data/{self.dataset_name}.parquet"
+        if not default_storage.exists(filepath):
+            return None
+        with default_storage.open(filepath, "rb") as parquet_file:
+            return pd.read_parquet(parquet_file)
+
+    def is_up_to_date(self):
+        """
+        In incremental mode, the dataset does not need to be exported again if its source data has not changed
+        """
+        if not self.incremental:
+            return False
+        self.high_water_mark = self.get_high_water_mark()
+        return (
+            self.high_water_mark is not None
+            and self.high_water_mark == self.load_state()
+            and default_storage.exists(f"open_data/{self.dataset_name}.parquet")
+        )
 
     def _fill_geo_names(self, geo_zoom="department"):
         """
@@ -277,28 +379,26 @@ class ETL_OPEN_DATA(ETL):
 
         self.df[f"{geo_zoom}_lib"] = self.df[geo_zoom].apply(lambda x: format_geo_name(x, geo))
 
+    @etl_stage("transform_geo_data")
     def transform_geo_data(self, geo_col_names=["department", "region"]):
         logger.info("Start fetching communes details")
-        communes_infos = map_communes_infos()
+        referential = get_geo_referential()
+        if not referential:
+            logger.warning(
+                "No geo referential snapshot found, downloading it. Run refresh_geo_referential to avoid this"
+            )
+            referential = GeoReferential.from_api() or GeoReferential(None, {}, {})
 
         if "campagne_td" in self.dataset_name:
             # Get department and region as most of TD doesnt have this info
-            self.df["canteen_department"] = self.df["canteen_city_insee_code"].apply(
-                lambda x: fetch_commune_detail(x, communes_infos, "department")
-            )
-            self.df["canteen_region"] = self.df["canteen_city_insee_code"].apply(
-                lambda x: fetch_commune_detail(x, communes_infos, "region")
-            )
+            self.df["canteen_department"] = self.df["canteen_city_insee_code"].apply(referential.department)
+            self.df["canteen_region"] = self.df["canteen_city_insee_code"].apply(referential.region)
             prefix = "canteen_"
         else:
             prefix = ""
 
-        self.df[prefix + "epci"] = self.df[prefix + "city_insee_code"].apply(
-            lambda x: fetch_commune_detail(x, communes_infos, "epci")
-        )
-
-        epcis_names = map_epcis_code_name()
-        self.df[prefix + "epci_lib"] = self.df[prefix + "epci"].apply(lambda x: fetch_epci_name(x, epcis_names))
+        self.df[prefix + "epci"] = self.df[prefix + "city_insee_code"].apply(referential.epci)
+        self.df[prefix + "epci_lib"] = self.df[prefix + "epci"].apply(referential.epci_name)
 
         for geo in geo_col_names:
             logger.info("Start filling geo_name")
@@ -306,6 +406,7 @@ class ETL_OPEN_DATA(ETL):
             col_geo = self.df.pop(f"{geo}_lib")
             self.df.insert(self.df.columns.get_loc(geo) + 1, f"{geo}_lib", col_geo)
 
+    @etl_stage("clean_dataset")
     def _clean_dataset(self):
         columns = [i["name"].replace("canteen_", "canteen.") for i in self.schema["fields"]]
 
@@ -324,14 +425,39 @@ class ETL_OPEN_DATA(ETL):
                 self.df[col_int["name"]] = self.df[col_int["name"]].round(decimals=4)
         self.df = self.df.replace("<NA>", "")
 
+    def _extract_in_chunks(self, queryset, columns, chunk_size=5000):
+        """
+        Stream the rows of a queryset through a server-side cursor and build the dataframe chunk by chunk.
+        Each chunk is typed according to the schema so that the intermediate objects are released as we go
+        """
+        dtypes = {field["name"]: "Int64" for field in self.schema["fields"] if field["type"] == "integer"}
+        chunks = []
+        rows = []
+        for row in queryset.values_list(*columns).iterator(chunk_size=chunk_size):
+            rows.append(row)
+            if len(rows) == chunk_size:
+                chunks.append(self._build_chunk(rows, columns, dtypes))
+                rows = []
+        if rows:
+            chunks.append(self._build_chunk(rows, columns, dtypes))
+
+        if not chunks:
+            return pd.DataFrame(columns=columns)
+        return pd.concat(chunks, ignore_index=True)
+
+    @staticmethod
+    def _build_chunk(rows, columns, dtypes):
+        chunk = pd.DataFrame.from_records(rows, columns=columns)
+        return chunk.astype({col: dtype for col, dtype in dtypes.items() if col in chunk.columns})
+
+    @etl_stage("extract_sectors")
     def _extract_sectors(self):
-        # Fetching sectors information and aggreting in list in order to have only one row per canteen
+        # The sectors are aggregated in a list of ids during the extraction, there is only one row per canteen
         sectors = map_sectors()
-        self.df["sectors"] = self.df["sectors"].apply(lambda x: fetch_sector(x, sectors))
-        canteens_sectors = self.df.groupby("id")["sectors"].apply(list).apply(format_list_sectors)
-        del self.df["sectors"]
-
-        return self.df.merge(canteens_sectors, on="id")
+        self.df["sectors"] = self.df["sectors"].apply(
+            lambda sector_ids: format_list_sectors([fetch_sector(x, sectors) for x in sector_ids or []])
+        )
+        return self.df
 
     def get_schema(self):
         return self.schema
@@ -345,32 +471,14 @@ class ETL_OPEN_DATA(ETL):
         else:
             return 0
 
-    def is_valid(self, filepath) -> bool:
-        # In order to validate the dataset with the validata api, must first convert to CSV then save online
-        with default_storage.open(filepath + "_to_validate.csv", "w") as file:
-            self.df.to_csv(
-                file,
-                sep=";",
-                index=False,
-                na_rep="",
-                encoding="utf_8_sig",
-                quoting=csv.QUOTE_NONE,
-            )
-        dataset_to_validate_url = (
-            f"{os.environ['CELLAR_HOST']}/{os.environ['CELLAR_BUCKET_NAME']}/media/{filepath}_to_validate.csv"
-        )
-
-        res = requests.get(
-            f"https://api.validata.etalab.studio/validate?schema={self.schema_url}&url={dataset_to_validate_url}&header_case=true"
-        )
-        report = json.loads(res.text)["report"]
-        if len(report["errors"]) > 0 or report["stats"]["errors"] > 0:
+    def is_valid(self) -> bool:
+        report = validate_dataframe(self.df, self.schema)
+        if not report["valid"]:
             logger.error(f"The dataset {self.dataset_name} extraction has errors : ")
             logger.error(report["errors"])
             logger.error(report["tasks"])
-            return 0
-        else:
-            return 1
+            return False
+        return True
 
     def _load_data_csv(self, filename):
         df_csv = self.df.copy()
@@ -392,64 +500,91 @@ class ETL_OPEN_DATA(ETL):
             self.df.to_parquet(parquet_file)
 
     def _load_data_xlsx(self, filename):
-        chunk_size = 1000
-        start_row = 0
-
-        # Create an in-memory bytes buffer
-        output = BytesIO()
-
-        # Create ExcelWriter with the actual file path
-        with pd.ExcelWriter(output, engine="openpyxl") as writer:
-            dataframe_chunks = [self.df[i : i + chunk_size] for i in range(0, len(self.df), chunk_size)]
-            for chunk in dataframe_chunks:
-                # Convert datetime to string and create copy to avoid modifications on the original dataframe
-                chunk = datetimes_to_str(chunk.copy())
-
-                # Write chunk to the sheet, accumulating data
-                chunk.to_excel(
-                    writer,
-                    startrow=start_row,
-                    index=False,
-                    header=True if start_row == 0 else False,
-                )
-                start_row += len(chunk)  # Update starting row for next chunk
-
-        # Ensure the buffer is ready for reading
-        output.seek(0)
+        with default_storage.open(filename + ".xlsx", "wb") as xlsx_file:
+            write_dataframe_xlsx(xlsx_file, self.df)
 
-        # Save the in-memory bytes buffer to the storage backend
-        with default_storage.open(filename + ".xlsx", "wb") as f:
-            f.write(output.getvalue())
-
-    def load_dataset(self):
+    def load_dataset_format(self, file_format):
         filepath = f"open_data/{self.dataset_name}"
+        loaders = {
+            "csv": self._load_data_csv,
+            "parquet": self._load_data_parquet,
+            "xlsx": self._load_data_xlsx,
+        }
+        with self.stage(f"load_{file_format}"):
+            loaders[file_format](filepath)
+
+    def load_dataset(self, file_formats=["csv", "parquet", "xlsx"]):
+        """
+        Validate the dataset and save it in the given formats. Returns True if the dataset has been saved
+        """
         if (
-            os.environ.get("STATICFILES_STORAGE") == "dstorages.backends.s3boto3.S3StaticStorage"
+            os.environ.get("STATICFILES_STORAGE") == "storages.backends.s3boto3.S3StaticStorage"
             and os.environ.get("DEFAULT_FILE_STORAGE") == "storages.backends.s3boto3.S3Boto3Storage"
         ):
             if not self.is_valid():
-                logger.error(f"The dataset {self.name} is invalid and therefore will not be exported to s3")
-                return
+                logger.error(f"The dataset {self.dataset_name} is invalid and therefore will not be exported to s3")
+                return False
         try:
-            self._load_data_csv(filepath)
-            self._load_data_parquet(filepath)
-            self._load_data_xlsx(filepath)
-
-            update_datagouv_resources()
+            for file_format in file_formats:
+                self.load_dataset_format(file_format)
+            if self.high_water_mark is not None and "parquet" in file_formats:
+                self.save_state()
+            return True
         except Exception as e:
             logger.error(f"Error saving validated data: {e}")
+            return False
 
 
 class ETL_CANTEEN(ETL_OPEN_DATA):
-    def __init__(self):
-        super().__init__()
+    def __init__(self, incremental=False):
+        super().__init__(incremental)
         self.dataset_name = "registre_cantines"
         self.schema = json.load(open("data/schemas/schema_cantine.json"))
         self.schema_url = (
             "https://raw.githubusercontent.com/betagouv/ma-cantine/staging/data/schemas/schema_cantine.json"
         )
         self.canteens = None
+        self.previous_df = None
+
+    def get_high_water_mark(self):
+        last_modification = Canteen.all_objects.aggregate(Max("modification_date"))["modification_date__max"]
+        # The links to the sectors are not in the history of the canteens, any of their changes is spotted by
+        # their count and their last id
+        sector_links = Canteen.sectors.through.objects.aggregate(count=Count("id"), max_id=Max("id"))
+        return {
+            "history_id": Canteen.history.aggregate(Max("history_id"))["history_id__max"],
+            "modification_date": last_modification.isoformat() if last_modification else None,
+            "diagnostic_history_id": Diagnostic.history.aggregate(Max("history_id"))["history_id__max"],
+            "sector_links": [sector_links["count"], sector_links["max_id"]],
+        }
 
+    def is_up_to_date(self):
+        # The dataset also depends on the managers and the teledeclarations, so it is always rebuilt
+        return False
+
+    def _changed_canteen_ids(self, state):
+        """
+        Ids of the canteens created, modified or deleted since the last export, or whose diagnostics changed.
+        Returns None if the changes can not be tracked, e.g. the sectors of some canteens changed, and the whole
+        dataset must be extracted again
+        """
+        if "sector_links" not in state or state["sector_links"] != self.high_water_mark["sector_links"]:
+            return None
+        changed_ids = set(Canteen.history.filter(history_id__gt=state["history_id"] or 0).values_list("id", flat=True))
+        if state["modification_date"]:
+            changed_ids.update(
+                Canteen.all_objects.filter(modification_date__gt=state["modification_date"]).values_list(
+                    "id", flat=True
+                )
+            )
+        changed_ids.update(
+            Diagnostic.history.filter(history_id__gt=state["diagnostic_history_id"] or 0).values_list(
+                "canteen_id", flat=True
+            )
+        )
+        return changed_ids
+
+    @etl_stage("extract")
     def extract_dataset(self):
         all_canteens_col = [i["name"] for i in self.schema["fields"]]
         self.canteens_col_from_db = all_canteens_col
@@ -467,26 +602,29 @@ class ETL_CANTEEN(ETL_OPEN_DATA):
 
         exclude_filter = Q(sectors__id=22)  # Filtering out the police / army sectors
         exclude_filter |= Q(deletion_date__isnull=False)  # Filtering out the deleted canteens
-        start = time.time()
-        self.canteens = Canteen.objects.exclude(exclude_filter)
-
-        if self.canteens.count() == 0:
-            self.df = pd.DataFrame(columns=self.canteens_col_from_db)
-        else:
-            # Creating a dataframe with all canteens. The canteens can have multiple lines if they have multiple sectors
-            self.df = pd.DataFrame(self.canteens.values(*self.canteens_col_from_db))
-
-        end = time.time()
-        logger.info(f"Time spent on canteens extraction : {end - start}")
+        if self.incremental:
+            self.high_water_mark = self.get_high_water_mark()
+        self.canteens = Canteen.objects.exclude(exclude_filter).annotate(
+            sectors_ids=ArrayAgg("sectors", filter=Q(sectors__isnull=False))
+        )
 
+        self.previous_df = None
+        state = self.load_state() if self.incremental else None
+        previous_df = self.load_previous_snapshot() if state else None
+        changed_ids = self._changed_canteen_ids(state) if previous_df is not None else None
+        if changed_ids is not None:
+            # Only extracting the canteens that changed, the others are kept from the previous export
+            logger.info(f"Canteens : Incremental extraction of {len(changed_ids)} changed canteens")
+            self.canteens = self.canteens.filter(id__in=changed_ids)
+            self.previous_df = previous_df[~previous_df["id"].isin(changed_ids)]
+
+        # Creating a dataframe with one line per canteen, the sectors being aggregated by the database
+        columns = [col if col != "sectors" else "sectors_ids" for col in self.canteens_col_from_db]
+        self.df = self._extract_in_chunks(self.canteens, columns, chunk_size=self.extraction_chunk_size)
+        self.df = self.df.rename(columns={"sectors_ids": "sectors"})
+
+    @etl_stage("transform")
     def transform_dataset(self):
-        # Adding the active_on_ma_cantine column
-        start = time.time()
-        non_active_canteens = Canteen.objects.filter(managers=None).values_list("id", flat=True)
-        end = time.time()
-        logger.info(f"Time spent on active canteens : {end - start}")
-        self.df["active_on_ma_cantine"] = self.df["id"].apply(lambda x: x not in non_active_canteens)
-
         logger.info("Canteens : Extract sectors...")
         self.df = self._extract_sectors()
 
@@ -500,27 +638,36 @@ class ETL_CANTEEN(ETL_OPEN_DATA):
         self._clean_dataset()
 
         logger.info("Canteens : Fill geo name...")
-        start = time.time()
         self.transform_geo_data(geo_col_names=["department", "region"])
-        end = time.time()
-        logger.info(f"Time spent on geo data : {end - start}")
+
+        if self.previous_df is not None:
+            logger.info("Canteens : Merge with the previous export...")
+            self.df = pd.concat([self.previous_df, self.df], ignore_index=True)
+
+        self._add_active_on_ma_cantine()
 
         logger.info("Canteens : Fill campaign participations...")
-        start = time.time()
+        self._add_campaign_participations()
+
+    @etl_stage("active_on_ma_cantine")
+    def _add_active_on_ma_cantine(self):
+        non_active_canteens = set(Canteen.objects.filter(managers=None).values_list("id", flat=True))
+        self.df["active_on_ma_cantine"] = ~self.df["id"].isin(non_active_canteens)
+
+    @etl_stage("campaign_participations")
+    def _add_campaign_participations(self):
         for year in [2021, 2022, 2023]:
             campaign_participation = map_canteens_td(year)
             if year == 2023:
                 col_name_campaign = f"declaration_donnees_{year}_en_cours"
             else:
                 col_name_campaign = f"declaration_donnees_{year}"
-            self.df[col_name_campaign] = self.df["id"].apply(lambda x: x in campaign_participation)
-        end = time.time()
-        logger.info(f"Time spent on campaign participations : {end - start}")
+            self.df[col_name_campaign] = self.df["id"].isin(campaign_participation)
 
 
 class ETL_TD(ETL_OPEN_DATA):
-    def __init__(self, year: int):
-        super().__init__()
+    def __init__(self, year: int, incremental=False):
+        super().__init__(incremental)
         self.year = year
         self.dataset_name = f"campagne_td_{year}"
         self.schema = json.load(open("data/schemas/schema_teledeclaration.json"))
@@ -545,11 +692,86 @@ class ETL_TD(ETL_OPEN_DATA):
                 "_externalites",
             ],
         }
+        # Schema columns computed during the transformation, they are not read from the declared data
+        self.derived_columns = [
+            "canteen_epci",
+            "canteen_epci_lib",
+            "canteen_department_lib",
+            "canteen_region_lib",
+            "teledeclaration_ratio_bio",
+            "teledeclaration_ratio_egalim_hors_bio",
+        ]
+        # Flattened declared data columns whose name does not derive from the schema column name
+        self.declared_data_columns = {
+            "canteen_central_kitchen_siret": "central_kitchen_siret",
+            "teledeclaration_type": "teledeclaration.diagnostic_type",
+        }
         self.df = None
 
+    def get_high_water_mark(self):
+        # Any creation, modification or deletion of a teledeclaration of the campaign is recorded in its history
+        return {
+            "history_id": Teledeclaration.history.filter(year=self.year).aggregate(Max("history_id"))[
+                "history_id__max"
+            ]
+        }
+
+    @etl_stage("extract")
     def extract_dataset(self):
-        self.df = fetch_teledeclarations([self.year])
+        if self.incremental:
+            self.high_water_mark = self.get_high_water_mark()
+        if self.year not in CAMPAIGN_DATES.keys():
+            logger.warning(f"TD dataset does not exist for year : {self.year}")
+            self.df = pd.DataFrame()
+            return
+        projection = self._declared_data_projection()
+        queryset = campaign_teledeclarations(self.year).annotate(**projection)
+        columns = self.model_columns + list(projection.keys())
+        self.df = self._extract_in_chunks(queryset, columns, self.extraction_chunk_size)
+
+    @property
+    def model_columns(self):
+        model_fields = [field.attname for field in Teledeclaration._meta.concrete_fields]
+        # The canteen columns are read from the declared data, as they were at the time of the teledeclaration
+        return [
+            field["name"]
+            for field in self.schema["fields"]
+            if field["name"].replace("canteen_", "canteen.") in model_fields
+        ]
+
+    def _declared_data_projection(self):
+        """
+        Build the Postgres expressions reading only the declared data needed by the schema, named as
+        the columns flattened by pd.json_normalize, along with the sums of the appro categories
+        """
+        types = {"integer": IntegerField(), "number": FloatField()}
+        projection = {}
+        for field in self.schema["fields"]:
+            if field["name"] in self.model_columns or field["name"] in self.derived_columns:
+                continue
+            column = self.declared_data_columns.get(field["name"], field["name"].replace("canteen_", "canteen."))
+            path = "declared_data__" + column.replace(".", "__")
+            if field["type"] == "array":
+                projection[column] = F(path)
+            elif field["type"] in types:
+                projection[column] = Cast(KT(path), types[field["type"]])
+            else:
+                projection[column] = KT(path)
 
+        projection["teledeclaration.value_total_ht"] = Cast(
+            KT("declared_data__teledeclaration__value_total_ht"), FloatField()
+        )
+        for categ, elements_in_categ in self.categories_to_aggregate.items():
+            # Same columns as _aggregation_col: the numeric values whose key matches one of the sub categories
+            projection[f"teledeclaration.value_{categ}_ht"] = RawSQL(
+                "SELECT SUM((value #>> '{}')::float) FROM jsonb_each(declared_data->'teledeclaration') "
+                "WHERE jsonb_typeof(value) = 'number' AND key ~ %s",
+                ("|".join(elements_in_categ),),
+                output_field=FloatField(),
+            )
+        return projection
+
+    @etl_stage("transform_sectors")
     def transform_sectors(self) -> pd.Series:
         sectors = self.df["canteen_sectors"]
         if not sectors.isnull().all():
@@ -557,12 +779,15 @@ class ETL_TD(ETL_OPEN_DATA):
             sectors = sectors.apply(format_list_sectors)
         return sectors
 
+    @etl_stage("transform")
     def transform_dataset(self):
-        logger.info("TD campagne : Flatten declared data...")
-        self.df = self._flatten_declared_data()
+        if "declared_data" in self.df.columns:
+            # The declared data has not been projected during the extraction
+            logger.info("TD campagne : Flatten declared data...")
+            self.df = self._flatten_declared_data()
 
-        logger.info("TD campagne : Aggregate appro data for complete TD...")
-        self._aggregate_complete_td()
+            logger.info("TD campagne : Aggregate appro data for complete TD...")
+            self._aggregate_complete_td()
 
         self.df["teledeclaration_ratio_bio"] = (
             self.df["teledeclaration.value_bio_ht"] / self.df["teledeclaration.value_total_ht"]
@@ -590,6 +815,7 @@ class ETL_TD(ETL_OPEN_DATA):
         logger.info("TD Campagne : Fill geo name...")
         self.transform_geo_data(geo_col_names=["canteen_department", "canteen_region"])
 
+    @etl_stage("flatten_declared_data")
     def _flatten_declared_data(self):
         tmp_df = pd.json_normalize(self.df["declared_data"])
         self.df = pd.concat([self.df.drop("declared_data", axis=1), tmp_df], axis=1)
@@ -601,6 +827,7 @@ class ETL_TD(ETL_OPEN_DATA):
             axis=1, numeric_only=True, skipna=True, min_count=1
         )
 
+    @etl_stage("aggregate_complete_td")
     def _aggregate_complete_td(self):
         """
         Aggregate the columns of a complete TD for an appro category if the total value of this category is not specified.
@@ -608,10 +835,12 @@ class ETL_TD(ETL_OPEN_DATA):
         for categ, elements_in_categ in self.categories_to_aggregate.items():
             self._aggregation_col(categ, elements_in_categ)
 
+    @etl_stage("filter_null_values")
     def _filter_null_values(self):
         "We have decided not take into accounts the TD where the value total or the value bio are null"
         self.df = self.df[~self.df["teledeclaration_ratio_bio"].isnull()]
 
+    @etl_stage("filter_outsiders")
     def _filter_outsiders(self):
         """
         For the campaign 2023, after analyses, we decided to exclude two TD because their value were impossible
@@ -620,6 +849,7 @@ class ETL_TD(ETL_OPEN_DATA):
             td_with_errors = [9656, 8037]
             self.df = self.df[~self.df["id"].isin(td_with_errors)]
 
+    @etl_stage("filter_by_ministry")
     def _filter_by_ministry(self):
         """
         Filtering the ministry of Armees so they do     not appear publicly
@@ -635,12 +865,14 @@ class ETL_ANALYSIS(ETL):
     """
 
     def __init__(self):
-        self.df = None
+        super().__init__()
         self.years = CAMPAIGN_DATES.keys()
 
+    @etl_stage("extract")
     def extract_dataset(self):
         self.df = fetch_teledeclarations(self.years)
 
+    @etl_stage("transform")
     def transform_dataset(self):
         pass
 
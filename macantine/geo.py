@@ -0,0 +1,164 @@
+import json
+import logging
+import requests
+from collections import defaultdict
+from datetime import date
+from uuid import uuid4
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+logger = logging.getLogger(__name__)
+
+GEO_REFERENTIAL_PATH = "geo/referentiel_geo.json"
+# Changed by each save of the snapshot, so that every process reloads it
+GEO_REFERENTIAL_TOKEN_KEY = "geo-referential-token"
+
+_geo_referential = None
+_geo_referential_loaded = False
+_geo_referential_token = None
+
+
+def map_communes_infos():
+    """
+    Create a dict that maps cities with their EPCI code
+    """
+    commune_details = {}
+    try:
+        logger.info("Starting communes dl")
+        response_commune = requests.get("https://geo.api.gouv.fr/communes", timeout=50)
+        response_commune.raise_for_status()
+        communes = response_commune.json()
+        for commune in communes:
+            commune_details[commune["code"]] = {}
+            if "codeDepartement" in commune.keys():
+                commune_details[commune["code"]]["department"] = commune["codeDepartement"]
+            if "codeRegion" in commune.keys():
+                commune_details[commune["code"]]["region"] = commune["codeRegion"]
+            if "codeEpci" in commune.keys():
+                commune_details[commune["code"]]["epci"] = commune["codeEpci"]
+    except requests.exceptions.HTTPError as e:
+        logger.info(e)
+        return None
+    return commune_details
+
+
+def map_epcis_code_name():
+    try:
+        epci_names = {}
+        response = requests.get("https://geo.api.gouv.fr/epcis/?fields=nom", timeout=50)
+        response.raise_for_status()
+        epcis = response.json()
+        for epci in epcis:
+            epci_names[epci["code"]] = epci["nom"]
+        return epci_names
+    except requests.exceptions.HTTPError as e:
+        logger.info(e)
+        return {}
+
+
+class GeoReferential:
+    """
+    In-memory referential of the communes, keyed by INSEE code, and of the EPCIs, keyed by their code
+    """
+
+    def __init__(self, version, communes, epcis):
+        self.version = version
+        # {insee_code: (department, region, epci)}
+        self.communes = communes
+        # {epci_code: epci_name}
+        self.epcis = epcis
+        # {epci_code: [insee_code]}, the members of the EPCIs are resolved without scanning the communes
+        self.epci_communes = defaultdict(list)
+        for code, details in communes.items():
+            if details[2]:
+                self.epci_communes[details[2]].append(code)
+
+    @classmethod
+    def from_api(cls):
+        """
+        Download the referential from geo.api.gouv.fr. Returns None if the communes could not be fetched
+        """
+        commune_details = map_communes_infos()
+        if not commune_details:
+            return None
+        communes = {
+            code: (details.get("department"), details.get("region"), details.get("epci"))
+            for code, details in commune_details.items()
+        }
+        return cls(date.today().isoformat(), communes, map_epcis_code_name())
+
+    @classmethod
+    def from_dict(cls, data):
+        communes = {code: tuple(details) for code, details in data["communes"].items()}
+        return cls(data["version"], communes, data["epcis"])
+
+    def to_dict(self):
+        return {"version": self.version, "communes": self.communes, "epcis": self.epcis}
+
+    def department(self, city_insee_code):
+        return self._commune_detail(city_insee_code, 0)
+
+    def region(self, city_insee_code):
+        return self._commune_detail(city_insee_code, 1)
+
+    def epci(self, city_insee_code):
+        return self._commune_detail(city_insee_code, 2)
+
+    def epci_name(self, epci_code):
+        return self.epcis.get(epci_code) if isinstance(epci_code, str) else None
+
+    def communes_in_epci(self, epci_code):
+        return list(self.epci_communes.get(epci_code, []))
+
+    def _commune_detail(self, city_insee_code, index):
+        details = self.communes.get(city_insee_code) if isinstance(city_insee_code, str) else None
+        return details[index] if details else None
+
+
+def _get_geo_referential_token():
+    try:
+        return cache.get(GEO_REFERENTIAL_TOKEN_KEY)
+    except Exception as e:
+        logger.exception(f"Unable to read the geo referential token: {e}")
+        return None
+
+
+def save_geo_referential(referential):
+    """
+    Save the referential snapshot in the configured file system (local or s3), the other processes reloading it on
+    their next access
+    """
+    global _geo_referential, _geo_referential_loaded, _geo_referential_token
+    if default_storage.exists(GEO_REFERENTIAL_PATH):
+        default_storage.delete(GEO_REFERENTIAL_PATH)
+    default_storage.save(GEO_REFERENTIAL_PATH, ContentFile(json.dumps(referential.to_dict()).encode("utf-8")))
+    token = uuid4().hex
+    try:
+        cache.set(GEO_REFERENTIAL_TOKEN_KEY, token, timeout=None)
+    except Exception as e:
+        logger.exception(f"Unable to publish the geo referential token: {e}")
+    _geo_referential, _geo_referential_loaded, _geo_referential_token = referential, True, token
+
+
+def get_geo_referential():
+    """
+    Load the referential snapshot once per process, or again once another process saved a new one. Returns None if
+    no snapshot has been saved yet, which is remembered too
+    """
+    global _geo_referential, _geo_referential_loaded, _geo_referential_token
+    token = _get_geo_referential_token()
+    if _geo_referential_loaded and (token is None or token == _geo_referential_token):
+        return _geo_referential
+    referential = None
+    if default_storage.exists(GEO_REFERENTIAL_PATH):
+        with default_storage.open(GEO_REFERENTIAL_PATH, "r") as file:
+            referential = GeoReferential.from_dict(json.load(file))
+        logger.info(f"Geo referential loaded, version {referential.version}")
+    _geo_referential, _geo_referential_loaded, _geo_referential_token = referential, True, token
+    return _geo_referential
+
+
+def clear_geo_referential_cache():
+    global _geo_referential, _geo_referential_loaded, _geo_referential_token
+    _geo_referential, _geo_referential_loaded, _geo_referential_token = None, False, None
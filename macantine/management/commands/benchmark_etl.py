@@ -0,0 +1,55 @@
+import datetime
+import json
+import os
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from macantine.benchmark import BENCHMARK_FORMATS, benchmark_etl, current_commit, generate_synthetic_data, peak_rss_mb
+from macantine.tasks import EXPORTED_DATASETS, _get_dataset_etl
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate synthetic canteens and teledeclarations, run the open data ETLs stage by stage and report "
+        "the wall time, peak memory and row counts as JSON. The synthetic data is rolled back at the end"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--canteens", type=int, default=1000)
+        parser.add_argument("--sectors-per-canteen", type=int, default=3)
+        parser.add_argument("--teledeclarations", type=int, default=600, help="Spread across the campaign years")
+        parser.add_argument("--central-kitchens", type=int, default=5)
+        parser.add_argument("--satellites-per-central-kitchen", type=int, default=20)
+        parser.add_argument("--datasets", nargs="+", choices=EXPORTED_DATASETS, default=EXPORTED_DATASETS)
+        parser.add_argument("--formats", nargs="+", choices=BENCHMARK_FORMATS, default=BENCHMARK_FORMATS)
+        parser.add_argument("--output", help="Path of the JSON report, written to the standard output by default")
+
+    def handle(self, *args, **options):
+        if os.environ.get("ENVIRONMENT") == "prod":
+            raise CommandError("The benchmark inserts synthetic data and must not be run in production")
+
+        with transaction.atomic():
+            volumes = generate_synthetic_data(
+                canteens=options["canteens"],
+                sectors_per_canteen=options["sectors_per_canteen"],
+                teledeclarations=options["teledeclarations"],
+                central_kitchens=options["central_kitchens"],
+                satellites_per_central_kitchen=options["satellites_per_central_kitchen"],
+            )
+            datasets = {
+                dataset: benchmark_etl(_get_dataset_etl(dataset), options["formats"])
+                for dataset in options["datasets"]
+            }
+            transaction.set_rollback(True)
+
+        report = {
+            "date": datetime.datetime.now().isoformat(),
+            "commit": current_commit(),
+            "volumes": volumes,
+            "datasets": datasets,
+            "peak_rss_mb": peak_rss_mb(),
+        }
+        if options["output"]:
+            with open(options["output"], "w") as output:
+                json.dump(report, output, indent=2)
+        else:
+            self.stdout.write(json.dumps(report, indent=2))
@@ -1,5 +1,6 @@
 from django.core.management.base import BaseCommand
-from macantine.tasks import export_datasets
+from macantine.etl import update_datagouv_resources
+from macantine.tasks import EXPORTED_DATASETS, EXPORT_FORMATS, export_dataset, export_dataset_format
 
 
 class Command(BaseCommand):
@@ -7,5 +8,17 @@ class Command(BaseCommand):
         "Export datasets TD and canteens to the 'media/open_data' folder of the configured file system (local or s3)"
     )
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--incremental",
+            action="store_true",
+            help="Only export the changes since the last export, on top of the previous files",
+        )
+
     def handle(self, *args, **options):
-        export_datasets()
+        # Running the exports one after the other in the current process, without the celery workers
+        for dataset in EXPORTED_DATASETS:
+            exported = export_dataset(dataset, options["incremental"])
+            for file_format in EXPORT_FORMATS:
+                export_dataset_format(exported, dataset, file_format)
+        update_datagouv_resources()
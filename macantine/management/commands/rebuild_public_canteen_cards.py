@@ -0,0 +1,17 @@
+import logging
+from django.core.management.base import BaseCommand
+from data.models import PublicCanteenCard
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Rebuild the denormalised cards read by the public canteen endpoints, for all publicly visible canteens"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        logger.info("Start task : rebuild_public_canteen_cards")
+        count = PublicCanteenCard.rebuild(batch_size=options["batch_size"])
+        self.stdout.write(f"{count} public canteen cards rebuilt")
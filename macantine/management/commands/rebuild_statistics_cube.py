@@ -0,0 +1,16 @@
+import logging
+from django.core.management.base import BaseCommand
+from common.utils.response_cache import bump_generations
+from data.models import CanteenStatisticsCell
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Rebuild the statistics cube read by the canteen statistics endpoint"
+
+    def handle(self, *args, **options):
+        logger.info("Start task : rebuild_statistics_cube")
+        count = CanteenStatisticsCell.rebuild()
+        bump_generations(["canteens"])
+        self.stdout.write(f"{count} statistics cells rebuilt")
@@ -0,0 +1,21 @@
+import logging
+from django.core.management.base import BaseCommand
+from data.models import Diagnostic
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Compute the appro shares and badges stored on the diagnostics, e.g. after their rules change"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--year", type=int, help="Only the diagnostics of this year")
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        logger.info("Start task : refresh_diagnostic_badges")
+        diagnostics = Diagnostic.objects.all()
+        if options["year"]:
+            diagnostics = diagnostics.filter(year=options["year"])
+        count = Diagnostic.refresh_badges(diagnostics, batch_size=options["batch_size"])
+        self.stdout.write(f"{count} diagnostics updated")
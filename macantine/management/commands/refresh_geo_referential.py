@@ -0,0 +1,22 @@
+import logging
+from django.core.management.base import BaseCommand, CommandError
+from data.models import Canteen
+from macantine.geo import GeoReferential, save_geo_referential
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Download the communes and EPCIs from geo.api.gouv.fr and save them as the local geo referential snapshot"
+
+    def handle(self, *args, **options):
+        logger.info("Start task : refresh_geo_referential")
+        referential = GeoReferential.from_api()
+        if not referential or not referential.communes:
+            raise CommandError("Unable to download the communes, the current geo referential is kept")
+        save_geo_referential(referential)
+        canteen_count = Canteen.refresh_epcis(referential)
+        self.stdout.write(
+            f"Geo referential version {referential.version} saved : {len(referential.communes)} communes, {len(referential.epcis)} EPCIs"
+        )
+        self.stdout.write(f"EPCI updated on {canteen_count} canteens")
@@ -541,6 +541,19 @@ OAUTH2_PROVIDER = {
 REDIS_URL = os.getenv("REDIS_URL")
 REDIS_PREPEND_KEY = os.getenv("REDIS_PREPEND_KEY", "")
 
+# Cache of the anonymous API reads, see api.views.utils.CachedResponseMixin
+CACHES = {
+    "default": (
+        {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+            "KEY_PREFIX": REDIS_PREPEND_KEY,
+        }
+        if REDIS_URL
+        else {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+    )
+}
+
 AUTHLIB_OAUTH_CLIENTS = {
     "moncomptepro": {
         "client_id": os.getenv("MONCOMPTEPRO_CLIENT_ID"),
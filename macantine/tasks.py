@@ -10,13 +10,18 @@ from django.db.models import Q
 from django.core.paginator import Paginator
 from django.db.models import F
 from django.db.models.functions import Length
+from django.core.cache import cache
 from django.core.management import call_command
-from data.models import User, Canteen
+from data.models import User, Canteen, CanteenStatisticsCell
+from data.signals import RESPONSE_CACHE_GROUPS, STATISTICS_REFRESH_SCHEDULED_KEY
 import redis as r
 from common.utils import get_siret_token
+from common.utils.response_cache import bump_generations
+from celery import chain, chord, group
 from .celery import app
 from .utils import get_infos_from_siret
-from .etl import ETL_TD, ETL_CANTEEN
+from .geo import get_geo_referential
+from .etl import ETL_TD, ETL_CANTEEN, update_datagouv_resources
 import sib_api_v3_sdk
 from sib_api_v3_sdk.rest import ApiException
 
@@ -347,6 +352,9 @@ def _update_canteen_geo_data(canteen, response):
             canteen.city_insee_code = response["city_insee_code"]
             canteen.postal_code = response["postal_code"]
             canteen.city = response["city"]
+            referential = get_geo_referential()
+            if referential and referential.department(canteen.city_insee_code):
+                canteen.department = referential.department(canteen.city_insee_code)
             canteen.save()
             update_change_reason(canteen, "Données de localisation MAJ par bot, via SIRET")
             logger.info(f"Canteen info has been updated. Canteen name : {canteen.name}")
@@ -411,15 +419,109 @@ def delete_old_historical_records():
 
 
 @app.task()
-def export_datasets():
-    logger.info("Starting datasets extractions")
-    datasets = {
-        "campagne teledeclaration 2021": ETL_TD(2021),
-        "campagne teledeclaration 2022": ETL_TD(2022),
-        "cantines": ETL_CANTEEN(),
-    }
-    for key, etl in datasets.items():
-        logger.info(f"Starting {key} dataset extraction")
+def rebuild_public_canteen_cards():
+    """
+    The cards are refreshed when the canteens change, the nightly rebuild includes the writes made without signals,
+    e.g. the bulk updates, and the change of the current year which the published diagnostics depend on
+    """
+    call_command("rebuild_public_canteen_cards")
+
+
+@app.task()
+def rebuild_statistics_cube():
+    """
+    The cells are refreshed when the canteens change, the nightly rebuild includes the writes made without signals
+    and the changes of the geo referential
+    """
+    call_command("rebuild_statistics_cube")
+
+
+@app.task()
+def refresh_statistics_cells():
+    """
+    Refresh the cells of the departments changed since the last run, scheduled by the signals once the changes are
+    committed. The cached statistics are then invalidated again as they could have been built in between
+    """
+    cache.delete(STATISTICS_REFRESH_SCHEDULED_KEY)
+    if CanteenStatisticsCell.refresh_stale():
+        bump_generations(RESPONSE_CACHE_GROUPS[Canteen])
+
+
+@app.task()
+def refresh_geo_referential():
+    """
+    The new communes and EPCIs are stored on the canteens, which the EPCI filter of the statistics reads
+    """
+    call_command("refresh_geo_referential")
+
+
+EXPORTED_DATASETS = ["campagne_td_2021", "campagne_td_2022", "registre_cantines"]
+EXPORT_FORMATS = ["csv", "xlsx"]  # The parquet file is written first and shared by the other formats
+
+
+def _get_dataset_etl(dataset, incremental=False):
+    if dataset == "registre_cantines":
+        return ETL_CANTEEN(incremental)
+    return ETL_TD(int(dataset.split("_")[-1]), incremental)
+
+
+@app.task()
+def export_dataset(dataset, incremental=False):
+    """
+    Extract and transform one dataset, then save it as parquet for the other formats.
+    Returns True if the dataset has been exported
+    """
+    etl = _get_dataset_etl(dataset, incremental)
+    if etl.is_up_to_date():
+        logger.info(f"The {dataset} dataset has not changed since the last export, skipping")
+        return False
+    logger.info(f"Starting {dataset} dataset extraction")
+    try:
         etl.extract_dataset()
         etl.transform_dataset()
-        etl.load_dataset()
+        # Once merged with the previous export in incremental mode, as the changes alone can be empty
+        if etl.len_dataset() == 0:
+            logger.warning(f"The {dataset} dataset is empty, skipping")
+            return False
+        return etl.load_dataset(file_formats=["parquet"])
+    except Exception as e:
+        # Not raising so that the other datasets and the data.gouv update still happen
+        logger.exception(f"Error exporting the {dataset} dataset: {e}")
+        return False
+    finally:
+        etl.save_report()
+
+
+@app.task()
+def export_dataset_format(exported, dataset, file_format):
+    """
+    Write one format of a dataset from the parquet file saved by export_dataset
+    """
+    if not exported:
+        return
+    etl = _get_dataset_etl(dataset)
+    try:
+        etl.df = etl.load_previous_snapshot()
+        etl.load_dataset_format(file_format)
+    except Exception as e:
+        logger.exception(f"Error saving the {dataset} dataset in {file_format}: {e}")
+    finally:
+        etl.save_report(part=file_format)
+
+
+@app.task()
+def update_datagouv_resources_after_export():
+    return update_datagouv_resources()
+
+
+@app.task()
+def export_datasets(incremental=False):
+    logger.info("Starting datasets extractions")
+    dataset_exports = [
+        chain(
+            export_dataset.si(dataset, incremental),
+            group(export_dataset_format.s(dataset, file_format) for file_format in EXPORT_FORMATS),
+        )
+        for dataset in EXPORTED_DATASETS
+    ]
+    chord(dataset_exports)(update_datagouv_resources_after_export.si())
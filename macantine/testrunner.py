@@ -2,6 +2,7 @@ import factory.random
 from random import randint
 from django.conf import settings
 from django.test.runner import DiscoverRunner
+from macantine.celery import app
 
 
 class MaCantineTestRunner(DiscoverRunner):
@@ -10,4 +11,9 @@ class MaCantineTestRunner(DiscoverRunner):
         seed = int(override_seed) if override_seed else randint(0, 65535)
         factory.random.reseed_random(seed)
         print("Using seed: {}".format(seed))
+        # The responses are not cached between the tests, whose data is rolled back. The tests of the cache
+        # override the setting with a local memory cache
+        settings.CACHES = {"default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}}
+        # The tasks scheduled by the signals, e.g. the refresh of the statistics cells, are run in the process
+        app.conf.task_always_eager = True
         super().setup_test_environment(**kwargs)
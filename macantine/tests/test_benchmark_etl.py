@@ -0,0 +1,47 @@
+import json
+import os
+import tempfile
+import requests_mock
+from django.core.management import call_command
+from django.test import TestCase
+from data.models import Canteen, Teledeclaration
+
+
+@requests_mock.Mocker()
+class TestBenchmarkEtl(TestCase):
+    def test_benchmark_report(self, mock):
+        mock.get("https://geo.api.gouv.fr/communes", text=json.dumps(""))
+        mock.get("https://geo.api.gouv.fr/epcis/?fields=nom", text=json.dumps(""))
+
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, "report.json")
+            call_command(
+                "benchmark_etl",
+                canteens=30,
+                teledeclarations=12,
+                central_kitchens=2,
+                satellites_per_central_kitchen=5,
+                datasets=["campagne_td_2022", "registre_cantines"],
+                formats=["csv", "parquet"],
+                output=output,
+            )
+            with open(output) as report_file:
+                report = json.load(report_file)
+
+        self.assertEqual(report["volumes"]["canteens"], 30)
+        self.assertEqual(report["volumes"]["satellites"], 10)
+        self.assertEqual(report["volumes"]["teledeclarations"], 12)
+
+        canteens = report["datasets"]["registre_cantines"]
+        self.assertEqual(canteens["rows"], 30)
+        stages = [stage["stage"] for stage in canteens["stages"]]
+        for stage in ["extract", "transform", "transform.transform_geo_data", "load_csv", "load_parquet"]:
+            self.assertIn(stage, stages)
+        self.assertGreater(canteens["peak_rss_mb"], 0)
+        # The TDs of the random canteens can be filtered out by the transformation (e.g. the armed forces)
+        td_stages = {stage["stage"]: stage for stage in report["datasets"]["campagne_td_2022"]["stages"]}
+        self.assertGreater(td_stages["extract"]["rows_out"], 0)
+
+        # The synthetic data should not be kept
+        self.assertEqual(Canteen.objects.count(), 0)
+        self.assertEqual(Teledeclaration.objects.count(), 0)
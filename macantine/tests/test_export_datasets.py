@@ -0,0 +1,99 @@
+import json
+import requests_mock
+from unittest import mock
+from celery.backends.cache import CacheBackend
+from django.core.files.storage import default_storage
+from django.test import TestCase
+from freezegun import freeze_time
+from data.factories import CanteenFactory, DiagnosticFactory, UserFactory
+from data.models import Teledeclaration
+from macantine import tasks
+from macantine.celery import app
+from macantine.etl import ETL_CANTEEN
+from macantine.tasks import _get_dataset_etl as get_dataset_etl
+
+
+@requests_mock.Mocker()
+class TestExportDatasets(TestCase):
+    def setUp(self):
+        # The tasks are run in the current process (see macantine/testrunner.py), with an in-memory result backend
+        # for the chord
+        backend_patcher = mock.patch.object(
+            type(app), "backend", new_callable=mock.PropertyMock, return_value=CacheBackend(app=app, url="memory://")
+        )
+        backend_patcher.start()
+        self.addCleanup(backend_patcher.stop)
+        # Avoid interferring with the files of the real exports
+        etl_patcher = mock.patch("macantine.tasks._get_dataset_etl", side_effect=self._get_test_dataset_etl)
+        etl_patcher.start()
+        self.addCleanup(etl_patcher.stop)
+
+    @staticmethod
+    def _get_test_dataset_etl(dataset, incremental=False):
+        etl = get_dataset_etl(dataset, incremental)
+        etl.dataset_name += "_test"
+        return etl
+
+    def tearDown(self):
+        for dataset in tasks.EXPORTED_DATASETS:
+            dataset += "_test"
+            for file_format in ["csv", "parquet", "xlsx"]:
+                default_storage.delete(f"open_data/{dataset}.{file_format}")
+            default_storage.delete(f"open_data/{dataset}_state.json")
+            if default_storage.exists(f"etl_reports/{dataset}"):
+                for report in default_storage.listdir(f"etl_reports/{dataset}")[1]:
+                    default_storage.delete(f"etl_reports/{dataset}/{report}")
+
+    @freeze_time("2023-05-14")  # Faking time to mock creation_date
+    @mock.patch("macantine.tasks.update_datagouv_resources")
+    def test_export_datasets(self, geo_mock, update_datagouv_resources):
+        """
+        Each dataset is exported in every format, and the data.gouv resources are updated once at the end.
+        Empty datasets are skipped without failing the other exports
+        """
+        geo_mock.get("https://geo.api.gouv.fr/communes", text=json.dumps(""))
+        geo_mock.get("https://geo.api.gouv.fr/epcis/?fields=nom", text=json.dumps(""))
+        canteen = CanteenFactory.create()
+        diagnostic = DiagnosticFactory.create(canteen=canteen, year=2022, diagnostic_type=None)
+        Teledeclaration.create_from_diagnostic(diagnostic, UserFactory.create())
+
+        tasks.export_datasets()
+
+        for dataset in ["campagne_td_2022_test", "registre_cantines_test"]:
+            for file_format in ["csv", "parquet", "xlsx"]:
+                self.assertTrue(default_storage.exists(f"open_data/{dataset}.{file_format}"))
+        for file_format in ["csv", "parquet", "xlsx"]:
+            self.assertFalse(default_storage.exists(f"open_data/campagne_td_2021_test.{file_format}"))
+        update_datagouv_resources.assert_called_once()
+        # The report of the parquet export and those of the formats written from it
+        self.assertEqual(len(default_storage.listdir("etl_reports/registre_cantines_test")[1]), 3)
+
+    @mock.patch("macantine.tasks.update_datagouv_resources")
+    def test_export_dataset_format_skipped(self, _, update_datagouv_resources):
+        """
+        The formats are not written if the dataset has not been exported
+        """
+        tasks.export_dataset_format(False, "registre_cantines", "csv")
+        self.assertFalse(default_storage.exists("open_data/registre_cantines_test.csv"))
+
+    @mock.patch("macantine.tasks.update_datagouv_resources")
+    def test_export_dataset_format_report(self, geo_mock, update_datagouv_resources):
+        """
+        The report of a format is saved, with the error of its stage if it failed
+        """
+        geo_mock.get("https://geo.api.gouv.fr/communes", text=json.dumps(""))
+        geo_mock.get("https://geo.api.gouv.fr/epcis/?fields=nom", text=json.dumps(""))
+        CanteenFactory.create()
+        self.assertTrue(tasks.export_dataset("registre_cantines"))
+
+        with mock.patch.object(ETL_CANTEEN, "_load_data_csv", side_effect=OSError("Disk full")):
+            with mock.patch("macantine.tasks.logger") as logger:
+                tasks.export_dataset_format(True, "registre_cantines", "csv")
+        logger.exception.assert_called_once()
+
+        reports = [report for report in default_storage.listdir("etl_reports/registre_cantines_test")[1]]
+        csv_report = next(report for report in reports if report.endswith("_csv.json"))
+        with default_storage.open(f"etl_reports/registre_cantines_test/{csv_report}", "r") as report_file:
+            report = json.load(report_file)
+        self.assertEqual(report["stages"][0]["stage"], "load_csv")
+        self.assertEqual(report["stages"][0]["error"], "OSError('Disk full')")
@@ -1,9 +1,11 @@
 import pandas as pd
 import requests_mock
+from common.utils.table_schema import validate_dataframe
 from django.test import TestCase, override_settings
-from macantine.etl import map_communes_infos, update_datagouv_resources
+from macantine.etl import fetch_teledeclarations, map_canteens_td, update_datagouv_resources
+from macantine.geo import map_communes_infos
 from data.factories import DiagnosticFactory, CanteenFactory, UserFactory, SectorFactory
-from data.models import Teledeclaration
+from data.models import Canteen, Diagnostic, Teledeclaration
 from macantine.etl import ETL_CANTEEN, ETL_TD, ETL_ANALYSIS
 from freezegun import freeze_time
 import json
@@ -79,6 +81,56 @@ class TestETLOpenData(TestCase):
         etl_td.extract_dataset()
         self.assertEqual(etl_td.len_dataset(), 0, "The list should be empty as the only td has the CANCELLED status")
 
+    @freeze_time("2023-05-14")  # Faking time to mock creation_date
+    def test_td_declared_data_projection(self, mock):
+        """
+        Projecting the declared data in Postgres should give the same dataset as flattening it with pandas
+        """
+        mock.get("https://geo.api.gouv.fr/communes", text=json.dumps(""))
+        mock.get("https://geo.api.gouv.fr/epcis/?fields=nom", text=json.dumps(""))
+        applicant = UserFactory.create()
+        sector = SectorFactory.create(id=101)
+        for diagnostic_type in [Diagnostic.DiagnosticType.SIMPLE, Diagnostic.DiagnosticType.COMPLETE]:
+            canteen = CanteenFactory.create(sectors=[sector])
+            diagnostic = DiagnosticFactory.create(
+                canteen=canteen,
+                year=2022,
+                diagnostic_type=diagnostic_type,
+                value_total_ht=1000,
+                value_bio_ht=200,
+                value_sustainable_ht=100,
+                value_autres_bio=10.5,
+                value_boissons_bio=20,
+                value_autres_label_rouge=5,
+                value_autres_hve=2,
+            )
+            Teledeclaration.create_from_diagnostic(diagnostic, applicant)
+
+        etl_td = ETL_TD(2022)
+        etl_td.extract_dataset()
+        self.assertNotIn("declared_data", etl_td.df.columns)
+
+        etl_td_flattened = ETL_TD(2022)
+        etl_td_flattened.df = fetch_teledeclarations([2022])
+        etl_td_flattened.df = etl_td_flattened._flatten_declared_data()
+        etl_td_flattened._aggregate_complete_td()
+        for categ in etl_td.categories_to_aggregate.keys():
+            column = f"teledeclaration.value_{categ}_ht"
+            pd.testing.assert_series_equal(
+                etl_td.df.sort_values("id")[column].reset_index(drop=True),
+                etl_td_flattened.df.sort_values("id")[column].reset_index(drop=True),
+                check_dtype=False,
+            )
+
+        etl_td.transform_dataset()
+        etl_td_flattened.df = fetch_teledeclarations([2022])
+        etl_td_flattened.transform_dataset()
+
+        projected = etl_td.get_dataset().sort_values("id").reset_index(drop=True)
+        flattened = etl_td_flattened.get_dataset().sort_values("id").reset_index(drop=True)
+        self.assertGreater(len(projected), 0)
+        pd.testing.assert_frame_equal(projected, flattened, check_dtype=False)
+
     @freeze_time("2023-05-14")  # Faking time to mock creation_date
     def test_transform_teledeclaration(self, mock):
 
@@ -180,6 +232,63 @@ class TestETLOpenData(TestCase):
         etl_canteen.extract_dataset()
         self.assertEqual(etl_canteen.len_dataset(), 0, "There should be one canteen less after hard deletion")
 
+    def test_extraction_canteen_sectors_aggregated(self, mock):
+        """
+        The sectors are aggregated during the extraction, so a canteen appears only once whatever its number of sectors
+        """
+        sectors = [SectorFactory.create(id=id) for id in [101, 102, 103]]  # Avoiding the police / army sector
+        canteen_with_sectors = CanteenFactory.create(sectors=sectors)
+        canteen_without_sector = CanteenFactory.create(sectors=[])
+
+        etl_canteen = ETL_CANTEEN()
+        etl_canteen.extraction_chunk_size = 1  # Forcing several chunks
+        etl_canteen.extract_dataset()
+
+        self.assertEqual(etl_canteen.len_dataset(), 2)
+        self.assertCountEqual(
+            etl_canteen.df[etl_canteen.df.id == canteen_with_sectors.id].iloc[0]["sectors"],
+            [sector.id for sector in sectors],
+        )
+        self.assertIsNone(etl_canteen.df[etl_canteen.df.id == canteen_without_sector.id].iloc[0]["sectors"])
+        self.assertEqual(etl_canteen.df["daily_meal_count"].dtype, "Int64")
+
+    def test_etl_stages_report(self, mock):
+        """
+        Each step of the ETL should be recorded in the report of the run, which is saved in the file system
+        """
+        mock.get("https://geo.api.gouv.fr/communes", text=json.dumps(""))
+        mock.get("https://geo.api.gouv.fr/epcis/?fields=nom", text=json.dumps(""))
+        sector = SectorFactory.create(id=101)
+        CanteenFactory.create(sectors=[sector])
+        CanteenFactory.create(sectors=[sector])
+
+        etl_canteen = ETL_CANTEEN()
+        etl_canteen.dataset_name += "_test"  # Avoid interferring with other files
+        etl_canteen.extract_dataset()
+        etl_canteen.transform_dataset()
+        etl_canteen.load_dataset_format("csv")
+        default_storage.delete(f"open_data/{etl_canteen.dataset_name}.csv")
+
+        stages = {stage["stage"]: stage for stage in etl_canteen.stages}
+        self.assertIn("transform.clean_dataset", stages)
+        self.assertIn("transform.campaign_participations", stages)
+        self.assertEqual(stages["extract"]["rows_in"], 0)
+        self.assertEqual(stages["extract"]["rows_out"], 2)
+        self.assertGreater(stages["extract"]["queries"], 0)
+        self.assertEqual(stages["transform.clean_dataset"]["queries"], 0)
+        self.assertGreaterEqual(stages["transform"]["duration_s"], stages["transform.clean_dataset"]["duration_s"])
+        self.assertIn("load_csv", stages)
+
+        etl_canteen.save_report()
+        _, reports = default_storage.listdir(f"etl_reports/{etl_canteen.dataset_name}")
+        self.assertEqual(len(reports), 1)
+        with default_storage.open(f"etl_reports/{etl_canteen.dataset_name}/{reports[0]}", "r") as report_file:
+            report = json.load(report_file)
+        default_storage.delete(f"etl_reports/{etl_canteen.dataset_name}/{reports[0]}")
+        self.assertEqual(report["dataset"], "registre_cantines_test")
+        self.assertEqual(report["rows"], 2)
+        self.assertEqual(len(report["stages"]), len(etl_canteen.stages))
+
     def test_transformation_canteens(self, mock):
         schema = json.load(open("data/schemas/schema_cantine.json"))
         schema_cols = [i["name"] for i in schema["fields"]]
@@ -304,6 +413,24 @@ class TestETLOpenData(TestCase):
             "The canteen hasn't participated in the campain",
         )
 
+    @freeze_time("2023-05-14")  # Faking time to mock creation_date
+    def test_map_canteens_td_with_satellites(self, mock):
+        """
+        The satellites declared by a central kitchen are considered as participating in the campaign
+        """
+        central_kitchen = CanteenFactory.create(siret="96766910375238", production_type=Canteen.ProductionType.CENTRAL)
+        satellite = CanteenFactory.create(
+            central_producer_siret=central_kitchen.siret, production_type=Canteen.ProductionType.ON_SITE_CENTRAL
+        )
+        canteen_has_not_declared = CanteenFactory.create()
+        applicant = UserFactory.create()
+        diagnostic = DiagnosticFactory.create(canteen=central_kitchen, year=2022, diagnostic_type=None)
+        Teledeclaration.create_from_diagnostic(diagnostic, applicant)
+
+        participation = map_canteens_td(2022)
+        self.assertCountEqual(participation, [central_kitchen.id, satellite.id])
+        self.assertNotIn(canteen_has_not_declared.id, participation)
+
     def test_transformation_canteens_sectors(self, mock):
         mock.get(
             "https://geo.api.gouv.fr/communes",
@@ -478,3 +605,189 @@ class TestETLOpenData(TestCase):
             # Cleaning files
             for file_extension in ["csv", "parquet", "xslx"]:
                 default_storage.delete(f"open_data/{etl.dataset_name}.{file_extension}")
+
+    def test_load_dataset_xlsx(self, mock):
+        etl = ETL_CANTEEN()
+        etl.dataset_name += "_test"  # Avoid interferring with other files
+        etl.df = pd.DataFrame(
+            {
+                "id": pd.Series([1, 2, None], dtype="Int64"),
+                "name": ["Cantine", None, "Autre cantine"],
+                "creation_date": pd.to_datetime(["2024-01-02 10:30", "2024-01-03 11:00", None], utc=True),
+            }
+        )
+        etl.load_dataset(file_formats=["xlsx"])
+
+        with default_storage.open(f"open_data/{etl.dataset_name}.xlsx", "rb") as xlsx_file:
+            output_dataframe = pd.read_excel(xlsx_file, dtype=str)
+        default_storage.delete(f"open_data/{etl.dataset_name}.xlsx")
+
+        self.assertEqual(list(output_dataframe.columns), ["id", "name", "creation_date"])
+        self.assertEqual(list(output_dataframe.id.fillna("")), ["1", "2", ""])
+        self.assertEqual(list(output_dataframe.name.fillna("")), ["Cantine", "", "Autre cantine"])
+        self.assertEqual(list(output_dataframe.creation_date.fillna("")), ["2024-01-02 10:30", "2024-01-03 11:00", ""])
+        self.assertIsInstance(etl.df.creation_date.dtype, pd.DatetimeTZDtype, "The dataframe should not be modified")
+
+    @freeze_time("2023-05-14")  # Faking time to mock creation_date
+    def test_dataset_validation(self, mock):
+        """
+        The transformed datasets should be valid against their schema, and the errors reported by column
+        """
+        mock.get("https://geo.api.gouv.fr/communes", text=json.dumps(""))
+        mock.get("https://geo.api.gouv.fr/epcis/?fields=nom", text=json.dumps(""))
+        sector = SectorFactory.create(id=101)
+        canteen = CanteenFactory.create(sectors=[sector])
+        CanteenFactory.create(sectors=[])
+        diagnostic = DiagnosticFactory.create(
+            canteen=canteen, year=2022, diagnostic_type=Diagnostic.DiagnosticType.SIMPLE
+        )
+        Teledeclaration.create_from_diagnostic(diagnostic, UserFactory.create())
+
+        for etl in [ETL_CANTEEN(), ETL_TD(2022)]:
+            etl.extract_dataset()
+            etl.transform_dataset()
+            self.assertTrue(etl.is_valid(), f"The dataset {etl.dataset_name} should match its schema")
+
+        etl.df["canteen_satellite_canteens_count"] = etl.df["canteen_satellite_canteens_count"].astype(object)
+        etl.df.loc[0, "canteen_satellite_canteens_count"] = "douze"
+        etl.df.loc[0, "canteen_sectors"] = "Scolaire"
+        etl.df = etl.df.drop(columns=["version"])
+        self.assertFalse(etl.is_valid())
+
+        report = validate_dataframe(etl.df, etl.schema)
+        self.assertEqual(report["stats"]["errors"], 3)
+        errors = {(error["type"], error["fieldName"]): error for error in report["tasks"][0]["errors"]}
+        self.assertIn(("missing-label", "version"), errors)
+        self.assertEqual(errors[("type-error", "canteen_satellite_canteens_count")]["rowNumbers"], [2])
+        self.assertEqual(errors[("type-error", "canteen_sectors")]["count"], 1)
+
+    def test_dataset_validation_constraints(self, mock):
+        schema = {
+            "fields": [
+                {"name": "id", "type": "integer", "constraints": {"required": True, "unique": True, "minimum": 1}},
+                {"name": "type", "type": "string", "constraints": {"enum": ["SIMPLE", "COMPLETE"]}},
+                {"name": "siret", "type": "string", "constraints": {"pattern": "[0-9]{14}"}},
+                {"name": "active", "type": "boolean"},
+            ]
+        }
+        df = pd.DataFrame(
+            {
+                "id": [1, 1, 0, None],
+                "type": ["SIMPLE", "COMPLETE", "OTHER", None],
+                "siret": ["12345678901234", "", "123", None],
+                "active": [True, "False", "oui", None],
+            }
+        )
+        report = validate_dataframe(df, schema)
+
+        self.assertFalse(report["valid"])
+        notes = {(error["fieldName"], error["note"]): error["rowNumbers"] for error in report["tasks"][0]["errors"]}
+        self.assertEqual(
+            notes,
+            {
+                ("id", 'constraint "required" is "True"'): [5],
+                ("id", 'constraint "unique" is "True"'): [2, 3],
+                ("id", 'constraint "minimum" is "1"'): [4],
+                ("type", "constraint \"enum\" is \"['SIMPLE', 'COMPLETE']\""): [4],
+                ("siret", 'constraint "pattern" is "[0-9]{14}"'): [4],
+                ("active", 'type is "boolean"'): [4],
+            },
+        )
+        self.assertTrue(validate_dataframe(df.iloc[:1], schema)["valid"])
+
+    def test_incremental_canteen_export(self, mock):
+        """
+        In incremental mode, only the canteens changed since the last export are extracted and merged with the previous export
+        """
+        mock.get("https://geo.api.gouv.fr/communes", text=json.dumps(""))
+        mock.get("https://geo.api.gouv.fr/epcis/?fields=nom", text=json.dumps(""))
+        canteen_modified = CanteenFactory.create(name="Ancien nom", sectors=[])
+        canteen_unchanged = CanteenFactory.create(sectors=[])
+        canteen_deleted = CanteenFactory.create(sectors=[])
+
+        etl = ETL_CANTEEN(incremental=True)
+        etl.dataset_name += "_test"  # Avoid interferring with other files
+        etl.extract_dataset()
+        self.assertEqual(etl.len_dataset(), 3, "Without a previous export, all the canteens are extracted")
+        etl.transform_dataset()
+        etl.load_dataset()
+        self.assertIsNotNone(etl.load_state())
+
+        canteen_modified.name = "Nouveau nom"
+        canteen_modified.save()
+        canteen_deleted.delete()
+        canteen_created = CanteenFactory.create(sectors=[])
+
+        etl = ETL_CANTEEN(incremental=True)
+        etl.dataset_name += "_test"
+        etl.extract_dataset()
+        self.assertCountEqual(
+            etl.df["id"], [canteen_modified.id, canteen_created.id], "Only the changes are extracted"
+        )
+        etl.transform_dataset()
+        canteens = etl.get_dataset()
+
+        self.assertCountEqual(canteens["id"], [canteen_modified.id, canteen_unchanged.id, canteen_created.id])
+        self.assertEqual(canteens[canteens.id == canteen_modified.id].iloc[0]["name"], "Nouveau nom")
+        self.assertTrue(canteens[canteens.id == canteen_unchanged.id].iloc[0]["active_on_ma_cantine"])
+        etl.load_dataset()
+
+        etl = ETL_CANTEEN(incremental=True)
+        etl.dataset_name += "_test"
+        etl.extract_dataset()
+        self.assertEqual(etl.len_dataset(), 0, "Nothing changed")
+        etl.transform_dataset()
+        self.assertEqual(etl.len_dataset(), 3, "The previous export is kept")
+        etl.load_dataset()
+
+        DiagnosticFactory.create(canteen=canteen_unchanged, year=2023)
+        etl = ETL_CANTEEN(incremental=True)
+        etl.dataset_name += "_test"
+        etl.extract_dataset()
+        self.assertCountEqual(etl.df["id"], [canteen_unchanged.id], "The canteens whose diagnostics changed")
+        etl.transform_dataset()
+        etl.load_dataset()
+
+        canteen_unchanged.sectors.add(SectorFactory.create())
+        etl = ETL_CANTEEN(incremental=True)
+        etl.dataset_name += "_test"
+        etl.extract_dataset()
+        self.assertEqual(
+            etl.len_dataset(), 3, "The changes of the sectors are not tracked, all canteens are extracted"
+        )
+
+        for file_extension in ["csv", "parquet", "xlsx"]:
+            default_storage.delete(f"open_data/{etl.dataset_name}.{file_extension}")
+        default_storage.delete(f"open_data/{etl.dataset_name}_state.json")
+
+    @freeze_time("2023-05-14")  # Faking time to mock creation_date
+    def test_incremental_td_export(self, mock):
+        """
+        In incremental mode, a TD dataset is not exported again if none of its teledeclarations changed
+        """
+        mock.get("https://geo.api.gouv.fr/communes", text=json.dumps(""))
+        mock.get("https://geo.api.gouv.fr/epcis/?fields=nom", text=json.dumps(""))
+        canteen = CanteenFactory.create()
+        applicant = UserFactory.create()
+        diagnostic = DiagnosticFactory.create(canteen=canteen, year=2022, diagnostic_type=None)
+        Teledeclaration.create_from_diagnostic(diagnostic, applicant)
+
+        etl = ETL_TD(2022, incremental=True)
+        etl.dataset_name += "_test"  # Avoid interferring with other files
+        self.assertFalse(etl.is_up_to_date(), "The dataset has never been exported")
+        etl.extract_dataset()
+        etl.transform_dataset()
+        etl.load_dataset()
+
+        etl = ETL_TD(2022, incremental=True)
+        etl.dataset_name += "_test"
+        self.assertTrue(etl.is_up_to_date())
+        self.assertFalse(ETL_TD(2022).is_up_to_date(), "A full export is always done if not incremental")
+
+        other_diagnostic = DiagnosticFactory.create(canteen=CanteenFactory.create(), year=2022, diagnostic_type=None)
+        Teledeclaration.create_from_diagnostic(other_diagnostic, applicant)
+        self.assertFalse(etl.is_up_to_date(), "A new teledeclaration has been submitted")
+
+        for file_extension in ["csv", "parquet", "xlsx"]:
+            default_storage.delete(f"open_data/{etl.dataset_name}.{file_extension}")
+        default_storage.delete(f"open_data/{etl.dataset_name}_state.json")
@@ -0,0 +1,166 @@
+import json
+from unittest.mock import patch
+import pandas as pd
+import requests_mock
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from data.factories import CanteenFactory
+from data.models import Canteen
+from macantine.etl import ETL_CANTEEN
+from macantine.geo import (
+    GEO_REFERENTIAL_PATH,
+    GEO_REFERENTIAL_TOKEN_KEY,
+    GeoReferential,
+    clear_geo_referential_cache,
+    get_geo_referential,
+    save_geo_referential,
+)
+
+
+@requests_mock.Mocker()
+class TestGeoReferential(TestCase):
+    communes = [
+        {"code": "29021", "codeDepartement": "29", "codeRegion": "53", "codeEpci": "242900793"},
+        {"code": "29022", "codeDepartement": "29", "codeRegion": "53", "codeEpci": "242900793"},
+        {"code": "01002", "codeDepartement": "01", "codeRegion": "84"},
+    ]
+    epcis = [{"nom": "CC Communauté Lesneven Côte des Légendes", "code": "242900793"}]
+
+    def setUp(self):
+        clear_geo_referential_cache()
+
+    def tearDown(self):
+        default_storage.delete(GEO_REFERENTIAL_PATH)
+        clear_geo_referential_cache()
+
+    def _mock_geo_api(self, mock):
+        mock.get("https://geo.api.gouv.fr/communes", text=json.dumps(self.communes))
+        mock.get("https://geo.api.gouv.fr/epcis/?fields=nom", text=json.dumps(self.epcis))
+
+    def test_refresh_command(self, mock):
+        self._mock_geo_api(mock)
+        call_command("refresh_geo_referential")
+
+        self.assertTrue(default_storage.exists(GEO_REFERENTIAL_PATH))
+        clear_geo_referential_cache()  # Making sure the referential is read from the snapshot
+        referential = get_geo_referential()
+        self.assertIsNotNone(referential.version)
+        self.assertEqual(referential.department("29021"), "29")
+        self.assertEqual(referential.region("29021"), "53")
+        self.assertEqual(referential.epci("29021"), "242900793")
+        self.assertIsNone(referential.epci("01002"), "Not all cities are part of an EPCI")
+        self.assertIsNone(referential.department("00000"))
+        self.assertIsNone(referential.department(None))
+        self.assertEqual(referential.epci_name("242900793"), "CC Communauté Lesneven Côte des Légendes")
+        self.assertCountEqual(referential.communes_in_epci("242900793"), ["29021", "29022"])
+
+    def test_refresh_command_canteen_epcis(self, mock):
+        """
+        The canteens store the EPCI of their commune, updated when the referential is refreshed
+        """
+        in_epci = CanteenFactory.create(city_insee_code="29021")
+        moved = CanteenFactory.create(city_insee_code="01002")
+        Canteen.objects.filter(id=moved.id).update(epci="242900793")
+        self.assertIsNone(in_epci.epci, "No referential yet")
+
+        self._mock_geo_api(mock)
+        call_command("refresh_geo_referential")
+        in_epci.refresh_from_db()
+        moved.refresh_from_db()
+        self.assertEqual(in_epci.epci, "242900793")
+        self.assertIsNone(moved.epci)
+
+        moved.city_insee_code = "29022"
+        moved.save()
+        self.assertEqual(moved.epci, "242900793")
+
+        # The referential is only read when the commune changes
+        with patch("data.models.canteen.get_geo_referential") as get_geo_referential:
+            moved.name = "Nouveau nom"
+            moved.save()
+            Canteen.objects.get(id=moved.id).save()
+        get_geo_referential.assert_not_called()
+
+    def test_refresh_command_api_error(self, mock):
+        """
+        The current snapshot should be kept if the API is down
+        """
+        save_geo_referential(GeoReferential("2024-01-01", {"29021": ("29", "53", None)}, {}))
+        mock.get("https://geo.api.gouv.fr/communes", status_code=500)
+
+        with self.assertRaises(CommandError):
+            call_command("refresh_geo_referential")
+
+        clear_geo_referential_cache()
+        self.assertEqual(get_geo_referential().version, "2024-01-01")
+
+    def test_no_snapshot(self, _):
+        self.assertIsNone(get_geo_referential())
+
+        # The absence of snapshot is remembered rather than checked again in the storage on each canteen save
+        with patch.object(default_storage, "exists", wraps=default_storage.exists) as exists:
+            self.assertIsNone(get_geo_referential())
+            CanteenFactory.create(city_insee_code="29021")
+        exists.assert_not_called()
+
+    @override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+    def test_snapshot_saved_by_another_process(self, _):
+        """
+        A process reloads the snapshot once another one, e.g. the worker refreshing it, saved a new one
+        """
+        self.assertIsNone(get_geo_referential())
+        referential = GeoReferential("2024-01-02", {"29021": ("29", "53", "242900793")}, {})
+        default_storage.save(GEO_REFERENTIAL_PATH, ContentFile(json.dumps(referential.to_dict()).encode("utf-8")))
+        self.assertIsNone(get_geo_referential(), "The token is unchanged")
+
+        cache.set(GEO_REFERENTIAL_TOKEN_KEY, "token", timeout=None)
+        self.assertEqual(get_geo_referential().version, "2024-01-02")
+        self.assertEqual(CanteenFactory.create(city_insee_code="29021").epci, "242900793")
+
+    def test_etl_uses_snapshot(self, mock):
+        """
+        The ETL should not call the geo API when a snapshot exists
+        """
+        self._mock_geo_api(mock)
+        call_command("refresh_geo_referential")
+        mock.reset_mock()
+
+        etl_canteen = ETL_CANTEEN()
+        etl_canteen.df = pd.DataFrame(
+            {
+                "id": [1, 2],
+                "name": ["Cantine", "Autre cantine"],
+                "city_insee_code": ["29021", "75056"],
+                "department": [None, None],
+                "region": [None, None],
+                "sectors": [None, None],
+            }
+        )
+        etl_canteen.transform_dataset()
+        canteens = etl_canteen.get_dataset()
+
+        geo_api_calls = [r for r in mock.request_history if "geo.api.gouv.fr" in r.url]
+        self.assertEqual(len(geo_api_calls), 0)
+        self.assertEqual(canteens[canteens.id == 1].iloc[0]["epci"], "242900793")
+        self.assertEqual(canteens[canteens.id == 1].iloc[0]["epci_lib"], "CC Communauté Lesneven Côte des Légendes")
+        self.assertIsNone(canteens[canteens.id == 2].iloc[0]["epci"])
+
+    def test_canteen_statistics_epci(self, mock):
+        self._mock_geo_api(mock)
+        call_command("refresh_geo_referential")
+        mock.reset_mock()
+
+        CanteenFactory.create(city_insee_code="29021", publication_status=Canteen.PublicationStatus.PUBLISHED)
+        CanteenFactory.create(city_insee_code="29022", publication_status=Canteen.PublicationStatus.PUBLISHED)
+        CanteenFactory.create(city_insee_code="01002", publication_status=Canteen.PublicationStatus.PUBLISHED)
+
+        response = self.client.get(reverse("canteen_statistics"), {"year": 2021, "epci": ["242900793"]})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["canteenCount"], 2)
+        self.assertFalse(mock.called)